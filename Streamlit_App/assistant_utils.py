@@ -1,16 +1,91 @@
 # assistant_utils.py
 
 import streamlit as st
-from openai import OpenAI
 import os
-from datetime import datetime, timedelta
+import re
+import hashlib
+import threading
+from datetime import date, timedelta
 import pandas as pd
-
-# Initialize the OpenAI client with your API key
-api_key = os.getenv('OPENAI_API_KEY', 'YOUR_API_KEY')  # Replace with your actual API key
-client = OpenAI(api_key=api_key)
-
-def ai_assistant_interaction(model, generate_forecast_function):
+from cache_utils import ResultCache
+from chat_utils import ASSISTANT_MODEL, make_chat_backend
+from perf_utils import span
+from context_utils import (
+    CONTEXT_TOKEN_BUDGET,
+    PROMPT_VERSION,
+    build_prompt,
+    encode_forecast_context,
+    prompt_token_summary,
+)
+
+# Assistant answers and forecast summaries kept for repeated questions
+ASSISTANT_CACHE_SIZE = int(os.getenv('ASSISTANT_CACHE_SIZE', '256'))
+ASSISTANT_CACHE_TTL = float(os.getenv('ASSISTANT_CACHE_TTL', '3600'))
+
+# Days of forecast summarized for the assistant
+CONTEXT_DAYS = 180
+
+# One backend per server process (set ASSISTANT_BACKEND to switch); the OpenAI client is created on first use
+@st.cache_resource
+def get_chat_backend():
+    return make_chat_backend()
+
+# Answers shared across sessions, keyed by question, prompt and forecast context
+@st.cache_resource
+def get_response_cache():
+    return ResultCache(max_entries=ASSISTANT_CACHE_SIZE, ttl=ASSISTANT_CACHE_TTL)
+
+# Forecast summaries shared across sessions, keyed by the model artifact and the date range
+@st.cache_resource
+def get_context_cache():
+    return ResultCache(max_entries=ASSISTANT_CACHE_SIZE, ttl=ASSISTANT_CACHE_TTL)
+
+# Questions differing only in case, spacing or trailing punctuation share an answer
+def normalize_question(question):
+    return re.sub(r'\s+', ' ', question).strip().rstrip('?!. ').lower()
+
+def fingerprint(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+# Forecast summary for the assistant. The key holds the artifact token, so a retrained model
+# misses and the summaries of its previous artifact are dropped. Each call is one counted lookup.
+def cached_forecast_context(version, version_token, generate_forecast_function):
+    start_date = date.today()
+    end_date = start_date + timedelta(days=CONTEXT_DAYS)
+    cache = get_context_cache()
+    key = (version_token, start_date, end_date, CONTEXT_TOKEN_BUDGET)
+
+    # Only runs on a miss
+    def encode():
+        cache.invalidate(lambda cached: cached[0].partition('@')[0] == version and cached[0] != version_token)
+        forecast_df = generate_forecast_function(start_date, end_date, version)
+        return encode_forecast_context(forecast_df) if forecast_df is not None else None
+
+    return cache.get_or_compute(key, encode) or ""
+
+# Key of an answer: the question, the chat model and prompt format, and the rest of the prompt
+# (forecast summary and earlier turns), so answers never cross differing contexts
+def response_cache_key(question, messages):
+    context = '\n'.join(f"{message['role']}:{message['content']}" for message in messages[:-1])
+    return (normalize_question(question), ASSISTANT_MODEL, PROMPT_VERSION, fingerprint(context))
+
+# Stream a reply into a placeholder as it arrives. A rerun (e.g. the Stop button) interrupts the
+# script inside the loop; the stream is then closed and parts holds the partial reply.
+def stream_response(messages, placeholder, parts):
+    cancel = threading.Event()
+    chunks = get_chat_backend().stream(messages, cancel)
+    try:
+        with span('assistant_api_call', backend=get_chat_backend().name):
+            for chunk in chunks:
+                parts.append(chunk)
+                placeholder.markdown(''.join(parts) + "▌")
+    finally:
+        cancel.set()
+        chunks.close()
+        placeholder.markdown(''.join(parts))
+    return ''.join(parts)
+
+def ai_assistant_interaction(model, generate_forecast_function, version_token_function):
     st.subheader("Chat with AI Assistant")
 
     st.write("""
@@ -33,7 +108,7 @@ def ai_assistant_interaction(model, generate_forecast_function):
         ]
         st.session_state["user_input"] = ""
         st.session_state["selected_question"] = ""
-        st.sidebar.success("Chat history cleared. You can start a new conversation.")
+        st.success("Chat history cleared. You can start a new conversation.")
 
     # Question options and user input for the chat
     question_options = [
@@ -59,44 +134,52 @@ def ai_assistant_interaction(model, generate_forecast_function):
 
                 forecast_text = ""
                 if include_prediction:
-                    start_date = datetime.today()
-                    end_date = start_date + timedelta(days=180)
-                    # Generate forecast for "All Products"
-                    forecast_df = generate_forecast_function(start_date, end_date, "All Products", model)
-                    if forecast_df is not None:
-                        # Calculate cumulative forecast
-                        forecast_df = forecast_df.sort_values('Date')
-                        forecast_df['Cumulative Forecast'] = forecast_df['Forecast'].cumsum()
-
-                        # Prepare profit/loss information
-                        profit_loss = forecast_df['Forecast'].apply(lambda x: 'Profit' if x >= 0 else 'Loss')
-                        forecast_df['Profit/Loss'] = profit_loss
-
-                        # Prepare forecast text including cumulative forecast, profit/loss, and resource requirement
-                        forecast_text = "\nPredicted Sales and Resource Allocation:\n" + forecast_df[['Date', 'Forecast', 'Resource Requirement', 'Cumulative Forecast', 'Profit/Loss']].to_string(index=False)
-                        # Include summary statistics
-                        total_forecast = forecast_df['Forecast'].sum()
-                        total_cumulative = forecast_df['Cumulative Forecast'].iloc[-1]
-                        total_resource = forecast_df['Resource Requirement'].sum()
-                        forecast_summary = f"\nTotal Forecasted Sales: {total_forecast:.2f}\nTotal Cumulative Sales: {total_cumulative:.2f}\nTotal Resource Requirement (Staff Hours): {total_resource:.2f}"
-                        forecast_text += forecast_summary
-
-                # Prepare the messages for the OpenAI API
-                messages = st.session_state["conversation_history"].copy()
-                if forecast_text:
-                    # Include forecast and resource allocation data in the assistant's context
-                    messages.append({"role": "system", "content": f"Here is the latest forecast and resource allocation data:\n{forecast_text}"})
-
-                # Call OpenAI API
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=messages
+                    # Compact per-product summary of the forecast for every product
+                    forecast_text = cached_forecast_context(model, version_token_function(model), generate_forecast_function)
+
+                # Prepare the messages within the prompt budget and record their size
+                messages, prompt_stats = build_prompt(st.session_state["conversation_history"], forecast_text)
+                st.session_state.setdefault("prompt_token_log", []).append(prompt_stats)
+                st.caption(
+                    f"Prompt: {prompt_stats['prompt_tokens']} tokens "
+                    f"({prompt_stats['history_messages']} messages kept, {prompt_stats['dropped_messages']} summarized)"
                 )
 
-                gpt_response = response.choices[0].message.content if response.choices else "No response received."
-
-                st.session_state["conversation_history"].append({"role": "assistant", "content": gpt_response})
-
-                st.text_area("AI Assistant Response:", value=gpt_response, height=150)
+                # Repeated questions in the same context are answered from the cache
+                cache = get_response_cache()
+                key = response_cache_key(query, messages)
+                cached_response = cache.get(key)
+                st.write("AI Assistant Response:")
+                if cached_response is not None:
+                    st.markdown(cached_response)
+                    st.session_state["conversation_history"].append({"role": "assistant", "content": cached_response})
+                else:
+                    # Stream the reply; Stop reruns the script, which ends the request early
+                    st.button("Stop", key="stop_response")
+                    placeholder = st.empty()
+                    parts = []
+                    completed = False
+                    try:
+                        stream_response(messages, placeholder, parts)
+                        completed = True
+                    except Exception as e:
+                        st.error(f"The assistant could not answer: {e}")
+                    finally:
+                        # Interrupted replies are kept as far as they got, but only complete ones are cached
+                        if parts:
+                            st.session_state["conversation_history"].append({"role": "assistant", "content": ''.join(parts)})
+                        if completed and parts:
+                            cache.put(key, ''.join(parts))
         else:
-            st.warning("Please select a question or type your own to send.")
\ No newline at end of file
+            st.warning("Please select a question or type your own to send.")
+
+    # Prompt sizes of this session, for tracking what the budget saves
+    if st.session_state.get("prompt_token_log"):
+        with st.expander("Prompt token usage"):
+            st.json(prompt_token_summary(st.session_state["prompt_token_log"]))
+
+# Assistant cache usage in the sidebar; drawn by the main script, since the assistant view runs as a
+# fragment and fragments cannot write to the sidebar
+def assistant_cache_panel():
+    with st.sidebar.expander("Assistant cache"):
+        st.json({'answers': get_response_cache().stats(), 'forecast_context': get_context_cache().stats()})
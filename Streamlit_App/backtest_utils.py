@@ -0,0 +1,303 @@
+# backtest_utils.py
+#
+# Rolling-origin cross-validation of the monthly sales series, spread across a process pool:
+#
+#     python backtest_utils.py --models arima linear forest naive --horizon 3 --workers 8
+#
+# Every origin trains on the months before it and forecasts the next `horizon` months. Each
+# (series, model) pair is one task that walks its origins in order, so the ARIMA fitted at the
+# first origin is carried forward with incremental updates instead of a new order search. Fitted
+# fold models are cached on disk keyed by their training data, so backtesting again after new
+# months arrive only fits the new origins.
+
+import os
+import time
+import hashlib
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import joblib
+import numpy as np
+import pandas as pd
+from data_utils import SALES_CSV
+from cube_utils import load_sales_cube
+from train_utils import (DEFAULT_ARIMA_PARAMS, MIN_OBSERVATIONS, build_series, has_enough_observations,
+                         series_file_name, write_json)
+
+# Where fitted fold models are cached, one sub-directory per series and model
+BACKTEST_CACHE_DIR = os.getenv('BACKTEST_CACHE_DIR', 'backtest_cache')
+
+# Fold models unused for this many days are pruned after each run, then the least recently used
+# ones until the cache fits in the size cap
+BACKTEST_CACHE_MAX_AGE_DAYS = float(os.getenv('BACKTEST_CACHE_MAX_AGE_DAYS', '30'))
+BACKTEST_CACHE_MAX_MB = float(os.getenv('BACKTEST_CACHE_MAX_MB', '1024'))
+
+# Months in the first training window (the seasonal differencing test needs three seasons),
+# months forecast from each origin, and months between origins
+MIN_TRAIN_MONTHS = 36
+HORIZON = 3
+STEP = 1
+
+# Lagged month-over-month differences used as features by the regression models, as in the notebook
+REGRESSION_LAGS = 12
+
+# Trees of the random forest
+FOREST_TREES = 100
+
+BACKTEST_MODELS = ('arima', 'linear', 'forest', 'naive')
+
+# Models fitted once per fold; the naive forecast has nothing to fit or cache
+FITTED_MODELS = ('arima', 'linear', 'forest')
+
+SEASON = 12
+
+# Origins (training lengths) of a rolling-origin backtest over n_obs months
+def rolling_origins(n_obs, min_train=MIN_TRAIN_MONTHS, horizon=HORIZON, step=STEP):
+    return list(range(min_train, n_obs - horizon + 1, step))
+
+# Cache file of a fold: the model, its parameters and the exact training data it saw
+def fold_cache_path(cache_dir, key, model_name, params, train):
+    digest = hashlib.sha1(f"{model_name}:{sorted(params.items())}".encode('utf-8'))
+    digest.update(np.ascontiguousarray(train, dtype=float).tobytes())
+    series_dir = os.path.splitext(series_file_name(key))[0]
+    return os.path.join(cache_dir, series_dir, model_name, f"{len(train)}_{digest.hexdigest()[:16]}.pkl")
+
+# Seasonal naive: the value one season earlier, or the last value for short series
+def naive_forecast(train, horizon):
+    if len(train) >= SEASON:
+        return np.resize(train[-SEASON:], SEASON * (horizon // SEASON + 1))[:horizon]
+    return np.full(horizon, train[-1])
+
+# Rows of lagged differences and the difference that followed each of them
+def lag_features(train, lags=REGRESSION_LAGS):
+    diff = np.diff(train)
+    X = np.column_stack([diff[lags - lag:len(diff) - lag] for lag in range(1, lags + 1)])
+    return X, diff[lags:]
+
+def fit_regression(model_name, train, lags=REGRESSION_LAGS):
+    from sklearn.linear_model import LinearRegression
+    from sklearn.ensemble import RandomForestRegressor
+
+    X, y = lag_features(train, lags)
+    if model_name == 'forest':
+        return RandomForestRegressor(n_estimators=FOREST_TREES, random_state=0).fit(X, y)
+    return LinearRegression().fit(X, y)
+
+# Recursive forecast of the differences, added back onto the last training month
+def regression_forecast(model, train, horizon, lags=REGRESSION_LAGS):
+    recent = list(np.diff(train)[-lags:])
+    diffs = np.empty(horizon)
+    for h in range(horizon):
+        diffs[h] = model.predict(np.array(recent[::-1][:lags])[None, :])[0]
+        recent.append(diffs[h])
+    return train[-1] + np.cumsum(diffs)
+
+# Fitted model of a fold: the cached one, else the previous origin's ARIMA updated with the
+# months in between, else a fresh fit. Returns the model and how it was obtained.
+def fold_model(model_name, train, previous, cache_path, arima_params):
+    import pmdarima as pm
+
+    if cache_path and os.path.exists(cache_path):
+        model = joblib.load(cache_path)
+        # Mark the file as recently used so pruning keeps it
+        os.utime(cache_path)
+        return model, 'cached'
+    if model_name == 'arima' and previous is not None:
+        model, previous_origin = previous
+        model.update(train[previous_origin:])
+        how = 'updated'
+    elif model_name == 'arima':
+        model = pm.auto_arima(train, **arima_params)
+        how = 'fitted'
+    else:
+        model = fit_regression(model_name, train)
+        how = 'fitted'
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        joblib.dump(model, cache_path)
+    return model, how
+
+# Delete cached fold models not used within max_age_days, then the least recently used ones until
+# the cache is at most max_mb. Models of superseded training data are never hit again, so they age out.
+def prune_fold_cache(cache_dir, max_age_days=BACKTEST_CACHE_MAX_AGE_DAYS, max_mb=BACKTEST_CACHE_MAX_MB):
+    files = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            if name.endswith('.pkl'):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    cutoff = time.time() - max_age_days * 86400
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= max_mb * 2 ** 20:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+
+    # Series and model directories left empty
+    for root, _, _ in os.walk(cache_dir, topdown=False):
+        if root != cache_dir and not os.listdir(root):
+            os.rmdir(root)
+    return {'removed': removed, 'kept': len(files) - removed, 'megabytes': round(total / 2 ** 20, 2)}
+
+# RMSE, MAE and R² of the forecasts of every fold pooled together
+def forecast_scores(actual, predicted):
+    from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+
+    actual, predicted = np.concatenate(actual), np.concatenate(predicted)
+    return {
+        'rmse': float(np.sqrt(mean_squared_error(actual, predicted))),
+        'mae': float(mean_absolute_error(actual, predicted)),
+        # R² is undefined when the actual values do not vary
+        'r2': float(r2_score(actual, predicted)) if np.ptp(actual) > 0 else None,
+    }
+
+# Backtest one model on one series in a worker process; errors are returned instead of raised
+# so one bad series cannot stop the run
+def backtest_series(key, values, model_name, origins, horizon, arima_params, cache_dir):
+    start = time.perf_counter()
+    result = {'key': key, 'model': model_name, 'folds': len(origins), 'fitted': 0, 'updated': 0, 'cached': 0,
+              'fit_seconds': 0.0, 'predict_seconds': 0.0}
+    try:
+        # Orders are searched once per chain of origins, so the first origin is part of every fold's identity
+        params = {**arima_params, 'search_origin': origins[0]} if model_name == 'arima' else {'lags': REGRESSION_LAGS}
+        actual, predicted = [], []
+        previous = None
+        for origin in origins:
+            train = values[:origin]
+            if model_name in FITTED_MODELS:
+                fit_start = time.perf_counter()
+                cache_path = fold_cache_path(cache_dir, key, model_name, params, train) if cache_dir else None
+                model, how = fold_model(model_name, train, previous, cache_path, arima_params)
+                result[how] += 1
+                result['fit_seconds'] += time.perf_counter() - fit_start
+
+            predict_start = time.perf_counter()
+            if model_name == 'arima':
+                forecast = np.asarray(model.predict(n_periods=horizon), dtype=float)
+                previous = (model, origin)
+            elif model_name in FITTED_MODELS:
+                forecast = regression_forecast(model, train, horizon)
+            else:
+                forecast = naive_forecast(train, horizon)
+            result['predict_seconds'] += time.perf_counter() - predict_start
+
+            actual.append(values[origin:origin + horizon])
+            predicted.append(forecast)
+        return {**result, **forecast_scores(actual, predicted), 'seconds': time.perf_counter() - start, 'error': None}
+    except Exception:
+        return {**result, 'seconds': time.perf_counter() - start, 'error': traceback.format_exc()}
+
+# Backtest every model on every series with enough history. Returns one row per series and model
+# plus the run's wall time and the summed worker time it was spread across.
+def run_backtest(csv_path=SALES_CSV, by_store=False, models=BACKTEST_MODELS, min_train=MIN_TRAIN_MONTHS,
+                 horizon=HORIZON, step=STEP, max_workers=None, cache_dir=BACKTEST_CACHE_DIR,
+                 arima_params=None, series_keys=None, min_observations=MIN_OBSERVATIONS,
+                 cache_max_age_days=BACKTEST_CACHE_MAX_AGE_DAYS, cache_max_mb=BACKTEST_CACHE_MAX_MB):
+    arima_params = {**DEFAULT_ARIMA_PARAMS, **(arima_params or {})}
+    unknown = set(models) - set(BACKTEST_MODELS)
+    if unknown:
+        raise ValueError(f"Unknown backtest models: {', '.join(sorted(unknown))}")
+
+    series, _ = build_series(load_sales_cube(csv_path), by_store=by_store)
+    if series_keys is not None:
+        series = {key: series[key] for key in series_keys}
+    run_start = time.perf_counter()
+    results, skipped = [], {}
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        futures = []
+        # The ARIMA tasks take longest, so they are queued first to keep the workers busy at the end
+        for model_name in sorted(models, key=lambda name: name != 'arima'):
+            for key, values in series.items():
+                origins = rolling_origins(len(values), min_train, horizon, step)
+                if not origins:
+                    skipped[key] = f'fewer than {min_train + horizon} months'
+                    continue
+                if not has_enough_observations(values, min_observations):
+                    skipped[key] = f'fewer than {min_observations} months with sales'
+                    continue
+                futures.append(pool.submit(backtest_series, key, values.to_numpy(dtype=float), model_name,
+                                           origins, horizon, arima_params, cache_dir))
+
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    results.sort(key=lambda row: (row['key'], row['model']))
+    cache = prune_fold_cache(cache_dir, cache_max_age_days, cache_max_mb) if cache_dir else None
+    return {
+        'min_train': min_train,
+        'horizon': horizon,
+        'step': step,
+        'models': list(models),
+        'wall_seconds': round(time.perf_counter() - run_start, 4),
+        'worker_seconds': round(sum(row['seconds'] for row in results), 4),
+        'results': results,
+        'skipped': skipped,
+        'cache': cache,
+    }
+
+# Median scores and total time per model over the series that backtested without errors; the
+# median keeps a few diverging series from hiding how a model does on the rest
+def summarize_backtest(backtest):
+    frame = pd.DataFrame(backtest['results'])
+    if frame.empty:
+        return frame
+    ok = frame[frame['error'].isna()]
+    summary = ok.groupby('model').agg(
+        series=('key', 'count'),
+        rmse=('rmse', 'median'),
+        mae=('mae', 'median'),
+        r2=('r2', 'median'),
+        seconds=('seconds', 'sum'),
+        fitted=('fitted', 'sum'),
+        updated=('updated', 'sum'),
+        cached=('cached', 'sum'),
+    )
+    summary['failed'] = frame[frame['error'].notna()].groupby('model').size().reindex(summary.index, fill_value=0)
+    return summary.sort_values('rmse')
+
+def main():
+    parser = argparse.ArgumentParser(description='Rolling-origin backtests of the monthly sales models.')
+    parser.add_argument('--csv', default=SALES_CSV, help='transactions CSV')
+    parser.add_argument('--by-store', action='store_true', help='also backtest the item and store series')
+    parser.add_argument('--models', nargs='+', default=list(BACKTEST_MODELS), choices=BACKTEST_MODELS,
+                        help='models to backtest')
+    parser.add_argument('--series', nargs='+', default=None, help='series keys to backtest (default: all)')
+    parser.add_argument('--min-train', type=int, default=MIN_TRAIN_MONTHS, help='months in the first training window')
+    parser.add_argument('--horizon', type=int, default=HORIZON, help='months forecast from each origin')
+    parser.add_argument('--step', type=int, default=STEP, help='months between origins')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--cache-dir', default=BACKTEST_CACHE_DIR, help='fold model cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='fit every fold without reading or writing the cache')
+    parser.add_argument('--cache-max-age-days', type=float, default=BACKTEST_CACHE_MAX_AGE_DAYS,
+                        help='prune cached fold models unused for this many days')
+    parser.add_argument('--cache-max-mb', type=float, default=BACKTEST_CACHE_MAX_MB,
+                        help='prune the least recently used fold models past this size')
+    parser.add_argument('--output', default=None, help='write the per-series results to this JSON or CSV file')
+    args = parser.parse_args()
+
+    backtest = run_backtest(args.csv, by_store=args.by_store, models=args.models, min_train=args.min_train,
+                            horizon=args.horizon, step=args.step, max_workers=args.workers,
+                            cache_dir=None if args.no_cache else args.cache_dir, series_keys=args.series,
+                            cache_max_age_days=args.cache_max_age_days, cache_max_mb=args.cache_max_mb)
+    if args.output and args.output.endswith('.csv'):
+        pd.DataFrame(backtest['results']).to_csv(args.output, index=False)
+    elif args.output:
+        write_json(args.output, backtest)
+
+    summary = summarize_backtest(backtest)
+    print(summary.to_string(float_format=lambda value: f"{value:,.3f}") if not summary.empty else "No series to backtest")
+    print(f"series skipped: {len(backtest['skipped'])}  wall time: {backtest['wall_seconds']:.1f}s  "
+          f"worker time: {backtest['worker_seconds']:.1f}s")
+    if backtest['cache']:
+        cache = backtest['cache']
+        print(f"fold cache: {cache['kept']} models, {cache['megabytes']:.1f} MB, {cache['removed']} pruned")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+# bench_utils.py
+#
+# Headless benchmarks of the forecasting, aggregation and rendering paths on synthetic
+# transaction files shaped like Extended_Fashion_Retail_Sales.csv, at multiples of its size:
+#
+#     python bench_utils.py --scales 1 10 100 --output bench_results.json
+#     python bench_utils.py --scales 1 10 100 --baseline bench_baseline.json
+#
+# Results are written as JSON. Against a baseline, any benchmark slower than the baseline by
+# more than --tolerance fails the run with exit status 1.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import numpy as np
+import pandas as pd
+from cube_utils import SalesCube, stream_sales_cube
+from data_utils import DATE_FORMAT, ITEM_CATEGORIES, build_sales_cache, load_sales_columns, load_sales_data
+from forecast_utils import ALL_PRODUCTS, generate_batch_forecast, split_batch_forecast
+from figure_utils import (
+    aggregate_heatmap,
+    build_aggregated_forecast_figure,
+    build_cumulative_sales_figure,
+    build_historical_sales_figure,
+    build_resource_allocation_figure,
+    build_sales_heatmap_figure,
+    heatmap_row_labels,
+)
+from statespace_utils import StateSpaceBatch
+from train_utils import DEFAULT_ARIMA_PARAMS, build_series, fit_series
+
+# Rows of Extended_Fashion_Retail_Sales.csv, the 1x scale
+BASE_ROWS = 68400
+
+BENCH_DIR = os.getenv('BENCH_DIR', '.bench_data')
+
+# Rows generated and written per step, so large scales need bounded memory
+GENERATE_CHUNK_ROWS = 500_000
+
+# Scales above this are only ingested by streaming; the whole-file paths would not fit in memory
+MAX_IN_MEMORY_SCALE = 100
+
+PAYMENT_METHODS = ['Credit Card', 'Cash', 'Debit Card', 'Online Payment']
+DATE_RANGE = ('2019-01-01', '2023-12-31')
+
+# Forecast batch sizes and horizons (months)
+PRODUCT_COUNTS = (1, 10, 100, 1000)
+HORIZONS = (3, 12, 24)
+
+# Catalog sizes forecast by the vectorized state space engine, and the distinct fitted models they repeat
+STATE_SPACE_SERIES = (100, 1000, 5000)
+STATE_SPACE_MODELS = 8
+
+# Largest relative difference allowed between the vectorized and per-model forecasts
+EQUIVALENCE_TOLERANCE = 1e-6
+
+DEFAULT_TOLERANCE = 0.25
+
+# Slowdowns smaller than this (seconds) are timer noise, never regressions
+NOISE_FLOOR = 0.002
+
+# Transactions with the columns, value ranges and missing-value rates of the sales extract
+def synthetic_transactions(n_rows, rng, n_stores=10):
+    items = [item for category in ITEM_CATEGORIES.values() for item in category]
+    days = pd.date_range(*DATE_RANGE, freq='D')
+    amount = np.round(rng.gamma(2.0, 55.0, n_rows) + 10, 0)
+    sales_per_item = np.round(amount * rng.uniform(0.3, 1.0, n_rows), 0)
+    df = pd.DataFrame({
+        'Customer Reference ID': rng.integers(3000, 5001, n_rows),
+        'Item Purchased': np.asarray(items, dtype=object)[rng.integers(0, len(items), n_rows)],
+        'Purchase Amount (USD)': amount,
+        'Date Purchase': days[rng.integers(0, len(days), n_rows)].strftime(DATE_FORMAT),
+        'Review Rating': np.round(rng.uniform(1.0, 5.0, n_rows), 1),
+        'Payment Method': np.asarray(PAYMENT_METHODS, dtype=object)[rng.integers(0, len(PAYMENT_METHODS), n_rows)],
+        'Sales per Item': sales_per_item,
+        'Store ID': rng.integers(1, n_stores + 1, n_rows).astype(float),
+    })
+    # Missing values at the rates of the real extract
+    df.loc[rng.random(n_rows) < 0.0095, 'Purchase Amount (USD)'] = np.nan
+    df.loc[rng.random(n_rows) < 0.0047, 'Review Rating'] = np.nan
+    no_store = rng.random(n_rows) < 0.049
+    df.loc[no_store, ['Sales per Item', 'Store ID']] = np.nan
+    return df
+
+# Synthetic transactions file at a multiple of the extract's size, generated once and reused
+def synthetic_sales_csv(scale, directory=BENCH_DIR, seed=0):
+    path = os.path.join(directory, f"sales_x{scale}.csv")
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed + scale)
+    remaining = BASE_ROWS * scale
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', newline='') as f:
+        header = True
+        while remaining > 0:
+            n_rows = min(remaining, GENERATE_CHUNK_ROWS)
+            synthetic_transactions(n_rows, rng).to_csv(f, index=False, header=header)
+            header = False
+            remaining -= n_rows
+    os.replace(tmp_path, path)
+    return path
+
+# Best and median wall time of repeated calls; the last result is returned for later steps
+def measure(func, repeats):
+    times = []
+    result = None
+    for _ in range(repeats):
+        began = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - began)
+    return result, {'best_seconds': min(times), 'median_seconds': float(np.median(times)), 'repeats': repeats}
+
+class BenchRun:
+    def __init__(self, repeats=3):
+        self.repeats = repeats
+        self.results = []
+
+    # Cheap benchmarks get an untimed warm-up call (lazy imports, first-use caches); expensive ones
+    # pass repeats=1 and are timed cold
+    def run(self, name, func, repeats=None, rows=None, **params):
+        if repeats is None:
+            func()
+        result, timing = measure(func, repeats or self.repeats)
+        record = {'benchmark': name, 'params': params, **timing}
+        if rows:
+            record['rows'] = int(rows)
+            record['rows_per_second'] = rows / timing['best_seconds'] if timing['best_seconds'] else None
+        self.results.append(record)
+        print(f"{name:<32} {json.dumps(params):<40} {timing['best_seconds'] * 1000:10.1f} ms", file=sys.stderr)
+        return result
+
+# Ingestion and monthly aggregation of one synthetic file
+def bench_data(run, scale, memory_budget_mb):
+    csv_path = synthetic_sales_csv(scale)
+    rows = BASE_ROWS * scale
+    cube, _ = run.run('ingest_stream_cube', lambda: stream_sales_cube(csv_path, memory_budget_mb=memory_budget_mb),
+                      repeats=1, rows=rows, scale=scale)
+    run.run('monthly_sales_cube', cube.monthly_sales, rows=rows, scale=scale)
+    run.run('item_month_rollup', lambda: cube.rollup(('item', 'month')), rows=rows, scale=scale)
+
+    if scale <= MAX_IN_MEMORY_SCALE:
+        cache_dir = os.path.join(BENCH_DIR, 'cache')
+        run.run('ingest_columnar_cache', lambda: build_sales_cache(csv_path, cache_dir), repeats=1, rows=rows, scale=scale)
+        columns, categories = load_sales_columns(csv_path, cache_dir)
+        run.run('cube_from_columns', lambda: SalesCube.from_columns(columns, categories), rows=rows, scale=scale)
+        sales_df = run.run('load_sales_data', lambda: load_sales_data(csv_path, cache_dir), rows=rows, scale=scale)
+        run.run(
+            'monthly_sales_pandas',
+            lambda: sales_df.groupby(sales_df['Date Purchase'].dt.to_period('M'))['Purchase Amount (USD)'].sum(),
+            rows=rows, scale=scale
+        )
+    return cube
+
+# AutoARIMA fit of the total monthly series; its cost depends on the months covered, not the rows
+def bench_fit(run, cube, scale):
+    values = cube.monthly_sales().values.astype(float)
+    result = run.run('fit_total_series', lambda: fit_series(ALL_PRODUCTS, values, DEFAULT_ARIMA_PARAMS),
+                     repeats=1, scale=scale, months=len(values))
+    if result['error']:
+        raise RuntimeError(result['error'])
+    return result['model']
+
+# Forecasting and the steps the dashboard runs on its result
+def bench_forecast(run, model, product_counts=PRODUCT_COUNTS, horizons=HORIZONS):
+    start_date = datetime.date(2024, 1, 1)
+    for n_products in product_counts:
+        products = [f"Product {i}" for i in range(n_products)]
+        for months in horizons:
+            end_date = start_date + datetime.timedelta(days=30 * months)
+            params = {'products': n_products, 'horizon': months}
+            forecast_df = run.run('generate_forecast', lambda: generate_batch_forecast(start_date, end_date, products, model),
+                                  rows=n_products * months, **params)
+            combined, aggregated = run.run('split_batch_forecast', lambda: split_batch_forecast(forecast_df), **params)
+            run.run('heatmap_aggregate', lambda: aggregate_heatmap(
+                combined['Date'].values, heatmap_row_labels(combined['Product'].values, 'Product'), combined['Forecast'].values
+            ), rows=len(combined), **params)
+            bench_figures(run, combined, aggregated, params)
+
+def bench_figures(run, combined, aggregated, params):
+    heatmap_input = pd.DataFrame({
+        'Date': combined['Date'].values,
+        'Row': heatmap_row_labels(combined['Product'].values, 'Product'),
+        'Forecast': combined['Forecast'].values,
+        'Level': 'Product',
+    })
+    figures = {
+        'aggregated_forecast': lambda: build_aggregated_forecast_figure(aggregated),
+        'cumulative_sales': lambda: build_cumulative_sales_figure(aggregated),
+        'sales_heatmap': lambda: build_sales_heatmap_figure(heatmap_input),
+        'resource_allocation': lambda: build_resource_allocation_figure(aggregated[['Date', 'Resource Requirement']]),
+    }
+    for name, build in figures.items():
+        # Building and serializing are what a cache miss costs a dashboard rerun
+        run.run(f"figure_{name}", lambda: build().to_json(), **params)
+
+# Vectorized forecasts of a whole catalog, and their agreement with per-model predict
+def bench_state_space(run, cube, horizons=HORIZONS, series_counts=STATE_SPACE_SERIES, n_models=STATE_SPACE_MODELS):
+    series, _ = build_series(cube)
+    keys = sorted((key for key in series if key != ALL_PRODUCTS), key=lambda key: -series[key].sum())[:n_models]
+    models = {}
+    for key in keys:
+        result = fit_series(key, series[key].values.astype(float), DEFAULT_ARIMA_PARAMS)
+        if result['model'] is not None:
+            models[key] = result['model']
+
+    # Same numbers as the per-model path: forecasts and both interval bounds
+    batch = StateSpaceBatch(models)
+    for months in horizons:
+        vectorized = batch.forecast(months, max_workers=1)
+        errors = []
+        for i, model in enumerate(models.values()):
+            forecast, conf_int = model.predict(n_periods=months, return_conf_int=True)
+            for values, expected in zip(vectorized, (forecast, conf_int[:, 0], conf_int[:, 1])):
+                expected = np.asarray(expected, dtype=float)
+                errors.append(np.max(np.abs(values[i] - expected) / np.maximum(np.abs(expected), 1.0)))
+        run.results.append({
+            'benchmark': 'state_space_equivalence',
+            'params': {'models': len(models), 'horizon': months},
+            'max_relative_error': float(max(errors)),
+            'passed': bool(max(errors) <= EQUIVALENCE_TOLERANCE),
+        })
+
+    model_list = list(models.values())
+    for n_series in series_counts:
+        catalog = {f"series {i}": model_list[i % len(model_list)] for i in range(n_series)}
+        catalog_batch = run.run('state_space_build', lambda: StateSpaceBatch(catalog), repeats=1, series=n_series)
+        for months in horizons:
+            run.run('state_space_forecast', lambda: catalog_batch.forecast(months), rows=n_series * months,
+                    series=n_series, horizon=months)
+            if n_series <= series_counts[0]:
+                run.run('per_model_predict', lambda: [model.predict(n_periods=months, return_conf_int=True) for model in catalog.values()],
+                        repeats=1, rows=n_series * months, series=n_series, horizon=months)
+
+def bench_history_figure(run, cube, scale):
+    monthly_sales = cube.monthly_sales()
+    history_df = pd.DataFrame({'Date': monthly_sales.index.to_timestamp(), 'Sales': monthly_sales.values})
+    run.run('figure_historical_sales', lambda: build_historical_sales_figure(history_df).to_json(), scale=scale)
+
+def result_key(record):
+    return (record['benchmark'], json.dumps(record['params'], sort_keys=True))
+
+# Ratio of each benchmark's best time to the baseline's; ratios above 1 + tolerance are
+# regressions unless the slowdown is within the noise floor
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    baseline_times = {result_key(record): record['best_seconds'] for record in baseline['results'] if 'best_seconds' in record}
+    comparison = []
+    for record in results:
+        previous = baseline_times.get(result_key(record))
+        if not previous or 'best_seconds' not in record:
+            continue
+        ratio = record['best_seconds'] / previous
+        comparison.append({
+            'benchmark': record['benchmark'],
+            'params': record['params'],
+            'baseline_seconds': previous,
+            'seconds': record['best_seconds'],
+            'ratio': ratio,
+            'regression': ratio > 1 + tolerance and record['best_seconds'] - previous > NOISE_FLOOR,
+        })
+    return comparison
+
+def environment():
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+def run_benchmarks(scales, repeats=3, memory_budget_mb=256, product_counts=PRODUCT_COUNTS, horizons=HORIZONS,
+                   state_space_series=STATE_SPACE_SERIES):
+    run = BenchRun(repeats)
+    model = None
+    first_cube = None
+    for scale in scales:
+        cube = bench_data(run, scale, memory_budget_mb)
+        bench_history_figure(run, cube, scale)
+        fitted = bench_fit(run, cube, scale)
+        model = model or fitted
+        first_cube = first_cube or cube
+    bench_forecast(run, model, product_counts, horizons)
+    if state_space_series:
+        bench_state_space(run, first_cube, horizons, state_space_series)
+    return {'environment': environment(), 'results': run.results}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark forecasting, aggregation and rendering at several data scales.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help='multiples of the sales extract size (1000 needs ~4 GB of disk)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--memory-budget-mb', type=float, default=256, help='chunk budget of streamed ingestion')
+    parser.add_argument('--products', type=int, nargs='+', default=list(PRODUCT_COUNTS))
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(HORIZONS))
+    parser.add_argument('--state-space-series', type=int, nargs='*', default=list(STATE_SPACE_SERIES),
+                        help='catalog sizes for the vectorized engine (none to skip it)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scales, args.repeats, args.memory_budget_mb, args.products, args.horizons,
+                            args.state_space_series)
+    # The vectorized engine must reproduce the per-model forecasts before its speed counts
+    mismatches = [record for record in report['results'] if record.get('passed') is False]
+    for record in mismatches:
+        print(f"MISMATCH {record['benchmark']} {json.dumps(record['params'])}: "
+              f"max relative error {record['max_relative_error']:.2e}", file=sys.stderr)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare_to_baseline(report['results'], json.load(f), args.tolerance)
+        regressions = [record for record in report['comparison'] if record['regression']]
+        for record in regressions:
+            print(f"REGRESSION {record['benchmark']} {json.dumps(record['params'])}: "
+                  f"{record['baseline_seconds'] * 1000:.1f} ms -> {record['seconds'] * 1000:.1f} ms "
+                  f"(x{record['ratio']:.2f})", file=sys.stderr)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    sys.exit(1 if regressions or mismatches else 0)
+
+if __name__ == '__main__':
+    main()
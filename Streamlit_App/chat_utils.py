@@ -0,0 +1,265 @@
+# chat_utils.py
+#
+# Chat completion backends for the AI assistant. Every backend streams the reply as text
+# chunks and stops early when its cancel event is set:
+#
+#     ASSISTANT_BACKEND=openai        blocking OpenAI client, one connection per session thread
+#     ASSISTANT_BACKEND=openai-async  async OpenAI client on one shared event loop thread
+#     ASSISTANT_BACKEND=fake          local stand-in with configurable latency, no network
+#
+#     python chat_utils.py --backend fake --requests 200 --concurrency 32
+
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+ASSISTANT_BACKEND = os.getenv('ASSISTANT_BACKEND', 'openai')
+ASSISTANT_MODEL = os.getenv('ASSISTANT_MODEL', 'gpt-3.5-turbo')
+
+# Seconds allowed per request and retries on errors raised before the first chunk arrives
+ASSISTANT_TIMEOUT = float(os.getenv('ASSISTANT_TIMEOUT', '30'))
+ASSISTANT_RETRIES = int(os.getenv('ASSISTANT_RETRIES', '2'))
+RETRY_BACKOFF = 0.5
+
+# Latency of the fake backend: seconds before the first chunk, and chunks per second after it
+FAKE_FIRST_CHUNK_LATENCY = float(os.getenv('FAKE_FIRST_CHUNK_LATENCY', '0.3'))
+FAKE_CHUNKS_PER_SECOND = float(os.getenv('FAKE_CHUNKS_PER_SECOND', '50'))
+
+# Interface shared by the assistant backends
+class ChatBackend:
+    name = None
+
+    # Yield the reply to a list of chat messages chunk by chunk, stopping once cancel is set
+    def stream(self, messages, cancel=None):
+        raise NotImplementedError
+
+    def complete(self, messages, cancel=None):
+        return ''.join(self.stream(messages, cancel))
+
+# Retry failures that happen before anything was streamed; a partial reply is never replayed
+def retry_before_first_chunk(open_stream, retries, cancel):
+    for attempt in range(retries + 1):
+        try:
+            return open_stream()
+        except Exception:
+            if attempt == retries or (cancel is not None and cancel.is_set()):
+                raise
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+class OpenAIBackend(ChatBackend):
+    name = 'openai'
+
+    def __init__(self, model=ASSISTANT_MODEL, timeout=ASSISTANT_TIMEOUT, retries=ASSISTANT_RETRIES, api_key=None):
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    # Created on first use so importing the dashboard needs neither the package nor a key
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                api_key = self.api_key or os.getenv('OPENAI_API_KEY', 'YOUR_API_KEY')
+                self._client = OpenAI(api_key=api_key, timeout=self.timeout, max_retries=0)
+            return self._client
+
+    def stream(self, messages, cancel=None):
+        response = retry_before_first_chunk(
+            lambda: self.client.chat.completions.create(model=self.model, messages=messages, stream=True),
+            self.retries, cancel
+        )
+        try:
+            for chunk in response:
+                if cancel is not None and cancel.is_set():
+                    return
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+        finally:
+            # Drops the HTTP connection when the reader stops early
+            response.close()
+
+# Async client driven by one event loop thread shared by every session; each stream hands its
+# chunks to the calling thread through a queue
+class AsyncOpenAIBackend(OpenAIBackend):
+    name = 'openai-async'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = None
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='assistant-loop', daemon=True).start()
+            return self._loop
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import AsyncOpenAI
+                api_key = self.api_key or os.getenv('OPENAI_API_KEY', 'YOUR_API_KEY')
+                self._client = AsyncOpenAI(api_key=api_key, timeout=self.timeout, max_retries=0)
+            return self._client
+
+    async def _produce(self, messages, chunks, cancel):
+        client = self.client
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await client.chat.completions.create(model=self.model, messages=messages, stream=True)
+                    break
+                except Exception:
+                    if attempt == self.retries or cancel.is_set():
+                        raise
+                    await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+            try:
+                async for chunk in response:
+                    if cancel.is_set():
+                        break
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        chunks.put(text)
+            finally:
+                await response.close()
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(None)
+
+    def stream(self, messages, cancel=None):
+        cancel = cancel or threading.Event()
+        chunks = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._produce(messages, chunks, cancel), self.loop)
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No reply from the assistant backend within {self.timeout:g}s") from None
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # Reader stopped or timed out: let the coroutine wind down and close its response. Cancelling
+            # the future cancels the task on the loop thread, which also stops a request still waiting
+            # for its first chunk.
+            cancel.set()
+            if not future.done():
+                future.cancel()
+
+# Offline stand-in that replies with a canned answer at a configurable speed, for load tests
+class FakeChatBackend(ChatBackend):
+    name = 'fake'
+
+    def __init__(self, first_chunk_latency=FAKE_FIRST_CHUNK_LATENCY, chunks_per_second=FAKE_CHUNKS_PER_SECOND,
+                 failure_rate=0.0, seed=None):
+        self.first_chunk_latency = first_chunk_latency
+        self.chunks_per_second = chunks_per_second
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    def reply(self, messages):
+        question = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        context = sum(len(m['content']) for m in messages)
+        return (
+            f"This is a local test reply to: \"{question}\". "
+            f"The request carried {len(messages)} messages and {context} characters of context. "
+            "Forecasts suggest steady demand with seasonal peaks; staff plans should follow the forecast totals."
+        )
+
+    def stream(self, messages, cancel=None):
+        if self._random.random() < self.failure_rate:
+            raise ConnectionError("Simulated backend failure")
+        if cancel is not None and cancel.wait(self.first_chunk_latency):
+            return
+        if cancel is None:
+            time.sleep(self.first_chunk_latency)
+        delay = 1 / self.chunks_per_second if self.chunks_per_second else 0
+        for word in self.reply(messages).split(' '):
+            if cancel is not None and cancel.is_set():
+                return
+            yield word + ' '
+            time.sleep(delay)
+
+CHAT_BACKENDS = {
+    backend.name: backend
+    for backend in (OpenAIBackend, AsyncOpenAIBackend, FakeChatBackend)
+}
+
+def make_chat_backend(name=ASSISTANT_BACKEND, **kwargs):
+    if name not in CHAT_BACKENDS:
+        raise ValueError(f"Unknown assistant backend: {name} (expected one of {', '.join(CHAT_BACKENDS)})")
+    return CHAT_BACKENDS[name](**kwargs)
+
+# Time to first chunk and total latency of concurrent assistant requests
+def load_test(backend, n_requests=100, concurrency=16):
+    messages = [
+        {"role": "system", "content": "You are a fashion sales assistant."},
+        {"role": "user", "content": "What are the predicted sales for the next six months?"},
+    ]
+    first_chunk, total, failures = [], [], []
+    lock = threading.Lock()
+
+    def call(i):
+        began = time.perf_counter()
+        first = None
+        try:
+            for _ in backend.stream(messages):
+                if first is None:
+                    first = time.perf_counter() - began
+        except Exception as e:
+            with lock:
+                failures.append(repr(e))
+            return
+        with lock:
+            first_chunk.append(first if first is not None else time.perf_counter() - began)
+            total.append(time.perf_counter() - began)
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(n_requests)))
+    elapsed = time.perf_counter() - began
+    first_chunk, total = np.asarray(first_chunk or [np.nan]), np.asarray(total or [np.nan])
+    return {
+        'backend': backend.name,
+        'requests': n_requests,
+        'concurrency': concurrency,
+        'failures': len(failures),
+        'requests_per_second': n_requests / elapsed,
+        'first_chunk_p50_ms': float(np.percentile(first_chunk, 50) * 1000),
+        'first_chunk_p95_ms': float(np.percentile(first_chunk, 95) * 1000),
+        'total_p50_ms': float(np.percentile(total, 50) * 1000),
+        'total_p95_ms': float(np.percentile(total, 95) * 1000),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test an AI assistant backend.')
+    parser.add_argument('--backend', default='fake', choices=sorted(CHAT_BACKENDS))
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fake backend only')
+    args = parser.parse_args()
+
+    kwargs = {'failure_rate': args.failure_rate} if args.backend == 'fake' else {}
+    backend = make_chat_backend(args.backend, **kwargs)
+    print(json.dumps(load_test(backend, args.requests, args.concurrency), indent=2))
+
+if __name__ == '__main__':
+    main()
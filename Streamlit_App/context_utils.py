@@ -0,0 +1,148 @@
+# context_utils.py
+#
+# Keeps assistant prompts within a fixed size: forecasts are encoded as a compact per-product
+# summary, and the conversation is cut to the most recent turns that fit the prompt budget.
+
+import os
+import numpy as np
+import pandas as pd
+
+# Tokens allowed for the forecast summary and for the whole prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv('ASSISTANT_CONTEXT_TOKENS', '350'))
+PROMPT_TOKEN_BUDGET = int(os.getenv('ASSISTANT_PROMPT_TOKENS', '2000'))
+
+# Bumped whenever the prompt format changes so cached answers are not reused
+PROMPT_VERSION = 1
+
+# Tokens reserved for the note standing in for dropped turns
+SUMMARY_TOKEN_BUDGET = 80
+
+# Approximate tokens per message spent on role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Characters per token when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+ALL_PRODUCTS = "All Products"
+
+_encoding = None
+
+# Token count of a text: exact with tiktoken, otherwise estimated from its length
+def count_tokens(text):
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def message_tokens(messages):
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+# One line summarizing the forecast of a product: total, trend, peak month, CI width and resources
+def summarize_product(product, forecast_df):
+    monthly = forecast_df.set_index('Date')['Forecast']
+    total = monthly.sum()
+    first, last = monthly.iloc[0], monthly.iloc[-1]
+    trend = (last - first) / abs(first) * 100 if first else 0.0
+    peak = monthly.idxmax()
+    ci_width = (forecast_df['Upper CI'] - forecast_df['Lower CI']).mean()
+    ci_share = ci_width / abs(monthly.mean()) * 100 if monthly.mean() else 0.0
+    line = (
+        f"{product}: total {total:,.0f}, trend {trend:+.0f}%, "
+        f"peak {peak:%b %Y} ({monthly.max():,.0f}), CI ±{ci_share / 2:.0f}%"
+    )
+    if 'Resource Requirement' in forecast_df:
+        line += f", staff hours {forecast_df['Resource Requirement'].sum():,.0f}"
+    return line
+
+# Forecast summary within a token budget: the period, the total line, then products by total
+# sales until the budget is spent; the remaining products are collapsed into one line
+def encode_forecast_context(forecast_df, token_budget=CONTEXT_TOKEN_BUDGET):
+    if forecast_df is None or forecast_df.empty:
+        return ""
+    dates = forecast_df['Date']
+    lines = [f"Monthly forecast {dates.min():%b %Y} to {dates.max():%b %Y}."]
+    groups = {product: group.sort_values('Date') for product, group in forecast_df.groupby('Product', sort=False)}
+
+    total = groups.pop(ALL_PRODUCTS, None)
+    if total is not None:
+        lines.append(summarize_product(ALL_PRODUCTS, total))
+
+    totals = pd.Series({product: group['Forecast'].sum() for product, group in groups.items()}, dtype=float)
+    products = list(totals.sort_values(ascending=False).index)
+    used = count_tokens('\n'.join(lines))
+    for i, product in enumerate(products):
+        line = summarize_product(product, groups[product])
+        # Leave room for the line summarizing the products left out
+        remainder = f"{len(products) - i} more products, total {totals[products[i:]].sum():,.0f}"
+        if used + count_tokens(line) + count_tokens(remainder) > token_budget:
+            lines.append(remainder)
+            break
+        lines.append(line)
+        used += count_tokens(line) + 1
+    return '\n'.join(lines)
+
+# Short note standing in for the turns dropped from the prompt
+def summarize_dropped_turns(turns, token_budget):
+    questions = [turn['content'] for turn in turns if turn['role'] == 'user']
+    note = f"Earlier in this conversation ({len(turns)} messages omitted) the user asked about: "
+    topics = []
+    for question in reversed(questions):
+        topic = ' '.join(question.split()[:12])
+        if count_tokens(note + '; '.join(topics + [topic])) > token_budget:
+            break
+        topics.insert(0, topic)
+    return note + ('; '.join(topics) if topics else 'other topics') + '.'
+
+# Messages to send for a turn: system messages and the forecast context always, then the newest
+# conversation turns that fit the budget. Returns the messages and token counts of the request.
+def build_prompt(history, context_text="", token_budget=PROMPT_TOKEN_BUDGET):
+    system = [message for message in history if message['role'] == 'system']
+    turns = [message for message in history if message['role'] != 'system']
+    if context_text:
+        system = system + [{"role": "system", "content": f"Here is the latest forecast and resource allocation data:\n{context_text}"}]
+
+    # Newest turns first; the latest user message is always kept
+    budget = token_budget - message_tokens(system)
+    if message_tokens(turns) > budget:
+        budget -= SUMMARY_TOKEN_BUDGET
+    kept = []
+    for message in reversed(turns):
+        cost = message_tokens([message])
+        if kept and cost > budget:
+            break
+        kept.insert(0, message)
+        budget -= cost
+
+    dropped = turns[:len(turns) - len(kept)]
+    if dropped:
+        note = summarize_dropped_turns(dropped, SUMMARY_TOKEN_BUDGET - MESSAGE_OVERHEAD_TOKENS)
+        system = system + [{"role": "system", "content": note}]
+
+    messages = system + kept
+    stats = {
+        'prompt_tokens': message_tokens(messages),
+        'context_tokens': count_tokens(context_text) if context_text else 0,
+        'history_messages': len(kept),
+        'dropped_messages': len(dropped),
+        'unbounded_prompt_tokens': message_tokens(history) + (count_tokens(context_text) if context_text else 0),
+    }
+    return messages, stats
+
+# Token counts of the requests made in a session
+def prompt_token_summary(log):
+    if not log:
+        return {}
+    sent = np.array([entry['prompt_tokens'] for entry in log])
+    unbounded = np.array([entry['unbounded_prompt_tokens'] for entry in log])
+    return {
+        'requests': len(log),
+        'last_prompt_tokens': int(sent[-1]),
+        'mean_prompt_tokens': float(sent.mean()),
+        'tokens_saved': int((unbounded - sent).sum()),
+    }
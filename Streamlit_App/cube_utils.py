@@ -0,0 +1,343 @@
+# cube_utils.py
+
+import os
+import json
+import functools
+import numpy as np
+import pandas as pd
+from data_utils import SALES_CSV, MISSING_STORE, encode_columns, load_sales_columns, source_signature
+from quality_utils import DATA_CLEANING, QualityStats, clean_frame, profile_csv
+
+# Default peak memory allowed for one chunk of a streamed file
+MEMORY_BUDGET_MB = float(os.getenv('INGEST_MEMORY_BUDGET_MB', '64'))
+
+# Working memory per parsed row relative to the frame itself (parsing, encoding, index arrays)
+CHUNK_OVERHEAD = 4
+
+# Persisted cube built from streamed extracts; when set it replaces the in-memory build
+CUBE_STORE_DIR = os.getenv('CUBE_STORE_DIR')
+
+# File of a persisted cube; the ledger and data-quality statistics are saved inside it
+CUBE_FILE = 'cube.npz'
+
+# Separate ledger and statistics files of stores written before they moved into the cube file
+LEGACY_LEDGER_FILE = 'ledger.json'
+LEGACY_QUALITY_FILE = 'quality.json'
+
+# Axis names of the cube, in storage order
+AXES = ('month', 'item', 'store', 'payment')
+
+# Label used for transactions whose item or payment method is missing
+UNKNOWN_LABEL = 'Unknown'
+
+# Measures kept for every cell of the cube
+MEASURES = ('amount', 'count', 'rating_sum', 'rating_count')
+
+# Map category codes to axis positions, adding an "Unknown" slot if any value is missing
+def _category_axis(codes, labels):
+    labels = list(labels)
+    codes = np.asarray(codes, dtype=np.int64)
+    missing = codes < 0
+    if missing.any():
+        codes = np.where(missing, len(labels), codes)
+        labels.append(UNKNOWN_LABEL)
+    return codes, labels
+
+# Dense sales totals by month x item x store x payment method
+class SalesCube:
+    def __init__(self, months, items, stores, payments, measures):
+        self.months = pd.PeriodIndex(months, freq='M')
+        self.items = list(items)
+        self.stores = np.asarray(stores)
+        self.payments = list(payments)
+        self.measures = measures
+        self._labels = {
+            'month': self.months,
+            'item': pd.Index(self.items),
+            'store': pd.Index(self.stores),
+            'payment': pd.Index(self.payments),
+        }
+
+    @property
+    def shape(self):
+        return self.measures['amount'].shape
+
+    # Build every cell in one pass over the raw columns
+    @classmethod
+    def from_columns(cls, columns, categories):
+        month = np.asarray(columns['date']).astype('datetime64[M]')
+        first_month = month.min()
+        month_index = (month - first_month).astype(np.int64)
+        n_months = int(month_index.max()) + 1
+
+        item_index, items = _category_axis(columns['item'], categories['item'])
+        payment_index, payments = _category_axis(columns['payment'], categories['payment'])
+        stores, store_index = np.unique(np.asarray(columns['store']), return_inverse=True)
+
+        shape = (n_months, len(items), len(stores), len(payments))
+        flat = np.ravel_multi_index((month_index, item_index, store_index, payment_index), shape)
+        size = int(np.prod(shape))
+
+        amount = np.asarray(columns['amount'], dtype=np.float64)
+        rating = np.asarray(columns['rating'], dtype=np.float64)
+        has_rating = ~np.isnan(rating)
+        measures = {
+            'amount': np.bincount(flat, weights=np.nan_to_num(amount), minlength=size),
+            'count': np.bincount(flat, minlength=size),
+            'rating_sum': np.bincount(flat[has_rating], weights=rating[has_rating], minlength=size),
+            'rating_count': np.bincount(flat[has_rating], minlength=size),
+        }
+        measures = {name: values.reshape(shape) for name, values in measures.items()}
+
+        months = pd.period_range(pd.Period(first_month, freq='M'), periods=n_months, freq='M')
+        return cls(months, items, stores, payments, measures)
+
+    # Cube holding no transactions, to fold chunks into
+    @classmethod
+    def empty(cls):
+        measures = {name: np.zeros((0, 0, 0, 0), dtype=np.int64 if 'count' in name else np.float64) for name in MEASURES}
+        return cls(pd.PeriodIndex([], freq='M'), [], np.array([], dtype=np.int16), [], measures)
+
+    # New cube covering the labels of both cubes with their cells added together
+    def merge(self, other):
+        if other.measures['count'].size == 0:
+            return self
+        if self.measures['count'].size == 0:
+            return other
+
+        first_month = min(self.months[0], other.months[0])
+        last_month = max(self.months[-1], other.months[-1])
+        months = pd.period_range(first_month, last_month, freq='M')
+        known_items, known_payments = set(self.items), set(self.payments)
+        items = self.items + [item for item in other.items if item not in known_items]
+        stores = np.union1d(self.stores, other.stores)
+        payments = self.payments + [payment for payment in other.payments if payment not in known_payments]
+
+        shape = (len(months), len(items), len(stores), len(payments))
+        measures = {name: np.zeros(shape, dtype=values.dtype) for name, values in self.measures.items()}
+        for cube in (self, other):
+            # Position of each of the cube's labels on the merged axes
+            positions = np.ix_(
+                months.get_indexer(cube.months),
+                pd.Index(items).get_indexer(cube.items),
+                np.searchsorted(stores, cube.stores),
+                pd.Index(payments).get_indexer(cube.payments),
+            )
+            for name, values in cube.measures.items():
+                measures[name][positions] += values
+        return SalesCube(months, items, stores, payments, measures)
+
+    # Save the cube, plus any JSON-serializable metadata written with it in the same file
+    def save(self, path, metadata=None):
+        labels = {
+            'months': [str(month) for month in self.months],
+            'items': self.items,
+            'stores': self.stores.tolist(),
+            'payments': self.payments,
+        }
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, labels=np.array(json.dumps(labels)), metadata=np.array(json.dumps(metadata or {})),
+                 **self.measures)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            labels = json.loads(str(data['labels']))
+            measures = {name: data[name] for name in MEASURES}
+        months = pd.PeriodIndex(labels['months'], freq='M')
+        return cls(months, labels['items'], np.array(labels['stores'], dtype=np.int16), labels['payments'], measures)
+
+    # Metadata saved with a cube, without loading its cells
+    @staticmethod
+    def load_metadata(path):
+        with np.load(path) as data:
+            return json.loads(str(data['metadata'])) if 'metadata' in data.files else {}
+
+    # Positions along an axis for one label or a list of labels
+    def _positions(self, axis, selection):
+        labels = self._labels[axis]
+        if axis == 'month':
+            selection = pd.PeriodIndex(np.atleast_1d(selection), freq='M')
+        positions = labels.get_indexer(np.atleast_1d(selection))
+        if (positions < 0).any():
+            raise KeyError(f"Unknown {axis}: {selection}")
+        return positions
+
+    # Sum a measure over every axis not in `by`, after restricting axes to the given labels
+    def rollup(self, by=('month',), measure='amount', **selections):
+        values = self.measures[measure]
+        for axis, selection in selections.items():
+            if selection is not None:
+                values = np.take(values, self._positions(axis, selection), axis=AXES.index(axis))
+
+        by = tuple(by)
+        summed = values.sum(axis=tuple(i for i, axis in enumerate(AXES) if axis not in by))
+        # Remaining axes are in storage order; put them in the requested order
+        remaining = [axis for axis in AXES if axis in by]
+        summed = np.transpose(summed, [remaining.index(axis) for axis in by])
+        labels = []
+        for axis in by:
+            axis_labels = self._labels[axis]
+            selection = selections.get(axis)
+            if selection is not None:
+                axis_labels = axis_labels[self._positions(axis, selection)]
+            labels.append(axis_labels)
+
+        if len(by) == 0:
+            return summed
+        if len(by) == 1:
+            return pd.Series(summed, index=labels[0].rename(by[0]))
+        index = pd.MultiIndex.from_product(labels, names=list(by))
+        return pd.Series(summed.ravel(), index=index)
+
+    # Monthly sales for everything, one item, one store or one item at one store
+    def monthly_sales(self, item=None, store=None, payment=None):
+        return self.rollup(('month',), item=item, store=store, payment=payment)
+
+    # Yearly sales, replacing the notebook's monthly_or_years_sales(..., "years")
+    def yearly_sales(self, **selections):
+        monthly = self.monthly_sales(**selections)
+        return monthly.groupby(monthly.index.year).sum()
+
+    # Total sales per store, replacing the notebook's sales_per_store
+    def sales_per_store(self, include_missing=False):
+        sales = self.rollup(('store',))
+        if not include_missing:
+            sales = sales[sales.index != MISSING_STORE]
+        return sales
+
+    # Average monthly sales over the last n months, replacing the notebook's average_12months
+    def average_last_months(self, n_months=12, **selections):
+        return float(self.monthly_sales(**selections).tail(n_months).mean())
+
+    # Mean review rating along the requested axes (NaN where nothing was rated)
+    def mean_rating(self, by=('month',), **selections):
+        rating_sum = self.rollup(by, measure='rating_sum', **selections)
+        rating_count = self.rollup(by, measure='rating_count', **selections)
+        return rating_sum / rating_count.where(rating_count > 0)
+
+# Cube of a transactions file, built from its columnar cache and reused until the file changes
+def load_sales_cube(csv_path=SALES_CSV, store_dir=CUBE_STORE_DIR):
+    if store_dir:
+        cube_path = CubeStore(store_dir).cube_path
+        signature = source_signature(cube_path)
+        return _load_stored_cube(cube_path, signature['size'], signature['mtime_ns'])
+    signature = source_signature(csv_path)
+    return _load_sales_cube(csv_path, signature['size'], signature['mtime_ns'])
+
+@functools.lru_cache(maxsize=4)
+def _load_sales_cube(csv_path, size, mtime_ns):
+    columns, categories = load_sales_columns(csv_path)
+    return SalesCube.from_columns(columns, categories)
+
+@functools.lru_cache(maxsize=4)
+def _load_stored_cube(cube_path, size, mtime_ns):
+    return SalesCube.load(cube_path)
+
+# Rows per chunk so that parsing one chunk stays within the memory budget
+def chunk_rows_for_budget(csv_path, memory_budget_mb=MEMORY_BUDGET_MB, sample_rows=1000):
+    sample = pd.read_csv(csv_path, nrows=sample_rows)
+    bytes_per_row = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    return max(int(memory_budget_mb * 2 ** 20 / (bytes_per_row * CHUNK_OVERHEAD)), 1)
+
+# Fold a transactions file into a cube chunk by chunk; memory depends on the budget, not the file size.
+# Chunks are cleaned with the given data-quality statistics, or with the file's own, gathered in a
+# first streaming pass.
+def stream_sales_cube(csv_path, cube=None, memory_budget_mb=MEMORY_BUDGET_MB, stats=None):
+    cube = cube if cube is not None else SalesCube.empty()
+    chunk_rows = chunk_rows_for_budget(csv_path, memory_budget_mb)
+    if DATA_CLEANING and stats is None:
+        stats = profile_csv(csv_path, chunk_rows)
+    categories = None
+    rows = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows):
+        if stats is not None:
+            chunk, _ = clean_frame(chunk, stats)
+        columns, categories = encode_columns(chunk, categories)
+        cube = cube.merge(SalesCube.from_columns(columns, categories))
+        rows += len(chunk)
+    return cube, rows
+
+# Persisted cube plus a ledger of the extracts already folded into it. The cube, ledger and
+# data-quality statistics are one file replaced atomically, so a crash never leaves a cube that
+# disagrees with its ledger and an extract is never counted twice.
+class CubeStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.cube_path = os.path.join(directory, CUBE_FILE)
+
+    def load_cube(self):
+        if os.path.isfile(self.cube_path):
+            return SalesCube.load(self.cube_path)
+        return SalesCube.empty()
+
+    def metadata(self):
+        if os.path.isfile(self.cube_path):
+            metadata = SalesCube.load_metadata(self.cube_path)
+            if 'ledger' in metadata:
+                return metadata
+        # Stores written before the ledger moved into the cube file
+        metadata = {}
+        ledger_path = os.path.join(self.directory, LEGACY_LEDGER_FILE)
+        if os.path.isfile(ledger_path):
+            with open(ledger_path) as f:
+                metadata['ledger'] = json.load(f)
+        quality_path = os.path.join(self.directory, LEGACY_QUALITY_FILE)
+        if os.path.isfile(quality_path):
+            metadata['quality'] = QualityStats.load(quality_path).to_dict()
+        return metadata
+
+    def ledger(self):
+        return self.metadata().get('ledger', {})
+
+    # Data-quality statistics of every extract ingested so far
+    def quality_stats(self):
+        quality = self.metadata().get('quality')
+        return QualityStats.from_dict(quality) if quality else QualityStats()
+
+    # Fold new extracts into the stored cube without rescanning the ones already ingested
+    def append(self, csv_paths, memory_budget_mb=MEMORY_BUDGET_MB):
+        os.makedirs(self.directory, exist_ok=True)
+        metadata = self.metadata()
+        ledger = metadata.get('ledger', {})
+        cube = self.load_cube()
+        stats = None
+        if DATA_CLEANING:
+            stats = QualityStats.from_dict(metadata['quality']) if metadata.get('quality') else QualityStats()
+        ingested = []
+        for csv_path in csv_paths:
+            key = os.path.abspath(csv_path)
+            signature = source_signature(csv_path)
+            if ledger.get(key, {}).get('source') == signature:
+                continue
+            if key in ledger:
+                raise ValueError(f"{csv_path} changed after it was ingested; rebuild the cube store")
+            if stats is not None:
+                # Only the new extract is profiled; it is cleaned with the statistics of every extract so far
+                stats.merge(profile_csv(csv_path, chunk_rows_for_budget(csv_path, memory_budget_mb)))
+            cube, rows = stream_sales_cube(csv_path, cube, memory_budget_mb, stats)
+            ledger[key] = {'source': signature, 'rows': rows}
+            ingested.append(csv_path)
+
+        if ingested:
+            metadata['ledger'] = ledger
+            if stats is not None:
+                metadata['quality'] = stats.to_dict()
+            cube.save(self.cube_path, metadata)
+        return cube, ingested
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fold transaction extracts into a persisted sales cube.')
+    parser.add_argument('extracts', nargs='+', help='CSV extracts to append')
+    parser.add_argument('--store', default=CUBE_STORE_DIR or 'cube_store', help='cube store directory')
+    parser.add_argument('--memory-budget-mb', type=float, default=MEMORY_BUDGET_MB, help='peak memory per chunk')
+    args = parser.parse_args()
+
+    cube, ingested = CubeStore(args.store).append(args.extracts, args.memory_budget_mb)
+    print(f"Ingested {len(ingested)} new extract(s); cube shape {cube.shape}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+# data_utils.py
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from quality_utils import DATA_CLEANING, QualityStats, clean_frame
+
+# Raw transaction extract shipped with the repository
+SALES_CSV = os.getenv(
+    'SALES_CSV',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Extended_Fashion_Retail_Sales.csv')
+)
+
+# Columnar caches are written next to the CSV unless configured otherwise
+CACHE_DIR = os.getenv('SALES_CACHE_DIR')
+
+# Date format used by the 'Date Purchase' column (M/D/YYYY)
+DATE_FORMAT = '%m/%d/%Y'
+
+# Bumped whenever the cache layout changes so old caches are rebuilt
+CACHE_FORMAT = 2
+
+META_FILE = 'meta.json'
+
+# Data-quality statistics the cached columns were cleaned with
+QUALITY_FILE = 'quality.json'
+
+# Cached column name -> (CSV column, on-disk dtype)
+CACHE_COLUMNS = {
+    'customer_id': ('Customer Reference ID', 'int32'),
+    'item': ('Item Purchased', 'int16'),
+    'amount': ('Purchase Amount (USD)', 'float32'),
+    'date': ('Date Purchase', 'datetime64[D]'),
+    'rating': ('Review Rating', 'float32'),
+    'payment': ('Payment Method', 'int8'),
+    'sales_per_item': ('Sales per Item', 'float32'),
+    'store': ('Store ID', 'int16'),
+}
+
+# Columns stored as categorical codes (-1 marks a missing value)
+CATEGORICAL_COLUMNS = ('item', 'payment')
+
+# Store ID used for transactions without a store
+MISSING_STORE = -1
+
+# Product category of every item of the sales extract, used to roll up views of many series.
+# Product lines of the single-model forecasts, such as 'Formal Wear', are not items and are not listed.
+ITEM_CATEGORIES = {
+    'Tops': [
+        'Tunic', 'Tank Top', 'T-shirt', 'Camisole', 'Blouse', 'Polo Shirt', 'Flannel Shirt',
+        'Hoodie', 'Sweater', 'Cardigan', 'Vest',
+    ],
+    'Bottoms': ['Leggings', 'Skirt', 'Shorts', 'Pants', 'Trousers', 'Jeans', 'Overalls'],
+    'Dresses & One-Pieces': ['Dress', 'Romper', 'Jumpsuit', 'Onesie', 'Kimono', 'Pajamas', 'Swimsuit'],
+    'Outerwear': ['Blazer', 'Coat', 'Trench Coat', 'Raincoat', 'Jacket', 'Poncho'],
+    'Footwear': ['Loafers', 'Sneakers', 'Boots', 'Slippers', 'Sandals', 'Flip-Flops'],
+    'Bags': ['Handbag', 'Wallet', 'Backpack'],
+    'Accessories': ['Belt', 'Socks', 'Umbrella', 'Hat', 'Sun Hat', 'Sunglasses', 'Scarf', 'Gloves', 'Tie', 'Bowtie'],
+}
+CATEGORY_OF_ITEM = {item: category for category, items in ITEM_CATEGORIES.items() for item in items}
+
+# Category of an item, "Other" for anything not listed above
+def item_category(item):
+    return CATEGORY_OF_ITEM.get(item, 'Other')
+
+# Directory holding the columnar cache of a CSV
+def cache_path(csv_path, cache_dir=CACHE_DIR):
+    csv_path = os.path.abspath(csv_path)
+    root = cache_dir or os.path.join(os.path.dirname(csv_path), '.sales_cache')
+    return os.path.join(root, os.path.splitext(os.path.basename(csv_path))[0])
+
+# Identifies the CSV content a cache was built from
+def source_signature(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def read_cache_meta(directory):
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+# Convert a frame of raw CSV rows into typed column arrays and category labels
+def encode_columns(df, categories=None):
+    categories = {name: list(labels) for name, labels in (categories or {}).items()}
+    columns = {}
+    for name, (source, dtype) in CACHE_COLUMNS.items():
+        values = df[source]
+        if name in CATEGORICAL_COLUMNS:
+            # Extend the known labels so codes stay stable when new values appear
+            labels = categories.setdefault(name, [])
+            new_labels = sorted(set(values.dropna().unique()) - set(labels))
+            labels.extend(new_labels)
+            columns[name] = pd.Categorical(values, categories=labels).codes.astype(dtype)
+        elif name == 'date':
+            columns[name] = pd.to_datetime(values, format=DATE_FORMAT).to_numpy().astype(dtype)
+        elif name == 'store':
+            columns[name] = values.fillna(MISSING_STORE).to_numpy().astype(dtype)
+        else:
+            columns[name] = values.to_numpy().astype(dtype)
+    return columns, categories
+
+# Parse the CSV once, clean it with statistics gathered in the same pass and write one .npy file per column
+def build_sales_cache(csv_path=SALES_CSV, cache_dir=CACHE_DIR):
+    directory = cache_path(csv_path, cache_dir)
+    signature = source_signature(csv_path)
+    df = pd.read_csv(csv_path)
+    stats, report = None, {}
+    if DATA_CLEANING:
+        stats = QualityStats().update(df)
+        df, report = clean_frame(df, stats)
+    columns, categories = encode_columns(df)
+
+    # Build in a scratch directory and swap it in, so readers never see a half-written cache
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp_directory, f"{name}.npy"), values)
+    if stats is not None:
+        stats.save(os.path.join(tmp_directory, QUALITY_FILE))
+    meta = {
+        'format': CACHE_FORMAT,
+        'source': signature,
+        'rows': int(len(columns['date'])),
+        'categories': categories,
+        'cleaned': DATA_CLEANING,
+        'cleaning': {name: dict(counts) for name, counts in report.items()},
+    }
+    with open(os.path.join(tmp_directory, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+    return directory
+
+# Memory-mapped column arrays and category labels, rebuilding the cache if the CSV changed
+def load_sales_columns(csv_path=SALES_CSV, cache_dir=CACHE_DIR):
+    directory = cache_path(csv_path, cache_dir)
+    meta = read_cache_meta(directory)
+    if (meta is None or meta.get('format') != CACHE_FORMAT or meta.get('source') != source_signature(csv_path)
+            or meta.get('cleaned') != DATA_CLEANING):
+        build_sales_cache(csv_path, cache_dir)
+        meta = read_cache_meta(directory)
+
+    columns = {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+        for name in CACHE_COLUMNS
+    }
+    return columns, meta['categories']
+
+# Load the transactions with parsed purchase dates
+def load_sales_data(path=SALES_CSV, cache_dir=CACHE_DIR):
+    columns, categories = load_sales_columns(path, cache_dir)
+    data = {}
+    for name, (source, _) in CACHE_COLUMNS.items():
+        values = columns[name]
+        if name in CATEGORICAL_COLUMNS:
+            data[source] = pd.Categorical.from_codes(values, categories=categories[name])
+        elif name == 'date':
+            data[source] = values.astype('datetime64[ns]')
+        elif name == 'store':
+            data[source] = pd.arrays.IntegerArray(np.asarray(values), values == MISSING_STORE)
+        else:
+            data[source] = values
+    return pd.DataFrame(data)
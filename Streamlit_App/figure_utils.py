@@ -0,0 +1,373 @@
+# figure_utils.py
+#
+# Plotly figure builders for the dashboard charts, without Streamlit: downsampling to a point
+# budget, WebGL traces for long series and fixed-resolution heatmaps. plot_utils caches and
+# renders them; the benchmarks build them directly.
+
+import os
+import hashlib
+import numpy as np
+import plotly.graph_objects as go
+import pandas as pd
+from perf_utils import span
+from data_utils import MISSING_STORE, item_category
+from train_utils import parse_series_key, store_label
+
+# Most points sent to the browser per trace; longer series are downsampled
+POINT_BUDGET = int(os.getenv('PLOT_POINT_BUDGET', '2000'))
+
+# Traces with more points than this are drawn with WebGL instead of SVG
+WEBGL_THRESHOLD = int(os.getenv('PLOT_WEBGL_THRESHOLD', '1000'))
+
+# Heatmap resolution: rows and date columns sent to the browser, whatever the number of series
+HEATMAP_MAX_ROWS = int(os.getenv('HEATMAP_MAX_ROWS', '40'))
+HEATMAP_MAX_COLS = int(os.getenv('HEATMAP_MAX_COLS', '60'))
+
+# Stores grouped together in the store-cluster view of the heatmap
+STORE_CLUSTER_SIZE = int(os.getenv('STORE_CLUSTER_SIZE', '5'))
+
+# Heatmap row groupings offered once there are too many series to show one row each
+HEATMAP_LEVELS = ('Category', 'Store Cluster')
+
+# Hash of the columns a figure is built from
+def data_fingerprint(df, columns):
+    hashed = pd.util.hash_pandas_object(df[list(columns)], index=False).values
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+def serialize_figure(builder, df):
+    with span('figure_build', figure=builder.__name__):
+        fig = builder(df)
+    with span('figure_serialize', figure=builder.__name__):
+        return fig.to_json()
+
+# Indices of the points kept by largest-triangle-three-buckets downsampling
+def lttb_indices(y, n_out, x=None):
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # First and last points are always kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (or the last point for the final bucket)
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Keep the point forming the largest triangle with the previous kept point and that average
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+    return indices
+
+# Rows of a frame reduced to the point budget, keeping the shape of the value column
+def downsample(df, value_column, n_out=POINT_BUDGET):
+    if len(df) <= n_out:
+        return df
+    x = df['Date'].values.astype('datetime64[ns]').astype(np.int64)
+    return df.iloc[lttb_indices(df[value_column].values, n_out, x)]
+
+# SVG scatter for small traces, WebGL scatter past the size threshold
+def scatter_trace(n_points, **kwargs):
+    if n_points > WEBGL_THRESHOLD:
+        return go.Scattergl(**kwargs)
+    return go.Scatter(**kwargs)
+
+def build_aggregated_forecast_figure(aggregated_forecast):
+    # Plot aggregated forecast
+    fig = go.Figure()
+    aggregated_forecast = downsample(aggregated_forecast.sort_values('Date'), 'Forecast')
+    n_points = len(aggregated_forecast)
+
+    # Create a trace for the forecast line
+    fig.add_trace(scatter_trace(
+        n_points,
+        x=aggregated_forecast['Date'],
+        y=aggregated_forecast['Forecast'],
+        mode='lines+markers' if n_points <= WEBGL_THRESHOLD else 'lines',
+        line=dict(width=2, color='white'),
+        marker=dict(size=5, color='white'),
+        name='Forecast',
+    ))
+
+    # Fill positive area (Profit) with green color
+    fig.add_trace(scatter_trace(
+        n_points,
+        x=aggregated_forecast['Date'],
+        y=aggregated_forecast['Forecast'].clip(lower=0),
+        mode='lines',
+        line=dict(width=0),
+        fill='tozeroy',
+        fillcolor='rgba(0, 255, 0, 0.5)',
+        name='Profit',
+        hoverinfo='skip',
+        showlegend=True
+    ))
+
+    # Fill negative area (Loss) with red color
+    fig.add_trace(scatter_trace(
+        n_points,
+        x=aggregated_forecast['Date'],
+        y=aggregated_forecast['Forecast'].clip(upper=0),
+        mode='lines',
+        line=dict(width=0),
+        fill='tozeroy',
+        fillcolor='rgba(255, 0, 0, 0.5)',
+        name='Loss',
+        hoverinfo='skip',
+        showlegend=True
+    ))
+
+    # Update layout
+    fig.update_layout(
+        title='Aggregated Sales Forecast for All Products',
+        xaxis_title='Date',
+        yaxis_title='Predicted Sales (Profit/Loss)',
+        template='plotly_dark',
+        plot_bgcolor='black',
+        paper_bgcolor='black',
+        font=dict(color="white"),
+        hovermode='x unified',
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+def build_cumulative_sales_figure(aggregated_forecast):
+    # Calculate cumulative sales
+    aggregated_forecast = aggregated_forecast.sort_values('Date')
+    aggregated_forecast['Cumulative Forecast'] = aggregated_forecast['Forecast'].cumsum()
+    aggregated_forecast = downsample(aggregated_forecast, 'Cumulative Forecast')
+    n_points = len(aggregated_forecast)
+
+    fig = go.Figure()
+
+    # Create a trace for the cumulative forecast line
+    fig.add_trace(scatter_trace(
+        n_points,
+        x=aggregated_forecast['Date'],
+        y=aggregated_forecast['Cumulative Forecast'],
+        mode='lines+markers' if n_points <= WEBGL_THRESHOLD else 'lines',
+        line=dict(width=2, color='white'),
+        marker=dict(size=5, color='white'),
+        name='Cumulative Sales',
+    ))
+
+    # Fill positive area (Cumulative Profit) with green color
+    fig.add_trace(scatter_trace(
+        n_points,
+        x=aggregated_forecast['Date'],
+        y=aggregated_forecast['Cumulative Forecast'].clip(lower=0),
+        mode='lines',
+        line=dict(width=0),
+        fill='tozeroy',
+        fillcolor='rgba(0, 255, 0, 0.5)',
+        name='Cumulative Profit',
+        hoverinfo='skip',
+        showlegend=True
+    ))
+
+    # Fill negative area (Cumulative Loss) with red color
+    fig.add_trace(scatter_trace(
+        n_points,
+        x=aggregated_forecast['Date'],
+        y=aggregated_forecast['Cumulative Forecast'].clip(upper=0),
+        mode='lines',
+        line=dict(width=0),
+        fill='tozeroy',
+        fillcolor='rgba(255, 0, 0, 0.5)',
+        name='Cumulative Loss',
+        hoverinfo='skip',
+        showlegend=True
+    ))
+
+    # Update layout
+    fig.update_layout(
+        title='Cumulative Sales Forecast',
+        xaxis_title='Date',
+        yaxis_title='Cumulative Predicted Sales (Profit/Loss)',
+        template='plotly_dark',
+        plot_bgcolor='black',
+        paper_bgcolor='black',
+        font=dict(color="white"),
+        hovermode='x unified',
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+# Row label of a series at a heatmap level
+def heatmap_row_label(product, level):
+    item, store = parse_series_key(product)
+    if level == 'Category':
+        return item_category(item)
+    if level == 'Store Cluster':
+        if store is None:
+            return 'All Stores'
+        if store == MISSING_STORE:
+            return store_label(store)
+        first = (store - 1) // STORE_CLUSTER_SIZE * STORE_CLUSTER_SIZE + 1
+        return f"Stores {first}-{first + STORE_CLUSTER_SIZE - 1}"
+    return product
+
+# Levels that group the given series: store clusters only when some series is per store
+def heatmap_levels(products):
+    has_stores = any(parse_series_key(product)[1] is not None for product in pd.unique(products))
+    return [level for level in HEATMAP_LEVELS if level != 'Store Cluster' or has_stores]
+
+# Row labels of every forecast row at a heatmap level, computed once per distinct product
+def heatmap_row_labels(products, level):
+    codes, uniques = pd.factorize(products)
+    labels = np.array([heatmap_row_label(product, level) for product in uniques], dtype=object)
+    return labels[codes]
+
+# Heatmap matrix aggregated from long-format rows at a fixed resolution: rows are the labels
+# (largest max_rows - 1 kept, the rest summed into "Other"), columns are bins of consecutive dates
+# holding the mean per-date value. Only the output matrix is dense.
+def aggregate_heatmap(dates, labels, values, max_rows=HEATMAP_MAX_ROWS, max_cols=HEATMAP_MAX_COLS):
+    row_codes, row_labels = pd.factorize(labels, sort=True)
+    unique_dates, date_codes = np.unique(dates, return_inverse=True)
+    n_dates = len(unique_dates)
+    n_bins = min(n_dates, max_cols)
+    bin_codes = date_codes * n_bins // n_dates
+
+    # Fold the smallest rows into "Other" when there are more labels than rows on screen
+    row_labels = list(row_labels)
+    if len(row_labels) > max_rows:
+        totals = np.bincount(row_codes, weights=np.abs(values), minlength=len(row_labels))
+        keep = np.sort(np.argsort(totals)[::-1][:max_rows - 1])
+        remap = np.full(len(row_labels), max_rows - 1)
+        remap[keep] = np.arange(max_rows - 1)
+        row_codes = remap[row_codes]
+        row_labels = [row_labels[i] for i in keep] + ['Other']
+
+    n_rows = len(row_labels)
+    sums = np.bincount(row_codes * n_bins + bin_codes, weights=values, minlength=n_rows * n_bins)
+    dates_per_bin = np.bincount(np.arange(n_dates) * n_bins // n_dates, minlength=n_bins)
+    matrix = sums.reshape(n_rows, n_bins) / dates_per_bin
+    bin_starts = unique_dates[np.searchsorted(np.arange(n_dates) * n_bins // n_dates, np.arange(n_bins))]
+    return matrix, row_labels, pd.DatetimeIndex(bin_starts)
+
+def build_sales_heatmap_figure(heatmap_input):
+    matrix, row_labels, bin_starts = aggregate_heatmap(
+        heatmap_input['Date'].values, heatmap_input['Row'].values, heatmap_input['Forecast'].values
+    )
+
+    fig = go.Figure(data=go.Heatmap(
+        z=matrix,
+        x=bin_starts.strftime('%b %Y'),
+        y=row_labels,
+        colorscale='Viridis',
+        colorbar_title='Predicted Sales'
+    ))
+
+    # Update layout with black background
+    fig.update_layout(
+        title='Sales Forecast Heatmap',
+        xaxis_title='Date',
+        yaxis_title=heatmap_input['Level'].iloc[0] if len(heatmap_input) else 'Product',
+        template='plotly_dark',
+        plot_bgcolor='black',
+        paper_bgcolor='black',
+        font=dict(color="white")
+    )
+    return fig
+
+def build_resource_allocation_figure(resource_df):
+    fig = go.Figure()
+    resource_df = downsample(resource_df.sort_values('Date'), 'Resource Requirement')
+
+    # Add bars for resource requirements
+    fig.add_trace(go.Bar(
+        x=resource_df['Date'],
+        y=resource_df['Resource Requirement'],
+        marker_color='orange',
+        name='Resource Requirement',
+    ))
+
+    # Update layout with black background
+    fig.update_layout(
+        title='Resource Allocation Forecast',
+        xaxis_title='Date',
+        yaxis_title='Resource Requirement (Staff Hours)',
+        template='plotly_dark',
+        plot_bgcolor='black',
+        paper_bgcolor='black',
+        font=dict(color="white"),
+        hovermode='x',
+        showlegend=False,
+        xaxis_tickformat='%b %Y'
+    )
+    return fig
+
+def build_staffing_figure(staffing_df):
+    fig = go.Figure()
+    staffing_df = staffing_df.sort_values('Date')
+
+    # Median staffing as bars, with the P90 and P95 levels planners staff to above them
+    fig.add_trace(go.Bar(
+        x=staffing_df['Date'],
+        y=staffing_df['P50'],
+        marker_color='orange',
+        name='P50',
+    ))
+    for column, color in (('P90', 'lightblue'), ('P95', 'red')):
+        fig.add_trace(go.Scatter(
+            x=staffing_df['Date'],
+            y=staffing_df[column],
+            mode='lines+markers',
+            line=dict(color=color, dash='dash'),
+            name=column,
+        ))
+
+    # Update layout with black background
+    fig.update_layout(
+        title=f"Staffing Percentiles: {staffing_df['Store'].iloc[0]}" if len(staffing_df) else 'Staffing Percentiles',
+        xaxis_title='Date',
+        yaxis_title='Staff Hours',
+        template='plotly_dark',
+        plot_bgcolor='black',
+        paper_bgcolor='black',
+        font=dict(color="white"),
+        hovermode='x',
+        xaxis_tickformat='%b %Y'
+    )
+    return fig
+
+def build_historical_sales_figure(history_df):
+    fig = go.Figure()
+    history_df = downsample(history_df, 'Sales')
+    n_points = len(history_df)
+
+    # Add a line for the actual monthly sales
+    fig.add_trace(scatter_trace(
+        n_points,
+        x=history_df['Date'],
+        y=history_df['Sales'],
+        mode='lines+markers' if n_points <= WEBGL_THRESHOLD else 'lines',
+        line=dict(width=2, color='darkorange'),
+        marker=dict(size=4, color='darkorange'),
+        name='Monthly Sales',
+    ))
+
+    # Update layout with black background
+    fig.update_layout(
+        title='Historical Monthly Sales',
+        xaxis_title='Month',
+        yaxis_title='Sales (USD)',
+        template='plotly_dark',
+        plot_bgcolor='black',
+        paper_bgcolor='black',
+        font=dict(color="white"),
+        hovermode='x',
+        showlegend=False,
+        xaxis_tickformat='%b %Y'
+    )
+    return fig
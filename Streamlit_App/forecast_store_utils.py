@@ -0,0 +1,131 @@
+# forecast_store_utils.py
+#
+# Materializes forecasts for every series of a model version so the dashboard can read them
+# instead of running the model:
+#
+#     python forecast_store_utils.py --version models/20240101-120000
+
+import os
+import re
+import json
+import shutil
+import argparse
+import functools
+from datetime import datetime
+import numpy as np
+
+# Root directory of the forecast store, one sub-directory per model version
+FORECAST_STORE_DIR = os.getenv('FORECAST_STORE_DIR', 'forecast_store')
+
+# Longest horizon materialized, in monthly periods (two years)
+MAX_HORIZON = int(os.getenv('FORECAST_MAX_HORIZON', '24'))
+
+META_FILE = 'meta.json'
+
+# Layout of a version's directory. Format 1 stores also kept a 'resource' array of staff hours;
+# those go stale when the staffing factors change, so format 2 derives staff hours at lookup.
+# Format 1 stores still load: their extra array is ignored.
+STORE_FORMAT = 2
+
+# Arrays kept per version, each of shape (series, horizon)
+STORE_ARRAYS = ('forecast', 'lower', 'upper')
+
+# Directory holding the forecasts of a model version
+def store_path(version, root=FORECAST_STORE_DIR):
+    return os.path.join(root, re.sub(r'[^A-Za-z0-9_.-]+', '_', version))
+
+# Memory-mapped forecasts of one model version, indexed by series and horizon step
+class ForecastStore:
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.meta = meta
+        self.model_token = meta['model_token']
+        self.max_horizon = meta['max_horizon']
+        self.series_index = {key: i for i, key in enumerate(meta['series'])}
+        self.arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+            for name in STORE_ARRAYS
+        }
+
+    # Forecast, lower and upper arrays for the first n_periods steps of each series,
+    # or None if any series or step is missing
+    def lookup(self, series_keys, n_periods):
+        if n_periods > self.max_horizon:
+            return None
+        rows = [self.series_index.get(key) for key in series_keys]
+        if any(row is None for row in rows):
+            return None
+        return tuple(np.asarray(self.arrays[name][rows, :n_periods], dtype=float) for name in STORE_ARRAYS)
+
+# Write a version's forecasts to a scratch directory and swap it in
+def write_forecast_store(version, model_token, series_keys, arrays, root=FORECAST_STORE_DIR):
+    directory = store_path(version, root)
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for name in STORE_ARRAYS:
+        np.save(os.path.join(tmp_directory, f"{name}.npy"), np.asarray(arrays[name], dtype=np.float32))
+    meta = {
+        'format': STORE_FORMAT,
+        'version': version,
+        'model_token': model_token,
+        'max_horizon': int(arrays['forecast'].shape[1]),
+        'series': list(series_keys),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(os.path.join(tmp_directory, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+    return directory
+
+# Forecast store of a model version, or None if it has not been materialized
+def open_forecast_store(version, root=FORECAST_STORE_DIR):
+    meta_path = os.path.join(store_path(version, root), META_FILE)
+    try:
+        stat = os.stat(meta_path)
+    except FileNotFoundError:
+        return None
+    # A rewritten store is a new file, so its inode changes even within the timestamp granularity
+    return _open_forecast_store(meta_path, stat.st_ino, stat.st_mtime_ns)
+
+@functools.lru_cache(maxsize=8)
+def _open_forecast_store(meta_path, inode, mtime_ns):
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return ForecastStore(os.path.dirname(meta_path), meta)
+
+# Predict every series of a model version for the longest supported horizon and store the result
+def materialize_forecasts(version, path, root=FORECAST_STORE_DIR, max_horizon=MAX_HORIZON):
+    from forecast_utils import SeriesModelSet, available_product_types, file_digest, load_artifact, predict_products
+
+    model = load_artifact(path)
+    # Every product offered in the dashboard, plus the per-store series of an artifact set
+    series_keys = available_product_types(model)
+    if isinstance(model, SeriesModelSet):
+        series_keys += sorted(key for key in model.models if key not in set(series_keys))
+
+    forecasts, lower, upper = predict_products(model, series_keys, max_horizon)
+    arrays = {'forecast': forecasts, 'lower': lower, 'upper': upper}
+    # Same token format as ModelRegistry.version_token, so a retrained artifact makes the store stale
+    model_token = f"{version}@{file_digest(path)[:12]}"
+    return write_forecast_store(version, model_token, series_keys, arrays, root)
+
+def main():
+    from forecast_utils import ModelRegistry, default_model_version, discover_model_versions
+
+    parser = argparse.ArgumentParser(description='Precompute forecasts for every series of a model version.')
+    parser.add_argument('--version', default=None, help='model version (default: the dashboard default)')
+    parser.add_argument('--all', action='store_true', help='materialize every available model version')
+    parser.add_argument('--output-dir', default=FORECAST_STORE_DIR, help='forecast store root directory')
+    parser.add_argument('--max-horizon', type=int, default=MAX_HORIZON, help='longest horizon in months')
+    args = parser.parse_args()
+
+    registry = discover_model_versions(ModelRegistry())
+    versions = registry.versions() if args.all else [args.version or default_model_version()]
+    for version in versions:
+        directory = materialize_forecasts(version, registry.path(version), args.output_dir, args.max_horizon)
+        print(f"{version}: forecasts written to {directory}")
+
+if __name__ == '__main__':
+    main()
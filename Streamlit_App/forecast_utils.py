@@ -0,0 +1,429 @@
+# forecast_utils.py
+#
+# Model loading and forecasting without Streamlit: the model registry, batch forecasts and the
+# forecast store lookup. The dashboard wraps these in its shared caches (model_utils); the
+# forecast service and the benchmarks use them directly.
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+import joblib
+import pandas as pd
+import numpy as np
+from perf_utils import span, timed
+from forecast_store_utils import open_forecast_store
+from statespace_utils import StateSpaceBatch
+from reconcile_utils import Hierarchy, reconcile, sum_forecasts
+from staffing_utils import (STAFFING_QUANTILES, STAFFING_SCENARIOS, load_staffing_factors, simulate_staffing,
+                            staffing_factors, staffing_groups)
+from train_utils import ARTIFACT_DIR, MANIFEST_FILE, LATEST_FILE, TOTAL_SERIES
+
+# Label used for the aggregated rows of a batch forecast
+ALL_PRODUCTS = "All Products"
+
+# Products offered when the model has no per-product series
+DEFAULT_PRODUCT_TYPES = [
+    "Women's Dresses", "Jeans", "Casual Wear", "Formal Wear", "Athletic Apparel",
+    "Footwear", "Accessories", "Handbags", "Children's Clothing"
+]
+
+# Staff hours required per unit sold
+RESOURCE_FACTOR = 0.1  # Adjust this factor based on your business needs
+
+# Default model artifact and the directory scanned for other versions
+DEFAULT_MODEL_PATH = 'autoarima_model.pkl'
+MODEL_DIR = os.getenv('MODEL_DIR', '.')
+
+# Number of model versions kept in memory at once
+MAX_CACHED_MODELS = int(os.getenv('MAX_CACHED_MODELS', '4'))
+
+# Size and lifetime of the forecast cache shared across sessions
+FORECAST_CACHE_SIZE = int(os.getenv('FORECAST_CACHE_SIZE', '256'))
+FORECAST_CACHE_TTL = float(os.getenv('FORECAST_CACHE_TTL', '3600'))
+
+# How the total, item and item x store forecasts of an artifact set are made coherent: 'mint', 'bottom_up' or 'none'
+FORECAST_RECONCILIATION = os.getenv('FORECAST_RECONCILIATION', 'mint')
+
+# Name a model version after its artifact file
+def model_version_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+# Name an artifact set version written by train_utils
+def artifact_set_name(version):
+    return f"{os.path.basename(os.path.normpath(ARTIFACT_DIR))}/{version}"
+
+# Per-series models of one artifact set written by train_utils
+class SeriesModelSet:
+    def __init__(self, manifest, models):
+        self.manifest = manifest
+        self.models = models
+        self._state_space = None
+        self._hierarchy = None
+        self._reconciled = {}
+        self._lock = threading.Lock()
+        # Held while reconciling, so concurrent requests wait for one reconciliation instead of repeating it
+        self._reconcile_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.models)
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    # Stacked state spaces of every model, built on first use and shared by all requests
+    @property
+    def state_space(self):
+        with self._lock:
+            if self._state_space is None:
+                self._state_space = StateSpaceBatch(self.models)
+            return self._state_space
+
+    # Total, item and item x store hierarchy of the fitted series; series the set could not fit
+    # keep their parents out of the constraints
+    @property
+    def hierarchy(self):
+        with self._lock:
+            if self._hierarchy is None:
+                self._hierarchy = Hierarchy(self.models, self.manifest['series'])
+            return self._hierarchy
+
+    # Reconciled forecast, lower and upper arrays of every node of the hierarchy. Periods are
+    # reconciled independently, so the longest horizon computed so far serves shorter ones.
+    def reconciled_forecast(self, n_periods, method=FORECAST_RECONCILIATION):
+        with self._reconcile_lock:
+            cached = self._reconciled.get(method)
+            if cached is None or cached[0].shape[1] < n_periods:
+                hierarchy = self.hierarchy
+                with span('reconcile', series=len(hierarchy), method=method):
+                    cached = reconcile(hierarchy, *self.state_space.forecast(n_periods, hierarchy.nodes), method=method)
+                self._reconciled[method] = cached
+        return tuple(values[:, :n_periods] for values in cached)
+
+    # Item-level series, offered as products in the dashboard
+    def product_types(self):
+        return sorted(
+            key for key, entry in self.manifest['series'].items()
+            if key in self.models and entry['item'] is not None and entry['store'] is None
+        )
+
+# Load every successfully fitted model of an artifact set
+def load_artifact_set(manifest_path):
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    version_dir = os.path.dirname(manifest_path)
+    models = {
+        key: joblib.load(os.path.join(version_dir, entry['file']))
+        for key, entry in manifest['series'].items()
+        if entry['status'] == 'ok'
+    }
+    return SeriesModelSet(manifest, models)
+
+# Load a single pickled model or a whole artifact set
+@timed('load_model')
+def load_artifact(path):
+    if os.path.basename(path) == MANIFEST_FILE:
+        return load_artifact_set(path)
+    return joblib.load(path)
+
+# Hash the content of a model artifact
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Process-wide store of loaded models, shared by every session
+class ModelRegistry:
+    def __init__(self, max_models=MAX_CACHED_MODELS):
+        self.max_models = max_models
+        self._paths = {}
+        # version name -> (stat signature, content digest, model), least recently used first
+        self._models = OrderedDict()
+        # path -> (stat signature, content digest) of artifacts hashed without being loaded
+        self._digests = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._paths.get(name) != path:
+                self._paths[name] = path
+                self._models.pop(name, None)
+
+    def versions(self):
+        with self._lock:
+            return sorted(self._paths)
+
+    def path(self, name):
+        return self._paths[name]
+
+    def get(self, name):
+        path = self._paths[name]
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is not None:
+                cached_signature, digest, model = entry
+                # Only re-hash when the file looks different, and only reload when the content really changed
+                if cached_signature == signature or file_digest(path) == digest:
+                    self._models[name] = (signature, digest, model)
+                    self._models.move_to_end(name)
+                    return model
+
+            model = load_artifact(path)
+            self._models[name] = (signature, file_digest(path), model)
+            self._models.move_to_end(name)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+            return model
+
+    # Identifies the loaded content of a version, changes whenever the artifact is swapped. Versions
+    # not loaded yet are identified by the content of their artifact, so the token does not change
+    # when they are loaded.
+    def version_token(self, name):
+        with self._lock:
+            entry = self._models.get(name)
+            path = self._paths.get(name)
+        if entry is not None:
+            return f"{name}@{entry[1][:12]}"
+        if path is None:
+            return name
+        return f"{name}@{self._artifact_digest(path)[:12]}"
+
+    def _artifact_digest(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[path] = (signature, digest)
+        return digest
+
+    def loaded_versions(self):
+        with self._lock:
+            return list(self._models)
+
+# Register every pickled model and every trained artifact set
+def discover_model_versions(registry, directory=MODEL_DIR, artifact_dir=ARTIFACT_DIR):
+    if os.path.isdir(directory):
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.pkl'):
+                path = os.path.join(directory, file_name)
+                registry.register(model_version_name(path), path)
+    if os.path.isdir(artifact_dir):
+        for version in os.listdir(artifact_dir):
+            manifest_path = os.path.join(artifact_dir, version, MANIFEST_FILE)
+            if os.path.isfile(manifest_path):
+                registry.register(artifact_set_name(version), manifest_path)
+    return registry
+
+# Latest trained artifact set if there is one, otherwise the notebook model
+def default_model_version(artifact_dir=ARTIFACT_DIR):
+    latest_path = os.path.join(artifact_dir, LATEST_FILE)
+    if os.path.isfile(latest_path):
+        with open(latest_path) as f:
+            version = f.read().strip()
+        if os.path.isfile(os.path.join(artifact_dir, version, MANIFEST_FILE)):
+            return artifact_set_name(version)
+    return model_version_name(DEFAULT_MODEL_PATH)
+
+# Number of monthly periods covered by a date range (at least one)
+def forecast_periods(start_date, end_date):
+    return max((end_date - start_date).days // 30, 1)
+
+# Small per-product variation used to simulate different products
+# (crc32 rather than hash() so the variation is the same in every process)
+def product_adjustment_factors(product_types):
+    return np.array([(zlib.crc32(product_type.encode('utf-8')) % 5) / 100 for product_type in product_types])
+
+# Staff hours per unit sold for each series; STAFFING_FACTORS_FILE overrides RESOURCE_FACTOR per item or store
+def resource_factors(series_keys):
+    return staffing_factors(series_keys, load_staffing_factors(), RESOURCE_FACTOR)
+
+# Products that can be forecast with a model, plus the "All Products" option
+def available_product_types(model):
+    if isinstance(model, SeriesModelSet) and model.product_types():
+        return model.product_types() + [ALL_PRODUCTS]
+    return DEFAULT_PRODUCT_TYPES + [ALL_PRODUCTS]
+
+# Predict one model and return its forecast and confidence interval as arrays
+def predict_model(model, n_periods):
+    forecast, conf_int = model.predict(n_periods=n_periods, return_conf_int=True)
+    return np.asarray(forecast, dtype=float), np.asarray(conf_int, dtype=float)
+
+# Forecast, lower and upper arrays with one row per product and one column per period
+@timed('predict')
+def predict_products(model, product_types, n_periods):
+    n_products = len(product_types)
+    forecasts = np.empty((n_products, n_periods))
+    lower = np.empty((n_products, n_periods))
+    upper = np.empty((n_products, n_periods))
+
+    # Products with their own model in an artifact set, forecast together in one vectorized pass
+    # and reconciled with the rest of the hierarchy
+    fitted = []
+    if isinstance(model, SeriesModelSet):
+        fitted = [i for i, product_type in enumerate(product_types) if product_type in model.models]
+        if fitted and FORECAST_RECONCILIATION != 'none':
+            rows = model.hierarchy.rows([product_types[i] for i in fitted])
+            reconciled = model.reconciled_forecast(n_periods)
+            forecasts[fitted], lower[fitted], upper[fitted] = (values[rows] for values in reconciled)
+        elif fitted:
+            forecasts[fitted], lower[fitted], upper[fitted] = model.state_space.forecast(
+                n_periods, [product_types[i] for i in fitted]
+            )
+
+    # Every other product shares one prediction of the total model, adjusted per product
+    fitted = set(fitted)
+    simulated = [i for i in range(n_products) if i not in fitted]
+    if simulated:
+        total_model = model.models[TOTAL_SERIES] if isinstance(model, SeriesModelSet) else model
+        forecast, conf_int = predict_model(total_model, n_periods)
+        scale = 1 + product_adjustment_factors([product_types[i] for i in simulated])
+        forecasts[simulated] = np.outer(scale, forecast)
+        lower[simulated] = np.outer(scale, conf_int[:, 0])
+        upper[simulated] = np.outer(scale, conf_int[:, 1])
+
+    return forecasts, lower, upper
+
+# Long-format forecast frame from arrays with one row per product and one column per period
+@timed('build_forecast_frame')
+def build_forecast_frame(start_date, product_types, forecasts, lower, upper, include_total=True):
+    n_products, n_periods = forecasts.shape
+
+    # Calculate resource requirements (e.g., staff hours) with the staffing factors in force now
+    # Ensure that Resource Requirement is non-negative
+    resources = forecasts.clip(min=0) * resource_factors(product_types)[:, None]
+
+    forecast_index = pd.date_range(start=start_date, periods=n_periods, freq='M')
+    forecast_df = pd.DataFrame({
+        'Date': np.tile(forecast_index.values, n_products),
+        'Forecast': forecasts.ravel(),
+        'Lower CI': lower.ravel(),
+        'Upper CI': upper.ravel(),
+        'Product': np.repeat(product_types, n_periods),
+        'Resource Requirement': resources.ravel()
+    })
+
+    if include_total:
+        # Aggregated rows for all selected products; the interval of a sum comes from the summed
+        # variances, not the summed bounds
+        total, total_lower, total_upper = sum_forecasts(forecasts, lower, upper)
+        total_df = pd.DataFrame({
+            'Date': forecast_index,
+            'Forecast': total,
+            'Lower CI': total_lower,
+            'Upper CI': total_upper,
+            'Product': ALL_PRODUCTS,
+            'Resource Requirement': resources.sum(axis=0)
+        })
+        forecast_df = pd.concat([forecast_df, total_df], ignore_index=True)
+
+    return forecast_df
+
+# Generate forecasts for several products from as few model predictions as possible
+@timed('generate_forecast')
+def generate_batch_forecast(start_date, end_date, product_types, model, include_total=True):
+    if model and len(product_types) > 0:
+        product_types = list(product_types)
+        n_periods = forecast_periods(start_date, end_date)
+
+        # Rows are products, columns are periods
+        forecasts, lower, upper = predict_products(model, product_types, n_periods)
+        return build_forecast_frame(start_date, product_types, forecasts, lower, upper, include_total=include_total)
+    return None
+
+# Split a batch forecast into its per-product rows and aggregated rows
+@timed('aggregate_forecast')
+def split_batch_forecast(batch_forecast_df):
+    is_total = batch_forecast_df['Product'] == ALL_PRODUCTS
+    per_product = batch_forecast_df[~is_total].reset_index(drop=True)
+    aggregated = batch_forecast_df[is_total].reset_index(drop=True)
+    return per_product, aggregated
+
+# Generate model predictions
+def generate_forecast(start_date, end_date, product_type, model):
+    return generate_batch_forecast(start_date, end_date, [product_type], model, include_total=False)
+
+# Batch forecast read from the precomputed forecast store, or None when the store cannot serve it;
+# staff hours are derived from the stored forecasts on every lookup
+@timed('forecast_store_lookup')
+def stored_batch_forecast(start_date, end_date, product_types, version, registry, include_total=True):
+    store = open_forecast_store(version)
+    if store is None or store.model_token != registry.version_token(version):
+        return None
+    arrays = store.lookup(product_types, forecast_periods(start_date, end_date))
+    if arrays is None:
+        return None
+    return build_forecast_frame(start_date, list(product_types), *arrays, include_total=include_total)
+
+# Batch forecast for a loaded model version: the forecast store when it is fresh, live inference otherwise
+def version_batch_forecast(start_date, end_date, product_types, version, model, registry, include_total=True):
+    forecast_df = stored_batch_forecast(start_date, end_date, product_types, version, registry, include_total)
+    if forecast_df is None:
+        forecast_df = generate_batch_forecast(start_date, end_date, product_types, model, include_total)
+    return forecast_df
+
+# Cache key of a batch forecast request
+def forecast_cache_key(start_date, end_date, product_types, version_token, include_total):
+    return (
+        version_token,
+        pd.Timestamp(start_date),
+        forecast_periods(start_date, end_date),
+        tuple(sorted(product_types)),
+        include_total
+    )
+
+# Rows of a batch forecast computed for computed_order, rearranged into requested_order. Rows of
+# product p are the p-th block of n_periods rows; any total rows stay at the end.
+def reorder_forecast_products(forecast_df, computed_order, requested_order, n_periods):
+    if list(computed_order) == list(requested_order):
+        return forecast_df
+    position = {product: i for i, product in enumerate(computed_order)}
+    blocks = np.array([position[product] for product in requested_order])
+    rows = (blocks[:, None] * n_periods + np.arange(n_periods)).ravel()
+    rows = np.concatenate([rows, np.arange(len(computed_order) * n_periods, len(forecast_df))])
+    return forecast_df.iloc[rows].reset_index(drop=True)
+
+# Item x store series of the given items in an artifact set; empty for single models
+def store_series(model, product_types):
+    if not isinstance(model, SeriesModelSet):
+        return []
+    items = set(product_types)
+    return sorted(
+        key for key, entry in model.manifest['series'].items()
+        if key in model.models and entry['store'] is not None and entry['item'] in items
+    )
+
+# Staff-hour percentiles per store and period, simulated from a batch forecast of the given series
+# without totals; returns the percentile frame and the simulation time
+@timed('staffing_simulation')
+def staffing_percentiles(forecast_df, series_keys, n_periods, n_scenarios=STAFFING_SCENARIOS, seed=None):
+    # The frame holds the periods of each series in turn
+    forecasts, lower, upper = (
+        forecast_df[column].to_numpy(dtype=float).reshape(len(series_keys), n_periods)
+        for column in ('Forecast', 'Lower CI', 'Upper CI')
+    )
+    result = simulate_staffing(forecasts, lower, upper, resource_factors(series_keys), staffing_groups(series_keys),
+                               n_scenarios=n_scenarios, seed=seed)
+
+    quantiles = result['quantiles']
+    dates = forecast_df['Date'].iloc[:n_periods].to_numpy()
+    n_groups = len(result['groups'])
+    staffing_df = pd.DataFrame({
+        'Store': np.repeat(result['groups'], n_periods),
+        'Date': np.tile(dates, n_groups),
+        'Mean': result['mean'].ravel(),
+        **{f"P{round(q * 100)}": quantiles[:, :, j].ravel() for j, q in enumerate(STAFFING_QUANTILES)},
+    })
+    return staffing_df, result['seconds']
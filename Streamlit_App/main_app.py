@@ -6,14 +6,34 @@ import pandas as pd
 import os
 import numpy as np
 # Import functions from other files
-from model_utils import load_model, generate_forecast
-from assistant_utils import ai_assistant_interaction
-from plot_utils import (
-    plot_aggregated_forecast,
-    plot_cumulative_sales_chart,
-    plot_sales_heatmap,
-    plot_resource_allocation  # Import the new function
+from model_utils import (
+    available_model_versions,
+    forecasting_ready,
+    version_product_types,
+    version_overview_forecast,
+    model_version_token,
+    cached_batch_forecast,
+    version_store_forecast,
+    forecast_cache_stats,
+    version_staffing_simulation
 )
+from forecast_utils import default_model_version, split_batch_forecast
+from collections import OrderedDict
+from cube_utils import load_sales_cube
+from perf_utils import recorder, set_sample_rate, span
+
+# Dashboard views; only the selected one runs on a rerun, and each is a fragment so its own
+# widgets rerun just that view
+VIEWS = ["Chat with AI", "Fashion Retail Forecast", "Resource Allocation Dashboard"]
+
+# Forecasts kept per session for reuse between the forecast and resource views
+SESSION_FORECASTS = 4
+
+# Scenario counts offered for the staffing simulation
+STAFFING_SCENARIO_OPTIONS = [10_000, 50_000, 100_000, 250_000]
+
+# Users who see the performance panel
+ADMIN_USERS = set(os.getenv('DASHBOARD_ADMINS', 'admin').split(','))
 
 # Simple authentication
 def authenticate(username, password):
@@ -37,6 +57,204 @@ def logout():
     st.session_state['logged_in'] = False
     st.sidebar.success("Logged out successfully.")
 
+# Forecast for the selected products, computed once per session for identical inputs
+def session_forecast(start_date, end_date, selected_products, product_types, version):
+    # If "All Products" is selected, include all products
+    if "All Products" in selected_products:
+        selected_products = product_types[:-1]  # Exclude "All Products" from the list
+
+    key = (version, start_date, end_date, tuple(selected_products))
+    forecasts = st.session_state.setdefault('session_forecasts', OrderedDict())
+    if key not in forecasts:
+        # Generate forecasts for all selected products in one batch
+        batch_forecast_df = cached_batch_forecast(start_date, end_date, selected_products, version)
+        if batch_forecast_df is None:
+            return None
+        forecasts[key] = split_batch_forecast(batch_forecast_df)
+        while len(forecasts) > SESSION_FORECASTS:
+            forecasts.popitem(last=False)
+    forecasts.move_to_end(key)
+    return forecasts[key]
+
+# AI Assistant Interaction; the assistant and its OpenAI client load on first use
+@st.fragment
+def assistant_view(model_version):
+    from assistant_utils import ai_assistant_interaction
+    ai_assistant_interaction(model_version, version_overview_forecast, model_version_token)
+
+# Forecast Dashboard
+@st.fragment
+def forecast_view(model_version):
+    st.subheader('Fashion Retail Trend Forecast Dashboard')
+    st.write("""
+        This section provides sales forecasts for various fashion retail products.
+        Use the options below to specify the date range and product types you're interested in.
+        The model uses historical data to make these forecasts, which are shown in the interactive charts below.
+
+        **Limitations of the Predictive Model:**
+        - **Data Quality**: The accuracy of the forecasts depends on the quality and completeness of the historical data.
+        - **Market Volatility**: Sudden market changes, economic events, or unforeseen circumstances may impact actual sales differently than predicted.
+        - **Assumptions**: The model makes certain assumptions about trends and patterns that may not hold in all situations.
+
+        **Please use these forecasts as guidance and complement them with professional expertise and current market analysis.**
+    """)
+
+    from plot_utils import (
+        plot_aggregated_forecast,
+        plot_cumulative_sales_chart,
+        plot_historical_sales,
+        plot_sales_heatmap,
+    )
+
+    # Load the model (and pmdarima) only once a forecasting view opens, unless a forecast service does the forecasting
+    model_ready = forecasting_ready(model_version)
+
+    # Historical sales from the pre-aggregated sales cube
+    with st.expander("Historical Sales"):
+        try:
+            sales_cube = load_sales_cube()
+        except FileNotFoundError:
+            st.info("Sales data not found.")
+        else:
+            col1, col2 = st.columns(2)
+            col1.metric("Average Monthly Sales", f"${sales_cube.average_last_months(len(sales_cube.months)):,.2f}")
+            col2.metric("Last 12 Months Average", f"${sales_cube.average_last_months(12):,.2f}")
+            plot_historical_sales(sales_cube.monthly_sales())
+
+    # Date range selection
+    col1, col2 = st.columns(2)
+    start_date = col1.date_input("Select start date", datetime.today())
+    end_date = col2.date_input("Select end date", datetime.today() + timedelta(days=90))
+
+    if (end_date - start_date).days < 30:
+        st.warning("Please select a date range of at least 30 days for meaningful predictions.")
+
+    # Product type selection
+    product_types = version_product_types(model_version)
+    selected_products = st.multiselect("Select product types", product_types, default=["All Products"])
+
+    if st.button('Predict Sales', key='predict'):
+        if model_ready:
+            # Kept in the session so chart controls and the resource view reuse the forecast
+            with span('predict_sales', products=len(selected_products)):
+                forecast_result = session_forecast(start_date, end_date, selected_products, product_types, model_version)
+            if forecast_result is not None:
+                st.session_state['forecast_result'] = forecast_result
+                st.session_state['forecast_request'] = (start_date, end_date, selected_products)
+            else:
+                st.session_state.pop('forecast_result', None)
+                st.error("No forecasts to display.")
+        else:
+            st.error('Model not loaded. Please check model path or load model.')
+
+    if 'forecast_result' in st.session_state:
+        combined_forecast_df, aggregated_forecast = st.session_state['forecast_result']
+
+        # Create tabs for multiple charts
+        chart_tab1, chart_tab2, chart_tab3 = st.tabs(
+            ["Aggregated Forecast", "Cumulative Sales", "Sales Heatmap"]
+        )
+
+        with chart_tab1:
+            st.subheader("Aggregated Sales Forecast")
+            plot_aggregated_forecast(aggregated_forecast)
+
+        with chart_tab2:
+            st.subheader("Cumulative Sales Forecast")
+            plot_cumulative_sales_chart(aggregated_forecast)
+
+        with chart_tab3:
+            st.subheader("Sales Forecast Heatmap")
+            # Item x store series when the version has store models, so rows can be grouped by store cluster
+            forecast_start, forecast_end, _ = st.session_state['forecast_request']
+            items = combined_forecast_df['Product'].unique().tolist()
+            store_forecast_df = version_store_forecast(forecast_start, forecast_end, items, model_version)
+            plot_sales_heatmap(store_forecast_df if store_forecast_df is not None else combined_forecast_df)
+
+# Resource Allocation Dashboard
+@st.fragment
+def resource_view(model_version):
+    st.subheader('Resource Allocation Dashboard')
+    st.write("""
+        This section assists in operational planning and workforce management by calculating resource requirements based on forecasted sales volumes.
+        Use the options below to specify the date range and product types you're interested in.
+        The model calculates the resources needed to meet the predicted demand, helping you optimize your operations.
+
+        **Assumptions:**
+        - **Resource Factor:** For this example, we assume that 0.1 staff hours are required per unit sold. Per-item and per-store factors can be set in the file named by `STAFFING_FACTORS_FILE`.
+        - **Staffing Percentiles:** The simulation samples demand scenarios from the forecast intervals and reports the staff hours needed per store at the 50th, 90th and 95th percentiles.
+    """)
+
+    from plot_utils import plot_resource_allocation
+
+    model_ready = forecasting_ready(model_version)
+
+    # Start from the forecast view's last request so its forecast is reused
+    default_start, default_end, default_products = st.session_state.get(
+        'forecast_request', (datetime.today(), datetime.today() + timedelta(days=90), ["All Products"])
+    )
+
+    # Date range selection
+    col1_res, col2_res = st.columns(2)
+    start_date_res = col1_res.date_input("Select start date for resource allocation", default_start, key='res_start_date')
+    end_date_res = col2_res.date_input("Select end date for resource allocation", default_end, key='res_end_date')
+
+    if (end_date_res - start_date_res).days < 30:
+        st.warning("Please select a date range of at least 30 days for meaningful predictions.")
+
+    # Product type selection
+    product_types_res = version_product_types(model_version)
+    selected_products_res = st.multiselect("Select product types for resource allocation", product_types_res, default=[product for product in default_products if product in product_types_res], key='res_products')
+
+    if st.button('Calculate Resource Requirements', key='calculate_resources'):
+        if model_ready:
+            st.session_state['resource_request'] = (start_date_res, end_date_res, selected_products_res)
+        else:
+            st.error('Model not loaded. Please check model path or load model.')
+
+    # Shown until the inputs change, and straight away for the forecast view's last request;
+    # the forecast comes from the session when already computed
+    resource_request = (start_date_res, end_date_res, selected_products_res)
+    if resource_request in (st.session_state.get('resource_request'), st.session_state.get('forecast_request')):
+        forecast_result = session_forecast(start_date_res, end_date_res, selected_products_res, product_types_res, model_version)
+        if forecast_result is not None:
+            _, aggregated_forecast_res = forecast_result
+            # Aggregated resource requirements
+            aggregated_resource = aggregated_forecast_res[['Date', 'Resource Requirement']]
+
+            # Plot resource allocation
+            plot_resource_allocation(aggregated_resource)
+            staffing_section(start_date_res, end_date_res, selected_products_res, product_types_res, model_version)
+        else:
+            st.error("No resource requirements to display.")
+
+# Staffing percentiles per store, simulated on request and kept in the session until the inputs change
+def staffing_section(start_date, end_date, selected_products, product_types, version):
+    from plot_utils import plot_staffing_percentiles
+
+    st.subheader("Staffing Percentiles")
+    if "All Products" in selected_products:
+        selected_products = product_types[:-1]
+
+    col1, col2 = st.columns(2)
+    n_scenarios = col1.select_slider("Scenarios", STAFFING_SCENARIO_OPTIONS, value=100_000, key='staffing_scenarios')
+    seed = int(col2.number_input("Random seed", min_value=0, value=0, step=1, key='staffing_seed'))
+
+    staffing_request = (version, start_date, end_date, tuple(selected_products), n_scenarios, seed)
+    if st.button('Simulate Staffing', key='simulate_staffing'):
+        with st.spinner(f"Simulating {n_scenarios:,} demand scenarios..."):
+            st.session_state['staffing_result'] = (
+                staffing_request,
+                version_staffing_simulation(start_date, end_date, selected_products, version, n_scenarios, seed),
+            )
+
+    request, result = st.session_state.get('staffing_result', (None, None))
+    if request == staffing_request and result is not None:
+        staffing_df, seconds = result
+        plot_staffing_percentiles(staffing_df, seconds)
+    elif request == staffing_request:
+        st.error("No staffing simulation to display.")
+
 # Page configuration
 st.set_page_config(page_title="Comprehensive Dashboard", page_icon=":chart_with_upwards_trend:", layout="wide")
 
@@ -69,142 +287,48 @@ if st.session_state.get('logged_in'):
         **Please note:** Our predictive model uses historical data to make forecasts. While we strive for accuracy, the model may have limitations due to factors like data quality, market volatility, and unforeseen events. Always consider these forecasts as estimates and complement them with professional judgment.
     """)
 
-    tab1, tab2, tab3 = st.tabs(["Chat with AI", "Fashion Retail Forecast", "Resource Allocation Dashboard"])
-
-    # Load the model
-    model = load_model('autoarima_model.pkl')
-
-    # AI Assistant Interaction
-    with tab1:
-        ai_assistant_interaction(model, generate_forecast)
-
-    # Forecast Dashboard
-    with tab2:
-        st.subheader('Fashion Retail Trend Forecast Dashboard')
-        st.write("""
-            This section provides sales forecasts for various fashion retail products.
-            Use the options below to specify the date range and product types you're interested in.
-            The model uses historical data to make these forecasts, which are shown in the interactive charts below.
-
-            **Limitations of the Predictive Model:**
-            - **Data Quality**: The accuracy of the forecasts depends on the quality and completeness of the historical data.
-            - **Market Volatility**: Sudden market changes, economic events, or unforeseen circumstances may impact actual sales differently than predicted.
-            - **Assumptions**: The model makes certain assumptions about trends and patterns that may not hold in all situations.
-
-            **Please use these forecasts as guidance and complement them with professional expertise and current market analysis.**
-        """)
-
-        # Date range selection
-        col1, col2 = st.columns(2)
-        start_date = col1.date_input("Select start date", datetime.today())
-        end_date = col2.date_input("Select end date", datetime.today() + timedelta(days=90))
-
-        if (end_date - start_date).days < 30:
-            st.warning("Please select a date range of at least 30 days for meaningful predictions.")
-
-        # Product type selection
-        product_types = [
-            "Women's Dresses", "Jeans", "Casual Wear", "Formal Wear", "Athletic Apparel",
-            "Footwear", "Accessories", "Handbags", "Children's Clothing", "All Products"
-        ]
-        selected_products = st.multiselect("Select product types", product_types, default=["All Products"])
-
-        if st.button('Predict Sales', key='predict'):
-            if model:
-                # If "All Products" is selected, include all products
-                if "All Products" in selected_products:
-                    selected_products = product_types[:-1]  # Exclude "All Products" from the list
-
-                # Generate forecasts for all selected products
-                all_forecasts = []
-                for product_type in selected_products:
-                    forecast_df = generate_forecast(start_date, end_date, product_type, model)
-                    if forecast_df is not None:
-                        all_forecasts.append(forecast_df)
-                    else:
-                        st.error(f"Could not generate forecast for {product_type}.")
-
-                if all_forecasts:
-                    combined_forecast_df = pd.concat(all_forecasts, ignore_index=True)
-
-                    # Aggregate forecasts
-                    aggregated_forecast = combined_forecast_df.groupby('Date').sum().reset_index()
-                    aggregated_forecast['Product'] = 'All Products'
-
-                    # Create tabs for multiple charts
-                    chart_tab1, chart_tab2, chart_tab3 = st.tabs(
-                        ["Aggregated Forecast", "Cumulative Sales", "Sales Heatmap"]
-                    )
-
-                    with chart_tab1:
-                        st.subheader("Aggregated Sales Forecast")
-                        plot_aggregated_forecast(aggregated_forecast)
-
-                    with chart_tab2:
-                        st.subheader("Cumulative Sales Forecast")
-                        plot_cumulative_sales_chart(aggregated_forecast)
-
-                    with chart_tab3:
-                        st.subheader("Sales Forecast Heatmap")
-                        plot_sales_heatmap(combined_forecast_df)
-                else:
-                    st.error("No forecasts to display.")
-            else:
-                st.error('Model not loaded. Please check model path or load model.')
-
-    # Resource Allocation Dashboard
-    with tab3:
-        st.subheader('Resource Allocation Dashboard')
-        st.write("""
-            This section assists in operational planning and workforce management by calculating resource requirements based on forecasted sales volumes.
-            Use the options below to specify the date range and product types you're interested in.
-            The model calculates the resources needed to meet the predicted demand, helping you optimize your operations.
-
-            **Assumptions:**
-            - **Resource Factor:** For this example, we assume that 0.1 staff hours are required per unit sold. You can adjust this factor in the model according to your business needs.
-        """)
-
-        # Date range selection
-        col1_res, col2_res = st.columns(2)
-        start_date_res = col1_res.date_input("Select start date for resource allocation", datetime.today(), key='res_start_date')
-        end_date_res = col2_res.date_input("Select end date for resource allocation", datetime.today() + timedelta(days=90), key='res_end_date')
-
-        if (end_date_res - start_date_res).days < 30:
-            st.warning("Please select a date range of at least 30 days for meaningful predictions.")
-
-        # Product type selection
-        product_types_res = [
-            "Women's Dresses", "Jeans", "Casual Wear", "Formal Wear", "Athletic Apparel",
-            "Footwear", "Accessories", "Handbags", "Children's Clothing", "All Products"
-        ]
-        selected_products_res = st.multiselect("Select product types for resource allocation", product_types_res, default=["All Products"], key='res_products')
-
-        if st.button('Calculate Resource Requirements', key='calculate_resources'):
-            if model:
-                # If "All Products" is selected, include all products
-                if "All Products" in selected_products_res:
-                    selected_products_res = product_types_res[:-1]  # Exclude "All Products" from the list
-
-                # Generate forecasts and resource requirements for all selected products
-                all_resource_forecasts = []
-                for product_type in selected_products_res:
-                    forecast_df = generate_forecast(start_date_res, end_date_res, product_type, model)
-                    if forecast_df is not None:
-                        all_resource_forecasts.append(forecast_df[['Date', 'Resource Requirement']])
-                    else:
-                        st.error(f"Could not generate resource requirements for {product_type}.")
-
-                if all_resource_forecasts:
-                    combined_resource_df = pd.concat(all_resource_forecasts, ignore_index=True)
-                    # Aggregate resource requirements
-                    aggregated_resource = combined_resource_df.groupby('Date').sum().reset_index()
-
-                    # Plot resource allocation
-                    plot_resource_allocation(aggregated_resource)
-                else:
-                    st.error("No resource requirements to display.")
+    # Pin a model version for this session; the model itself is shared across sessions
+    model_versions = available_model_versions()
+    default_version = default_model_version()
+    st.sidebar.selectbox(
+        "Model version", model_versions,
+        index=model_versions.index(default_version) if default_version in model_versions else 0,
+        key='model_version'
+    )
+
+    model_version = st.session_state['model_version']
+
+    # Shared forecast cache usage, for sizing the cache
+    with st.sidebar.expander("Forecast cache"):
+        st.json(forecast_cache_stats())
+
+    # Timing spans of this server process, for admins
+    if st.session_state.get('username') in ADMIN_USERS:
+        with st.sidebar.expander("Performance"):
+            sample_rate = st.slider("Span sampling rate", 0.0, 1.0, float(recorder.sample_rate), 0.05)
+            if sample_rate != recorder.sample_rate:
+                set_sample_rate(sample_rate)
+            if st.button("Reset spans"):
+                recorder.reset()
+            summary = recorder.summary()
+            if summary:
+                st.dataframe(pd.DataFrame(summary).round(2), hide_index=True)
             else:
-                st.error('Model not loaded. Please check model path or load model.')
+                st.caption("No spans recorded. Raise the sampling rate to start recording.")
+
+    # Only the selected view runs, so working in one view does not re-run the others
+    active_view = st.radio("View", VIEWS, horizontal=True, key='active_view', label_visibility='collapsed')
+    if active_view == VIEWS[0]:
+        assistant_view(model_version)
+        from assistant_utils import assistant_cache_panel
+        assistant_cache_panel()
+    elif active_view == VIEWS[1]:
+        forecast_view(model_version)
+    else:
+        resource_view(model_version)
 
 else:
     st.sidebar.warning("Please log in to access the dashboard.")
+
+# Export span metrics for monitoring (PERF_METRICS_FILE), throttled across reruns
+recorder.write_metrics_file()
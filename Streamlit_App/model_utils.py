@@ -1,49 +1,160 @@
 # model_utils.py
+#
+# Streamlit layer over forecast_utils: the model registry and forecast cache shared across
+# sessions, and the forecast service client when one is configured.
 
-import joblib
-import pandas as pd
-from datetime import datetime
-import numpy as np
+import os
 import streamlit as st
+from cache_utils import ResultCache
+from perf_utils import span, timed
+from staffing_utils import STAFFING_SCENARIOS
+from forecast_utils import (
+    ALL_PRODUCTS,
+    DEFAULT_MODEL_PATH,
+    FORECAST_CACHE_SIZE,
+    FORECAST_CACHE_TTL,
+    ModelRegistry,
+    available_product_types,
+    discover_model_versions,
+    forecast_cache_key,
+    reorder_forecast_products,
+    forecast_periods,
+    model_version_name,
+    staffing_percentiles,
+    store_series,
+    version_batch_forecast,
+)
 
-# Load the model
-def load_model(path):
+# Standalone forecast service used instead of in-process inference, e.g. http://127.0.0.1:8502
+FORECAST_SERVICE_URL = os.getenv('FORECAST_SERVICE_URL')
+
+# Registry shared across sessions and reruns of the Streamlit script
+@st.cache_resource
+def get_model_registry():
+    registry = ModelRegistry()
+    registry.register(model_version_name(DEFAULT_MODEL_PATH), DEFAULT_MODEL_PATH)
+    return discover_model_versions(registry)
+
+# Names of every model version available to the dashboard
+def available_model_versions():
+    client = get_forecast_client()
+    if client is not None:
+        return client.versions()['versions']
+    return discover_model_versions(get_model_registry()).versions()
+
+# Load a registered model version
+def load_model_version(name):
     try:
-        return joblib.load(path)
-    except FileNotFoundError:
+        return get_model_registry().get(name)
+    except (FileNotFoundError, KeyError):
         st.error('Error: Model file not found.')
         return None
     except Exception as e:
         st.error(f'An error occurred while loading the model: {e}')
         return None
 
-# Generate model predictions
-def generate_forecast(start_date, end_date, product_type, model):
-    if model:
-        n_periods = (end_date - start_date).days // 30
-        if n_periods < 1:
-            n_periods = 1
-
-        forecast, conf_int = model.predict(n_periods=n_periods, return_conf_int=True)
-
-        # Adjust forecast to simulate different products
-        adjustment_factor = (hash(product_type) % 5) / 100  # Creates a small variation
-        forecast_adjusted = forecast * (1 + adjustment_factor)
-        conf_int_adjusted = conf_int * (1 + adjustment_factor)
-
-        forecast_index = pd.date_range(start=start_date, periods=n_periods, freq='M')
-        forecast_df = pd.DataFrame({
-            'Date': forecast_index,
-            'Forecast': forecast_adjusted,
-            'Lower CI': conf_int_adjusted[:, 0],
-            'Upper CI': conf_int_adjusted[:, 1],
-            'Product': product_type
-        })
-
-        # Calculate resource requirements (e.g., staff hours)
-        # Ensure that Resource Requirement is non-negative
-        resource_factor = 0.1  # Adjust this factor based on your business needs
-        forecast_df['Resource Requirement'] = forecast_df['Forecast'].clip(lower=0) * resource_factor
-
-        return forecast_df
-    return None
+# Load the model
+def load_model(path):
+    name = model_version_name(path)
+    get_model_registry().register(name, path)
+    return load_model_version(name)
+
+# Forecast results shared across sessions and reruns
+@st.cache_resource
+def get_forecast_cache():
+    return ResultCache(max_entries=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL)
+
+# Client of the standalone forecast service, when one is configured
+@st.cache_resource
+def get_forecast_client():
+    if not FORECAST_SERVICE_URL:
+        return None
+    from service_utils import ForecastClient
+    return ForecastClient(FORECAST_SERVICE_URL)
+
+# Whether forecasts can be produced for a model version, locally or through the service
+def forecasting_ready(version):
+    if get_forecast_client() is not None:
+        return True
+    return bool(load_model_version(version))
+
+# Identifies the artifact behind a model version, so results derived from it change when it is retrained
+def model_version_token(version):
+    client = get_forecast_client()
+    if client is not None:
+        return client.versions().get('tokens', {}).get(version, version)
+    registry = get_model_registry()
+    registry.get(version)
+    return registry.version_token(version)
+
+# Products offered for a model version
+def version_product_types(version):
+    client = get_forecast_client()
+    if client is not None:
+        return client.product_types(version)
+    return available_product_types(load_model_version(version))
+
+# Batch forecast for a model version, computed once for identical requests from any session.
+# With a forecast service configured the service does the work and the caching.
+@timed('batch_forecast')
+def cached_batch_forecast(start_date, end_date, product_types, version, include_total=True):
+    if len(product_types) == 0:
+        return None
+
+    client = get_forecast_client()
+    if client is not None:
+        with span('forecast_service_call', products=len(product_types)):
+            return client.batch_forecast(start_date, end_date, product_types, version, include_total)
+
+    model = load_model_version(version)
+    if not model:
+        return None
+
+    # The key ignores product order, so the shared result is computed in sorted order and
+    # rearranged into the order asked for
+    sorted_products = sorted(product_types)
+    key = forecast_cache_key(start_date, end_date, product_types, get_model_registry().version_token(version), include_total)
+    forecast_df = get_forecast_cache().get_or_compute(
+        key, lambda: version_batch_forecast(start_date, end_date, sorted_products, version, model, get_model_registry(), include_total)
+    )
+    if forecast_df is None:
+        return None
+    forecast_df = reorder_forecast_products(forecast_df, sorted_products, product_types, forecast_periods(start_date, end_date))
+    # Callers get their own copy so the shared result is never modified
+    return forecast_df.copy()
+
+# Item x store series of the given items in a version's artifact set; empty when the version has
+# none or forecasts come from the service
+def version_store_series(version, product_types):
+    if get_forecast_client() is not None:
+        return []
+    return store_series(load_model_version(version), product_types)
+
+# Forecasts of the item x store series of the selected items, or None when the version has no store
+# models or forecasts come from the service
+def version_store_forecast(start_date, end_date, product_types, version):
+    series_keys = version_store_series(version, product_types)
+    if not series_keys:
+        return None
+    return cached_batch_forecast(start_date, end_date, series_keys, version, include_total=False)
+
+# Staff-hour percentiles per store and period for the selected items, simulated from the forecast
+# distributions of their item x store series (or of the items themselves without store models)
+def version_staffing_simulation(start_date, end_date, product_types, version, n_scenarios=STAFFING_SCENARIOS, seed=None):
+    series_keys = version_store_series(version, product_types) or list(product_types)
+    forecast_df = cached_batch_forecast(start_date, end_date, series_keys, version, include_total=False)
+    if forecast_df is None:
+        return None
+    return staffing_percentiles(forecast_df, series_keys, forecast_periods(start_date, end_date), n_scenarios, seed)
+
+# Forecast of every product of a version and their total, used as the assistant's context
+def version_overview_forecast(start_date, end_date, version):
+    product_types = [product for product in version_product_types(version) if product != ALL_PRODUCTS]
+    return cached_batch_forecast(start_date, end_date, product_types, version)
+
+# Hit/miss counters of the shared forecast cache
+def forecast_cache_stats():
+    client = get_forecast_client()
+    if client is not None:
+        return client.stats()
+    return get_forecast_cache().stats()
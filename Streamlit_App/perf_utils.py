@@ -0,0 +1,214 @@
+# perf_utils.py
+#
+# Timing spans around the dashboard's hot paths. A span records wall time, CPU time and the
+# change in resident memory of the code it wraps:
+#
+#     with span('generate_forecast', products=3):
+#         ...
+#
+#     @timed('load_model')
+#     def load_model(path): ...
+#
+# PERF_SAMPLE_RATE sets the share of top-level spans recorded (0 turns recording off; nested
+# spans follow their parent). Recorded spans are logged as JSON lines to the 'perf' logger
+# (and PERF_LOG_FILE), aggregated per span name, and exported in Prometheus text format.
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+PERF_SAMPLE_RATE = float(os.getenv('PERF_SAMPLE_RATE', '0'))
+PERF_LOG_FILE = os.getenv('PERF_LOG_FILE')
+PERF_METRICS_FILE = os.getenv('PERF_METRICS_FILE')
+
+# Recent spans kept for the performance panel
+RECENT_SPANS = 500
+
+# Upper bounds (seconds) of the wall-time histogram buckets
+WALL_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between rewrites of the Prometheus metrics file
+METRICS_FILE_INTERVAL = 15
+
+logger = logging.getLogger('perf')
+if PERF_LOG_FILE:
+    handler = logging.FileHandler(PERF_LOG_FILE)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Resident memory of the process in bytes, None where /proc is not available
+def resident_memory():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+# Per-name aggregates of recorded spans, shared by every thread of the process
+class SpanRecorder:
+    def __init__(self, sample_rate=PERF_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.recent = deque(maxlen=RECENT_SPANS)
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._metrics_written = 0.0
+
+    def record(self, record):
+        with self._lock:
+            self.recent.append(record)
+            totals = self._totals.get(record['name'])
+            if totals is None:
+                totals = self._totals[record['name']] = {
+                    'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'max_wall_seconds': 0.0,
+                    'memory_delta_bytes': 0, 'errors': 0, 'buckets': [0] * len(WALL_TIME_BUCKETS),
+                }
+            totals['count'] += 1
+            totals['wall_seconds'] += record['wall_seconds']
+            totals['cpu_seconds'] += record['cpu_seconds']
+            totals['max_wall_seconds'] = max(totals['max_wall_seconds'], record['wall_seconds'])
+            totals['memory_delta_bytes'] += record['memory_delta_bytes'] or 0
+            totals['errors'] += record['error'] is not None
+            for i, bound in enumerate(WALL_TIME_BUCKETS):
+                if record['wall_seconds'] <= bound:
+                    totals['buckets'][i] += 1
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, default=str))
+
+    # One row per span name, slowest total first
+    def summary(self):
+        with self._lock:
+            rows = [
+                {
+                    'span': name,
+                    'count': totals['count'],
+                    'mean_ms': totals['wall_seconds'] / totals['count'] * 1000,
+                    'max_ms': totals['max_wall_seconds'] * 1000,
+                    'cpu_ms': totals['cpu_seconds'] / totals['count'] * 1000,
+                    'memory_delta_mb': totals['memory_delta_bytes'] / totals['count'] / 2 ** 20,
+                    'errors': totals['errors'],
+                }
+                for name, totals in self._totals.items()
+            ]
+        return sorted(rows, key=lambda row: row['mean_ms'] * row['count'], reverse=True)
+
+    def recent_spans(self, n=50):
+        with self._lock:
+            return list(self.recent)[-n:]
+
+    def prometheus_text(self):
+        with self._lock:
+            totals = {name: dict(values, buckets=list(values['buckets'])) for name, values in self._totals.items()}
+        lines = [
+            '# HELP dashboard_span_seconds Wall time of instrumented dashboard spans.',
+            '# TYPE dashboard_span_seconds histogram',
+        ]
+        for name, values in totals.items():
+            for bound, count in zip(WALL_TIME_BUCKETS, values['buckets']):
+                lines.append(f'dashboard_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'dashboard_span_seconds_bucket{{span="{name}",le="+Inf"}} {values["count"]}')
+            lines.append(f'dashboard_span_seconds_sum{{span="{name}"}} {values["wall_seconds"]:.6f}')
+            lines.append(f'dashboard_span_seconds_count{{span="{name}"}} {values["count"]}')
+        for metric, key, help_text in (
+            ('dashboard_span_cpu_seconds_total', 'cpu_seconds', 'CPU time of instrumented dashboard spans.'),
+            ('dashboard_span_memory_delta_bytes_total', 'memory_delta_bytes', 'Resident memory change of instrumented dashboard spans.'),
+            ('dashboard_span_errors_total', 'errors', 'Instrumented dashboard spans that raised.'),
+        ):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for name, values in totals.items():
+                lines.append(f'{metric}{{span="{name}"}} {values[key]}')
+        return '\n'.join(lines) + '\n'
+
+    # Rewrite the metrics file for a node-exporter textfile collector, at most every interval
+    def write_metrics_file(self, path=PERF_METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+        now = time.monotonic()
+        if not path or now - self._metrics_written < interval:
+            return False
+        self._metrics_written = now
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.recent.clear()
+            self._totals.clear()
+
+recorder = SpanRecorder()
+
+# Whether the current thread is inside a recorded span
+_state = threading.local()
+
+@contextmanager
+def span(name, **labels):
+    sampled = getattr(_state, 'sampled', None)
+    top_level = sampled is None
+    if top_level:
+        sampled = recorder.sample_rate > 0 and random.random() < recorder.sample_rate
+    if not sampled:
+        # Unsampled trees stay unsampled down to their leaves
+        if top_level:
+            _state.sampled = False
+            try:
+                yield
+            finally:
+                _state.sampled = None
+        else:
+            yield
+        return
+
+    _state.sampled = True
+    memory_before = resident_memory()
+    cpu_before = time.thread_time()
+    began = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        wall = time.perf_counter() - began
+        cpu = time.thread_time() - cpu_before
+        memory_after = resident_memory()
+        if top_level:
+            _state.sampled = None
+        recorder.record({
+            'name': name,
+            'timestamp': time.time(),
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'memory_delta_bytes': memory_after - memory_before if memory_before is not None and memory_after is not None else None,
+            'thread': threading.current_thread().name,
+            'error': error,
+            'labels': labels,
+        })
+
+# Decorator wrapping every call of a function in a span
+def timed(name=None):
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Skip the span machinery entirely while recording is off
+            if not recorder.sample_rate and getattr(_state, 'sampled', None) is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def set_sample_rate(rate):
+    recorder.sample_rate = min(max(float(rate), 0.0), 1.0)
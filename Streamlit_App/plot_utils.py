@@ -1,63 +1,45 @@
 # plot_utils.py
 
-import plotly.graph_objects as go
+import os
+import plotly.io as pio
 import streamlit as st
 import pandas as pd
-
+from cache_utils import ResultCache
+from perf_utils import span, timed
+from figure_utils import (
+    HEATMAP_MAX_ROWS,
+    POINT_BUDGET,
+    WEBGL_THRESHOLD,
+    build_aggregated_forecast_figure,
+    build_cumulative_sales_figure,
+    build_historical_sales_figure,
+    build_resource_allocation_figure,
+    build_sales_heatmap_figure,
+    build_staffing_figure,
+    data_fingerprint,
+    heatmap_levels,
+    heatmap_row_labels,
+    serialize_figure,
+)
+
+# Number of serialized figures kept for reruns and other sessions
+FIGURE_CACHE_SIZE = int(os.getenv('FIGURE_CACHE_SIZE', '128'))
+
+# Serialized figures shared across sessions and reruns
+@st.cache_resource
+def get_figure_cache():
+    return ResultCache(max_entries=FIGURE_CACHE_SIZE)
+
+# Build a figure once per distinct input and reuse its serialized form afterwards
+def cached_figure(builder, df, columns):
+    key = (builder.__name__, data_fingerprint(df, columns), POINT_BUDGET, WEBGL_THRESHOLD)
+    figure_json = get_figure_cache().get_or_compute(key, lambda: serialize_figure(builder, df))
+    with span('figure_deserialize', figure=builder.__name__):
+        return pio.from_json(figure_json, skip_invalid=True)
+
+@timed()
 def plot_aggregated_forecast(aggregated_forecast):
-    # Plot aggregated forecast
-    fig = go.Figure()
-
-    # Create a trace for the forecast line
-    fig.add_trace(go.Scatter(
-        x=aggregated_forecast['Date'],
-        y=aggregated_forecast['Forecast'],
-        mode='lines+markers',
-        line=dict(width=2, color='white'),
-        marker=dict(size=5, color='white'),
-        name='Forecast',
-    ))
-
-    # Fill positive area (Profit) with green color
-    fig.add_trace(go.Scatter(
-        x=aggregated_forecast['Date'],
-        y=aggregated_forecast['Forecast'].clip(lower=0),
-        mode='lines',
-        line=dict(width=0),
-        fill='tozeroy',
-        fillcolor='rgba(0, 255, 0, 0.5)',
-        name='Profit',
-        hoverinfo='skip',
-        showlegend=True
-    ))
-
-    # Fill negative area (Loss) with red color
-    fig.add_trace(go.Scatter(
-        x=aggregated_forecast['Date'],
-        y=aggregated_forecast['Forecast'].clip(upper=0),
-        mode='lines',
-        line=dict(width=0),
-        fill='tozeroy',
-        fillcolor='rgba(255, 0, 0, 0.5)',
-        name='Loss',
-        hoverinfo='skip',
-        showlegend=True
-    ))
-
-    # Update layout
-    fig.update_layout(
-        title='Aggregated Sales Forecast for All Products',
-        xaxis_title='Date',
-        yaxis_title='Predicted Sales (Profit/Loss)',
-        template='plotly_dark',
-        plot_bgcolor='black',
-        paper_bgcolor='black',
-        font=dict(color="white"),
-        hovermode='x unified',
-        showlegend=True,
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
-
+    fig = cached_figure(build_aggregated_forecast_figure, aggregated_forecast, ['Date', 'Forecast'])
     st.plotly_chart(fig, use_container_width=True)
 
     # Help message
@@ -74,63 +56,9 @@ def plot_aggregated_forecast(aggregated_forecast):
         Use this plot to understand the overall profit and loss trend for all products combined. The color coding helps quickly identify profitable and non-profitable periods.
     """)
 
+@timed()
 def plot_cumulative_sales_chart(aggregated_forecast):
-    # Calculate cumulative sales
-    aggregated_forecast = aggregated_forecast.sort_values('Date')
-    aggregated_forecast['Cumulative Forecast'] = aggregated_forecast['Forecast'].cumsum()
-
-    fig = go.Figure()
-
-    # Create a trace for the cumulative forecast line
-    fig.add_trace(go.Scatter(
-        x=aggregated_forecast['Date'],
-        y=aggregated_forecast['Cumulative Forecast'],
-        mode='lines+markers',
-        line=dict(width=2, color='white'),
-        marker=dict(size=5, color='white'),
-        name='Cumulative Sales',
-    ))
-
-    # Fill positive area (Cumulative Profit) with green color
-    fig.add_trace(go.Scatter(
-        x=aggregated_forecast['Date'],
-        y=aggregated_forecast['Cumulative Forecast'].clip(lower=0),
-        mode='lines',
-        line=dict(width=0),
-        fill='tozeroy',
-        fillcolor='rgba(0, 255, 0, 0.5)',
-        name='Cumulative Profit',
-        hoverinfo='skip',
-        showlegend=True
-    ))
-
-    # Fill negative area (Cumulative Loss) with red color
-    fig.add_trace(go.Scatter(
-        x=aggregated_forecast['Date'],
-        y=aggregated_forecast['Cumulative Forecast'].clip(upper=0),
-        mode='lines',
-        line=dict(width=0),
-        fill='tozeroy',
-        fillcolor='rgba(255, 0, 0, 0.5)',
-        name='Cumulative Loss',
-        hoverinfo='skip',
-        showlegend=True
-    ))
-
-    # Update layout
-    fig.update_layout(
-        title='Cumulative Sales Forecast',
-        xaxis_title='Date',
-        yaxis_title='Cumulative Predicted Sales (Profit/Loss)',
-        template='plotly_dark',
-        plot_bgcolor='black',
-        paper_bgcolor='black',
-        font=dict(color="white"),
-        hovermode='x unified',
-        showlegend=True,
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
-
+    fig = cached_figure(build_cumulative_sales_figure, aggregated_forecast, ['Date', 'Forecast'])
     st.plotly_chart(fig, use_container_width=True)
 
     # Help message
@@ -147,29 +75,32 @@ def plot_cumulative_sales_chart(aggregated_forecast):
         Use this plot to understand the overall cumulative profit and loss trend over time. The color coding helps quickly identify periods of overall profitability and losses.
     """)
 
+@timed()
 def plot_sales_heatmap(combined_forecast_df):
-    # Pivot the data to create a matrix for the heatmap
-    heatmap_data = combined_forecast_df.pivot(index='Product', columns='Date', values='Forecast')
-
-    fig = go.Figure(data=go.Heatmap(
-        z=heatmap_data.values,
-        x=heatmap_data.columns.strftime('%b %Y'),
-        y=heatmap_data.index,
-        colorscale='Viridis',
-        colorbar_title='Predicted Sales'
-    ))
-
-    # Update layout with black background
-    fig.update_layout(
-        title='Sales Forecast Heatmap',
-        xaxis_title='Date',
-        yaxis_title='Product',
-        template='plotly_dark',
-        plot_bgcolor='black',
-        paper_bgcolor='black',
-        font=dict(color="white")
-    )
-
+    products = combined_forecast_df['Product']
+    level = 'Product'
+
+    # Small catalogs get one row per product; large ones are rolled up with drill-down
+    if products.nunique() > HEATMAP_MAX_ROWS:
+        col1, col2 = st.columns(2)
+        group_level = col1.radio("Group rows by", heatmap_levels(products.values), horizontal=True, key='heatmap_level')
+        group_labels = heatmap_row_labels(products.values, group_level)
+        selected_group = col2.selectbox(
+            "Drill down into", ["(all)"] + sorted(set(group_labels)), key='heatmap_drill'
+        )
+        if selected_group == "(all)":
+            level = group_level
+        else:
+            # Only the selected block of series is aggregated
+            combined_forecast_df = combined_forecast_df[group_labels == selected_group]
+
+    heatmap_input = pd.DataFrame({
+        'Date': combined_forecast_df['Date'].values,
+        'Row': heatmap_row_labels(combined_forecast_df['Product'].values, level),
+        'Forecast': combined_forecast_df['Forecast'].values,
+        'Level': level,
+    })
+    fig = cached_figure(build_sales_heatmap_figure, heatmap_input, ['Date', 'Row', 'Forecast', 'Level'])
     st.plotly_chart(fig, use_container_width=True)
 
     # Help message
@@ -180,35 +111,14 @@ def plot_sales_heatmap(combined_forecast_df):
         - **Darker Colors:** Indicate higher sales predictions.
         - **Lighter Colors:** Indicate lower sales predictions.
         - **Axes:** Products are listed on the y-axis and dates on the x-axis.
+        - **Large Catalogs:** With many products, rows are grouped by category or store cluster and dates are binned. Use **Drill down into** to see the products of one group.
 
         The heatmap provides a visual overview of sales performance across different products and time periods, helping identify patterns and anomalies.
     """)
 
+@timed()
 def plot_resource_allocation(resource_df):
-    fig = go.Figure()
-
-    # Add bars for resource requirements
-    fig.add_trace(go.Bar(
-        x=resource_df['Date'],
-        y=resource_df['Resource Requirement'],
-        marker_color='orange',
-        name='Resource Requirement',
-    ))
-
-    # Update layout with black background
-    fig.update_layout(
-        title='Resource Allocation Forecast',
-        xaxis_title='Date',
-        yaxis_title='Resource Requirement (Staff Hours)',
-        template='plotly_dark',
-        plot_bgcolor='black',
-        paper_bgcolor='black',
-        font=dict(color="white"),
-        hovermode='x',
-        showlegend=False,
-        xaxis_tickformat='%b %Y'
-    )
-
+    fig = cached_figure(build_resource_allocation_figure, resource_df, ['Date', 'Resource Requirement'])
     st.plotly_chart(fig, use_container_width=True)
 
     # Help message
@@ -222,3 +132,29 @@ def plot_resource_allocation(resource_df):
 
         This chart helps you plan and allocate resources effectively to meet the predicted demand, optimizing operational efficiency.
     """)
+
+@timed()
+def plot_staffing_percentiles(staffing_df, seconds=None):
+    stores = list(dict.fromkeys(staffing_df['Store']))
+    # The total across stores comes last and is shown first
+    store = st.selectbox("Store", stores[-1:] + stores[:-1], key='staffing_store')
+    store_df = staffing_df[staffing_df['Store'] == store]
+    fig = cached_figure(build_staffing_figure, store_df, ['Store', 'Date', 'P50', 'P90', 'P95'])
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(store_df.drop(columns='Store').set_index('Date').round(1), use_container_width=True)
+
+    # Help message
+    st.markdown(f"""
+        **How to Interpret the Staffing Percentiles:**
+
+        - **P50 Bars:** Staff hours that cover demand in half of the simulated scenarios.
+        - **P90 / P95 Lines:** Staff hours that cover demand in 90% / 95% of the scenarios; staffing to these levels protects against demand at the upper end of the forecast interval.
+        - Scenarios are sampled from each series' forecast and confidence interval and converted to staff hours with the per-item and per-store staffing factors.
+        {f"- Simulated in {seconds:.1f}s." if seconds is not None else ""}
+    """)
+
+@timed()
+def plot_historical_sales(monthly_sales):
+    history_df = pd.DataFrame({'Date': monthly_sales.index.to_timestamp(), 'Sales': monthly_sales.values})
+    fig = cached_figure(build_historical_sales_figure, history_df, ['Date', 'Sales'])
+    st.plotly_chart(fig, use_container_width=True)
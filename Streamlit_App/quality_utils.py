@@ -0,0 +1,379 @@
+# quality_utils.py
+#
+# Data-quality statistics and cleaning of transaction extracts, as the notebook does it (mean,
+# median and mode imputation, an IQR outlier scan and a 95th-percentile cap on purchase amounts)
+# but without full passes over the data. Statistics are mergeable summaries updated chunk by chunk:
+#
+#     running moments     count, mean and M2 (Welford / Chan et al.) for means and variances
+#     quantile sketches   log-spaced buckets with a fixed relative accuracy (DDSketch) for
+#                         medians, quartiles and the cap
+#     frequency counts    Counters for the modes of categorical columns
+#
+# Fitted statistics are saved as JSON, so a new extract is profiled on its own, merged into the
+# statistics of the history and cleaned chunk by chunk:
+#
+#     python quality_utils.py daily_extract.csv --stats quality.json --clean daily_clean.csv
+
+import os
+import json
+import argparse
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+# Set to 0 to ingest extracts as they are
+DATA_CLEANING = os.getenv('DATA_CLEANING', '1') != '0'
+
+# Relative accuracy of the quantile sketches: a quantile is within 1% of an exact one
+SKETCH_ACCURACY = 0.01
+
+# Values closer to zero than this are counted as zero by the sketches
+SKETCH_MIN_VALUE = 1e-9
+
+# Columns profiled, with the kind of statistics kept for them
+QUALITY_COLUMNS = {
+    'Purchase Amount (USD)': 'numeric',
+    'Sales per Item': 'numeric',
+    'Review Rating': 'numeric',
+    'Item Purchased': 'categorical',
+    'Payment Method': 'categorical',
+    'Store ID': 'categorical',
+}
+
+# Imputation and capping applied while cleaning, following the notebook. Missing store IDs are
+# profiled but not imputed: the dashboard keeps them apart from the per-store series.
+CLEANING_RULES = {
+    'Purchase Amount (USD)': {'fill': 'mean', 'cap': 0.95},
+    'Sales per Item': {'fill': 'mean'},
+    'Review Rating': {'fill': 'median'},
+    'Item Purchased': {'fill': 'mode'},
+    'Payment Method': {'fill': 'mode'},
+}
+
+# Whisker length of the IQR outlier scan
+IQR_WHISKER = 1.5
+
+# Count, mean and sum of squared deviations, merged with the parallel update of Chan et al.
+class RunningMoments:
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=None, maximum=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return self
+        mean = float(values.mean())
+        return self.merge(RunningMoments(len(values), mean, float(((values - mean) ** 2).sum()),
+                                         float(values.min()), float(values.max())))
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.minimum, self.maximum = (
+                other.count, other.mean, other.m2, other.minimum, other.maximum
+            )
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.minimum, 'max': self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['mean'], data['m2'], data['min'], data['max'])
+
+# Quantiles to a relative accuracy from counts of log-spaced buckets; bucket i holds the values in
+# (gamma^(i-1), gamma^i], so sketches with the same accuracy merge by adding their counts
+class QuantileSketch:
+    def __init__(self, relative_accuracy=SKETCH_ACCURACY, positive=None, negative=None, zeros=0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.positive = Counter(positive or {})
+        self.negative = Counter(negative or {})
+        self.zeros = zeros
+
+    @property
+    def count(self):
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zeros
+
+    def _add(self, buckets, magnitudes):
+        if len(magnitudes):
+            keys, counts = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64), return_counts=True)
+            buckets.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self._add(self.positive, values[values > SKETCH_MIN_VALUE])
+        self._add(self.negative, -values[values < -SKETCH_MIN_VALUE])
+        self.zeros += int((np.abs(values) <= SKETCH_MIN_VALUE).sum())
+        return self
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+        return self
+
+    # Representative value of a bucket, within the relative accuracy of every value in it
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        count = self.count
+        if count == 0:
+            return None
+        rank = q * (count - 1)
+        seen = 0
+        # Most negative values first, then zeros, then positive values
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'positive': {str(key): count for key, count in self.positive.items()},
+            'negative': {str(key): count for key, count in self.negative.items()},
+            'zeros': self.zeros,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['relative_accuracy'],
+            {int(key): count for key, count in data['positive'].items()},
+            {int(key): count for key, count in data['negative'].items()},
+            data['zeros'],
+        )
+
+# Mergeable statistics of one column: missing values plus moments and a sketch (numeric columns)
+# or value counts (categorical columns)
+class ColumnProfile:
+    def __init__(self, kind, missing=0, rows=0, moments=None, sketch=None, counts=None):
+        self.kind = kind
+        self.missing = missing
+        self.rows = rows
+        self.moments = moments or RunningMoments()
+        self.sketch = sketch or QuantileSketch()
+        self.counts = counts if counts is not None else Counter()
+
+    def update(self, series):
+        missing = series.isna()
+        self.rows += len(series)
+        self.missing += int(missing.sum())
+        values = series[~missing]
+        if self.kind == 'numeric':
+            values = values.to_numpy(dtype=float)
+            self.moments.update(values)
+            self.sketch.update(values)
+        else:
+            self.counts.update({value: int(count) for value, count in values.value_counts().items()})
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.missing += other.missing
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        self.counts.update(other.counts)
+        return self
+
+    def mode(self):
+        return self.counts.most_common(1)[0][0] if self.counts else None
+
+    # Fences of the IQR outlier scan
+    def iqr_bounds(self, whisker=IQR_WHISKER):
+        q1, q3 = self.sketch.quantile(0.25), self.sketch.quantile(0.75)
+        if q1 is None:
+            return None, None
+        return q1 - whisker * (q3 - q1), q3 + whisker * (q3 - q1)
+
+    def fill_value(self, method):
+        if method == 'mean':
+            return self.moments.mean if self.moments.count else None
+        if method == 'median':
+            return self.sketch.quantile(0.5)
+        if method == 'mode':
+            return self.mode()
+        raise ValueError(f"Unknown fill method: {method}")
+
+    def summary(self):
+        row = {'kind': self.kind, 'rows': self.rows, 'missing': self.missing}
+        if self.kind == 'numeric':
+            low, high = self.iqr_bounds()
+            row.update({
+                'mean': self.moments.mean, 'std': self.moments.variance ** 0.5,
+                'min': self.moments.minimum, 'max': self.moments.maximum,
+                'median': self.sketch.quantile(0.5), 'p95': self.sketch.quantile(0.95),
+                'iqr_low': low, 'iqr_high': high,
+            })
+        else:
+            row.update({'distinct': len(self.counts), 'mode': self.mode()})
+        return row
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'missing': self.missing,
+            'rows': self.rows,
+            'moments': self.moments.to_dict(),
+            'sketch': self.sketch.to_dict(),
+            # Pairs keep the value types (store IDs are numbers) through JSON
+            'counts': [[value, count] for value, count in self.counts.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['kind'], data['missing'], data['rows'],
+            RunningMoments.from_dict(data['moments']),
+            QuantileSketch.from_dict(data['sketch']),
+            Counter({value: count for value, count in data['counts']}),
+        )
+
+# Profiles of every quality column, updated chunk by chunk and merged across extracts
+class QualityStats:
+    def __init__(self, columns=None):
+        self.columns = columns or {name: ColumnProfile(kind) for name, kind in QUALITY_COLUMNS.items()}
+
+    @property
+    def rows(self):
+        return max((profile.rows for profile in self.columns.values()), default=0)
+
+    def update(self, df):
+        for name, profile in self.columns.items():
+            if name in df:
+                profile.update(df[name])
+        return self
+
+    def merge(self, other):
+        for name, profile in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(profile)
+            else:
+                self.columns[name] = profile
+        return self
+
+    def summary(self):
+        return pd.DataFrame({name: profile.summary() for name, profile in self.columns.items()}).T
+
+    def to_dict(self):
+        return {name: profile.to_dict() for name, profile in self.columns.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({name: ColumnProfile.from_dict(profile) for name, profile in data.items()})
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    # Saved statistics, or empty ones when nothing has been saved yet
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                return cls.from_dict(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+# Statistics of a CSV in one pass over chunks of chunk_rows rows
+def profile_csv(csv_path, chunk_rows):
+    stats = QualityStats()
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows):
+        stats.update(chunk)
+    return stats
+
+# A cleaned copy of a chunk: missing values imputed and capped columns clipped with the fitted
+# statistics, plus the number of values filled, capped and outside the IQR fences per column
+def clean_frame(df, stats, rules=CLEANING_RULES):
+    df = df.copy()
+    report = {'filled': Counter(), 'capped': Counter(), 'outliers': Counter()}
+    for name, rule in rules.items():
+        profile = stats.columns.get(name)
+        if name not in df or profile is None:
+            continue
+        values = df[name]
+        if profile.kind == 'numeric':
+            low, high = profile.iqr_bounds()
+            if low is not None:
+                report['outliers'][name] += int(((values < low) | (values > high)).sum())
+
+        missing = values.isna()
+        fill = profile.fill_value(rule['fill'])
+        if missing.any() and fill is not None:
+            values = values.where(~missing, fill)
+            report['filled'][name] += int(missing.sum())
+
+        cap = profile.sketch.quantile(rule['cap']) if 'cap' in rule else None
+        if cap is not None:
+            over = values > cap
+            values = values.where(~over, cap)
+            report['capped'][name] += int(over.sum())
+        df[name] = values
+    return df, report
+
+def merge_reports(total, report):
+    for name, counts in report.items():
+        total.setdefault(name, Counter()).update(counts)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile transaction extracts and clean them with persisted statistics.')
+    parser.add_argument('extracts', nargs='+', help='CSV extracts to profile')
+    parser.add_argument('--stats', default='quality_stats.json', help='statistics file, updated with the extracts')
+    parser.add_argument('--chunk-rows', type=int, default=100_000, help='rows read per chunk')
+    parser.add_argument('--clean', default=None, help='write the cleaned rows of the extracts to this CSV')
+    args = parser.parse_args()
+
+    stats = QualityStats.load(args.stats)
+    for csv_path in args.extracts:
+        stats.merge(profile_csv(csv_path, args.chunk_rows))
+    stats.save(args.stats)
+    print(stats.summary().to_string())
+
+    if args.clean:
+        report = {}
+        header = True
+        for csv_path in args.extracts:
+            for chunk in pd.read_csv(csv_path, chunksize=args.chunk_rows):
+                cleaned, chunk_report = clean_frame(chunk, stats)
+                cleaned.to_csv(args.clean, mode='w' if header else 'a', header=header, index=False)
+                header = False
+                merge_reports(report, chunk_report)
+        for name, counts in report.items():
+            print(f"{name}: " + ", ".join(f"{column} {count}" for column, count in counts.items()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# reconcile_utils.py
+#
+# Coherent forecasts for the total -> item -> item x store hierarchy of an artifact set. The
+# hierarchy is a sparse summing matrix S (nodes x leaves), and the base forecasts of every node
+# are reconciled in one pass of sparse linear algebra:
+#
+#     bottom-up:             y~ = S y^_leaves
+#     MinT (diagonal WLS):   y~ = y^ - W C' (C W C')^-1 C y^
+#
+# where C = [I  -S_agg] says each aggregate equals the sum of its leaves and W holds the base
+# forecast variances of the period. Only K = C W C', one row per aggregate, is ever factorized.
+# The aggregates form a tree and K only couples an aggregate with its ancestors, so eliminating
+# the deepest aggregates first gives an LDL' factorization without fill-in. The same pattern
+# carries the entries of K^-1 the variances need (Takahashi's selected inverse), so K^-1 itself
+# is never formed. Every step runs one tree level at a time for all periods at once.
+# Intervals come from the reconciled variances, assuming independent base forecast errors.
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.stats import norm
+from train_utils import TOTAL_SERIES, parse_series_key, series_key
+
+RECONCILIATION_METHODS = ('mint', 'bottom_up', 'none')
+
+# Confidence level of the intervals, matching the models' predict(return_conf_int=True)
+DEFAULT_ALPHA = 0.05
+
+# Smallest weight of a node relative to the largest, so series forecast with zero variance stay solvable
+VARIANCE_FLOOR = 1e-9
+
+# Series of an artifact set arranged as total, items and item x store series. Nodes are ordered
+# aggregates first, then leaves. `series` lists every series of the set, fitted or not; a series
+# is only constrained to the sum of its children when all of them are among the forecast `keys`,
+# since otherwise they do not add up to it.
+class Hierarchy:
+    def __init__(self, keys, series=None):
+        keys = set(keys)
+        every_series = keys | set(series or ())
+        natural_parents = {}
+        for key in every_series:
+            if key == TOTAL_SERIES:
+                continue
+            item, store = parse_series_key(key)
+            parent = series_key(item) if store is not None and series_key(item) in every_series else TOTAL_SERIES
+            if parent in every_series:
+                natural_parents[key] = parent
+
+        incomplete = {parent for child, parent in natural_parents.items() if child not in keys}
+        parents = {
+            child: parent for child, parent in natural_parents.items()
+            if child in keys and parent in keys and parent not in incomplete
+        }
+
+        aggregates = sorted(set(parents.values()), key=lambda key: (key != TOTAL_SERIES, key))
+        leaves = sorted(keys - set(aggregates))
+        self.nodes = aggregates + leaves
+        self.n_aggregates = len(aggregates)
+        self.position = {key: i for i, key in enumerate(self.nodes)}
+
+        # Aggregate parent of every node (-1 for none), and for every aggregate its depth and its
+        # ancestors by depth: ancestors[a, j] is the ancestor of aggregate a at depth j < depth[a]
+        self.parent = np.array([self.position[parents[key]] if key in parents else -1 for key in self.nodes], dtype=int)
+        self.depth = np.zeros(self.n_aggregates, dtype=int)
+        chains = []
+        for a in range(self.n_aggregates):
+            chain = []
+            node = self.parent[a]
+            while node >= 0:
+                chain.append(node)
+                node = self.parent[node]
+            chains.append(chain[::-1])
+            self.depth[a] = len(chain)
+        self.ancestors = np.full((self.n_aggregates, max(self.depth, default=0)), -1, dtype=int)
+        for a, chain in enumerate(chains):
+            self.ancestors[a, :len(chain)] = chain
+        self.levels = [np.flatnonzero(self.depth == k) for k in range(max(self.depth, default=-1) + 1)]
+
+        # Each leaf sums into itself and every one of its ancestors
+        rows, cols = [], []
+        for j, leaf in enumerate(leaves):
+            node = leaf
+            while node is not None:
+                rows.append(self.position[node])
+                cols.append(j)
+                node = parents.get(node)
+        self.S = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(self.nodes), len(leaves)))
+
+        # Constraints C y = 0: every aggregate minus the leaves it sums
+        self.C = sp.hstack([sp.identity(self.n_aggregates, format='csr'), -self.S[:self.n_aggregates]], format='csr')
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Positions of the given keys among the nodes
+    def rows(self, keys):
+        return np.array([self.position[key] for key in keys], dtype=int)
+
+# Variance implied by a symmetric confidence interval
+def interval_variance(lower, upper, alpha=DEFAULT_ALPHA):
+    return ((np.asarray(upper) - np.asarray(lower)) / (2 * norm.ppf(1 - alpha / 2))) ** 2
+
+def interval_bounds(forecasts, variance, alpha=DEFAULT_ALPHA):
+    half_width = norm.ppf(1 - alpha / 2) * np.sqrt(np.clip(variance, 0, None))
+    return forecasts - half_width, forecasts + half_width
+
+# Forecast and interval of the sum of several series, each row one series
+def sum_forecasts(forecasts, lower, upper, alpha=DEFAULT_ALPHA):
+    total = forecasts.sum(axis=0)
+    return (total, *interval_bounds(total, interval_variance(lower, upper, alpha).sum(axis=0), alpha))
+
+def bottom_up(hierarchy, forecasts, variance):
+    leaves = slice(hierarchy.n_aggregates, None)
+    return hierarchy.S @ forecasts[leaves], hierarchy.S @ variance[leaves]
+
+# LDL' factors of K = C W C' for every period: d (aggregates x periods) and l (aggregates x depth x
+# periods), where l[a, j] is the multiplier of aggregate a in the row of its depth-j ancestor.
+# K[a, a] is w_a plus the variances of a's leaves, and K between a and an ancestor is the variance
+# of a's leaves, since those are the leaves they share.
+def factor_constraints(hierarchy, w):
+    n_aggregates = hierarchy.n_aggregates
+    ancestors, levels = hierarchy.ancestors, hierarchy.levels
+    leaf_variance = hierarchy.S[:n_aggregates] @ w[n_aggregates:]
+    diagonal = w[:n_aggregates] + leaf_variance
+    off_diagonal = np.repeat(leaf_variance[:, None, :], ancestors.shape[1], axis=1)
+
+    d = np.empty_like(diagonal)
+    l = np.zeros_like(off_diagonal)
+    for k in range(len(levels) - 1, -1, -1):
+        level = levels[k]
+        d[level] = diagonal[level]
+        l[level, :k] = off_diagonal[level, :k] / d[level, None]
+        # Eliminating the level updates K among its ancestors, which all lie on one chain
+        for i in range(k):
+            for j in range(i, k):
+                update = l[level, i] * l[level, j] * d[level]
+                if i == j:
+                    np.subtract.at(diagonal, ancestors[level, i], update)
+                else:
+                    np.subtract.at(off_diagonal[:, i], ancestors[level, j], update)
+    return d, l
+
+# K^-1 x for every period (column of x), by forward and back substitution down and up the tree
+def solve_constraints(hierarchy, d, l, x):
+    ancestors, levels = hierarchy.ancestors, hierarchy.levels
+    y = x.copy()
+    for k in range(len(levels) - 1, -1, -1):
+        level = levels[k]
+        for j in range(k):
+            np.subtract.at(y, ancestors[level, j], l[level, j] * y[level])
+    y /= d
+    for k, level in enumerate(levels):
+        for j in range(k):
+            y[level] -= l[level, j] * y[ancestors[level, j]]
+    return y
+
+# diag(C' K^-1 C) for every node and period from the selected inverse Z of K, the entries of K^-1
+# between each aggregate and its ancestors. A column of C holds an aggregate's own 1, or -1 for
+# every aggregate above a leaf, so a leaf needs the sum of Z over all pairs on its parent's chain.
+def constraint_quadratic_diagonal(hierarchy, d, l):
+    ancestors, levels = hierarchy.ancestors, hierarchy.levels
+    z_diagonal = np.empty_like(d)
+    z_ancestor = np.zeros_like(l)
+    chain_sum = np.empty_like(d)
+    for k, level in enumerate(levels):
+        # Takahashi: Z = D^-1 L^-1 + (I - L') Z, solved from the root down
+        for j in range(k):
+            total = 0.0
+            for i in range(k):
+                if i == j:
+                    z_pair = z_diagonal[ancestors[level, i]]
+                else:
+                    z_pair = z_ancestor[ancestors[level, max(i, j)], min(i, j)]
+                total = total + l[level, i] * z_pair
+            z_ancestor[level, j] = -total
+        z_diagonal[level] = 1 / d[level] - (l[level, :k] * z_ancestor[level, :k]).sum(axis=1)
+        parent_sum = chain_sum[hierarchy.parent[level]] if k else 0.0
+        chain_sum[level] = parent_sum + z_diagonal[level] + 2 * z_ancestor[level, :k].sum(axis=1)
+
+    n_aggregates = hierarchy.n_aggregates
+    leaf_parent = hierarchy.parent[n_aggregates:]
+    quadratic = np.zeros((len(hierarchy), d.shape[1]))
+    quadratic[:n_aggregates] = z_diagonal
+    constrained = leaf_parent >= 0
+    quadratic[n_aggregates:][constrained] = chain_sum[leaf_parent[constrained]]
+    return quadratic
+
+# Diagonal MinT: the weighted least squares projection onto the coherent forecasts, with each
+# period weighted by its own base variances. For a WLS projection M W M' = M W, so the
+# reconciled variances are w - w^2 diag(C' K^-1 C).
+def mint(hierarchy, forecasts, variance):
+    w = np.maximum(variance, VARIANCE_FLOOR * np.where(variance.max(axis=0) > 0, variance.max(axis=0), 1.0))
+    d, l = factor_constraints(hierarchy, w)
+    reconciled = forecasts - w * (hierarchy.C.T @ solve_constraints(hierarchy, d, l, hierarchy.C @ forecasts))
+    reconciled_variance = w - w ** 2 * constraint_quadratic_diagonal(hierarchy, d, l)
+    return reconciled, reconciled_variance
+
+# Coherent forecasts and intervals for every node; arrays are (nodes x periods) in hierarchy order
+def reconcile(hierarchy, forecasts, lower, upper, method='mint', alpha=DEFAULT_ALPHA):
+    if method not in RECONCILIATION_METHODS:
+        raise ValueError(f"Unknown reconciliation method: {method}")
+    if method == 'none' or hierarchy.n_aggregates == 0:
+        return forecasts, lower, upper
+    variance = interval_variance(lower, upper, alpha)
+    if method == 'bottom_up':
+        reconciled, variance = bottom_up(hierarchy, forecasts, variance)
+    else:
+        reconciled, variance = mint(hierarchy, forecasts, variance)
+    return (reconciled, *interval_bounds(reconciled, variance, alpha))
@@ -0,0 +1,354 @@
+# service_utils.py
+#
+# Standalone forecast service that keeps models resident in one process, and the pooled
+# keep-alive client the dashboard and the AI assistant use to call it:
+#
+#     python service_utils.py serve --port 8502
+#     FORECAST_SERVICE_URL=http://127.0.0.1:8502 streamlit run main_app.py
+#     python service_utils.py bench --url http://127.0.0.1:8502
+
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from cache_utils import ResultCache
+from perf_utils import recorder, span
+from forecast_utils import (
+    FORECAST_CACHE_SIZE,
+    FORECAST_CACHE_TTL,
+    ModelRegistry,
+    available_product_types,
+    default_model_version,
+    discover_model_versions,
+    forecast_cache_key,
+    forecast_periods,
+    version_batch_forecast,
+)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8502
+
+# Forecast columns returned for every row, in response order
+FORECAST_COLUMNS = {
+    'forecast': 'Forecast',
+    'lower': 'Lower CI',
+    'upper': 'Upper CI',
+    'resource': 'Resource Requirement',
+}
+
+# A forecast the service cannot produce right now, e.g. a model that failed to predict; answered with 503
+class ForecastUnavailable(RuntimeError):
+    pass
+
+# Forecasting state shared by every request thread of the service
+class ForecastService:
+    def __init__(self):
+        self.registry = discover_model_versions(ModelRegistry())
+        self.cache = ResultCache(max_entries=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL)
+
+    def resolve_version(self, version=None):
+        version = version or default_model_version()
+        if version not in self.registry.versions():
+            # Pick up artifacts written since the service started
+            discover_model_versions(self.registry)
+        if version not in self.registry.versions():
+            raise KeyError(f"Unknown model version: {version}")
+        return version
+
+    def product_types(self, version=None):
+        version = self.resolve_version(version)
+        return available_product_types(self.registry.get(version))
+
+    # Batch forecast of one date range, shared with identical requests through the cache.
+    # product_types are expected in sorted order, the order the cache key uses.
+    def batch_forecast(self, start_date, end_date, product_types, version, include_total):
+        model = self.registry.get(version)
+        key = forecast_cache_key(start_date, end_date, product_types, self.registry.version_token(version), include_total)
+        forecast_df = self.cache.get_or_compute(
+            key,
+            lambda: version_batch_forecast(start_date, end_date, product_types, version, model, self.registry, include_total)
+        )
+        if forecast_df is None:
+            raise ForecastUnavailable(f"No forecast available from model version {version}")
+        return forecast_df
+
+    # Columnar response for many (product, start, end) requests; requests sharing a date range
+    # are answered by one batch forecast
+    def forecast(self, payload):
+        version = self.resolve_version(payload.get('version'))
+        include_total = bool(payload.get('include_total', False))
+        requests = payload['requests']
+
+        ranges = {}
+        for i, request in enumerate(requests):
+            date_range = (request['start'], request['end'])
+            ranges.setdefault(date_range, []).append(i)
+
+        parts = []
+        for range_index, ((start, end), request_indices) in enumerate(ranges.items()):
+            start_date, end_date = pd.Timestamp(start).date(), pd.Timestamp(end).date()
+            # Sorted so that the same set of products shares one cache entry whatever the request order
+            products = sorted(set(requests[i]['product'] for i in request_indices))
+            forecast_df = self.batch_forecast(start_date, end_date, products, version, include_total)
+            n_periods = forecast_periods(start_date, end_date)
+
+            # Rows of product p are the p-th block of n_periods rows; the total follows the products
+            product_position = {product: position for position, product in enumerate(products)}
+            blocks = [product_position[requests[i]['product']] for i in request_indices]
+            request_ids = list(request_indices)
+            if include_total:
+                blocks.append(len(products))
+                request_ids.append(-1)
+            rows = (np.asarray(blocks)[:, None] * n_periods + np.arange(n_periods)).ravel()
+            part = forecast_df.iloc[rows]
+            parts.append((np.repeat(request_ids, n_periods), np.full(len(rows), range_index), part))
+
+        columns = {
+            'request': np.concatenate([ids for ids, _, _ in parts]).tolist(),
+            'range': np.concatenate([range_ids for _, range_ids, _ in parts]).tolist(),
+            'product': pd.concat([part['Product'] for _, _, part in parts]).tolist(),
+            'date': pd.concat([part['Date'] for _, _, part in parts]).dt.strftime('%Y-%m-%d').tolist(),
+        }
+        for name, column in FORECAST_COLUMNS.items():
+            columns[name] = pd.concat([part[column] for _, _, part in parts]).round(4).tolist()
+
+        return {
+            'version': version,
+            'model_token': self.registry.version_token(version),
+            'ranges': [list(date_range) for date_range in ranges],
+            'columns': columns,
+        }
+
+class ForecastRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps client connections open between requests
+    protocol_version = 'HTTP/1.1'
+    service = None
+    verbose = False
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, action):
+        try:
+            self._send_json(200, action())
+        except KeyError as e:
+            self._send_json(404, {'error': str(e)})
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+        except ForecastUnavailable as e:
+            self._send_json(503, {'error': str(e)})
+        except Exception as e:
+            self._send_json(500, {'error': repr(e)})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            self._send_text(200, recorder.prometheus_text())
+            return
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        routes = {
+            '/health': lambda: {'status': 'ok'},
+            '/versions': lambda: {
+                'versions': self.service.registry.versions(),
+                'default': default_model_version(),
+                'tokens': {name: self.service.registry.version_token(name) for name in self.service.registry.versions()},
+            },
+            '/products': lambda: {'products': self.service.product_types(params.get('version'))},
+            '/stats': lambda: self.service.cache.stats(),
+        }
+        if url.path not in routes:
+            self._send_json(404, {'error': f"Unknown path: {url.path}"})
+            return
+        self._handle(routes[url.path])
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/forecast':
+            self._send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        payload = self.rfile.read(length)
+        with span('service_forecast'):
+            self._handle(lambda: self.service.forecast(json.loads(payload)))
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+# HTTP server answering forecast requests on its own threads
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False):
+    handler = type('BoundForecastRequestHandler', (ForecastRequestHandler,), {
+        'service': ForecastService(),
+        'verbose': verbose,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# Client with a pool of keep-alive connections, safe to share between threads
+class ForecastClient:
+    def __init__(self, base_url, pool_size=8, timeout=30.0, retries=1):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or DEFAULT_PORT
+        self.timeout = timeout
+        self.retries = retries
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connection(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload, separators=(',', ':')) if payload is not None else None
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        for attempt in range(self.retries + 1):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = json.loads(response.read())
+            except (ConnectionResetError, BrokenPipeError, http.client.RemoteDisconnected):
+                # Pooled connection closed by the server; retry on a fresh one. Timeouts and other
+                # errors are not retried, since the server may already be working on the request.
+                connection.close()
+                if attempt == self.retries:
+                    raise
+                continue
+            except Exception:
+                connection.close()
+                raise
+            self._release(connection)
+            if response.status != 200:
+                raise RuntimeError(f"Forecast service error {response.status}: {data.get('error')}")
+            return data
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def versions(self):
+        return self._request('GET', '/versions')
+
+    def stats(self):
+        return self._request('GET', '/stats')
+
+    def product_types(self, version=None):
+        query = f"?{urlencode({'version': version})}" if version else ''
+        return self._request('GET', f"/products{query}")['products']
+
+    # Raw columnar response for many (product, start, end) tuples
+    def forecast(self, requests, version=None, include_total=False):
+        payload = {
+            'version': version,
+            'include_total': include_total,
+            'requests': [
+                {'product': product, 'start': str(start), 'end': str(end)}
+                for product, start, end in requests
+            ],
+        }
+        return self._request('POST', '/forecast', payload)
+
+    # Same frame as forecast_utils.generate_batch_forecast, computed by the service
+    def batch_forecast(self, start_date, end_date, product_types, version=None, include_total=True):
+        response = self.forecast([(product, start_date, end_date) for product in product_types], version, include_total)
+        columns = response['columns']
+        forecast_df = pd.DataFrame({'Date': pd.to_datetime(columns['date'])})
+        for name in ('forecast', 'lower', 'upper'):
+            forecast_df[FORECAST_COLUMNS[name]] = columns[name]
+        forecast_df['Product'] = columns['product']
+        forecast_df['Resource Requirement'] = columns['resource']
+        return forecast_df
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+# Requests per second a running service sustains for a given batch size and concurrency
+def benchmark(client, n_calls=200, concurrency=8, n_products=9, months=3):
+    products = client.product_types()[:n_products]
+    start = pd.Timestamp.today().normalize()
+    latencies = []
+    lock = threading.Lock()
+
+    def call(i):
+        # Vary the start date so the service cache does not answer every call
+        start_date = (start + pd.Timedelta(days=i % 30)).date()
+        end_date = (start + pd.Timedelta(days=i % 30 + 30 * months)).date()
+        began = time.perf_counter()
+        client.forecast([(product, start_date, end_date) for product in products])
+        with lock:
+            latencies.append(time.perf_counter() - began)
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(n_calls)))
+    elapsed = time.perf_counter() - began
+    latencies = np.asarray(latencies)
+    return {
+        'calls': n_calls,
+        'concurrency': concurrency,
+        'products_per_call': len(products),
+        'calls_per_second': n_calls / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Local batch forecast service.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the forecast service')
+    serve.add_argument('--host', default=DEFAULT_HOST)
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--verbose', action='store_true', help='log every request')
+    bench = commands.add_parser('bench', help='measure the throughput of a running service')
+    bench.add_argument('--url', default=os.getenv('FORECAST_SERVICE_URL', f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"))
+    bench.add_argument('--calls', type=int, default=200)
+    bench.add_argument('--concurrency', type=int, default=8)
+    bench.add_argument('--products', type=int, default=9)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = make_server(args.host, args.port, args.verbose)
+        print(f"Forecast service listening on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    else:
+        client = ForecastClient(args.url, pool_size=args.concurrency)
+        print(json.dumps(benchmark(client, args.calls, args.concurrency, args.products), indent=2))
+        client.close()
+
+if __name__ == '__main__':
+    main()
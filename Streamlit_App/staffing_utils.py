@@ -0,0 +1,151 @@
+# staffing_utils.py
+#
+# Monte Carlo staffing percentiles. Demand paths are sampled from each series' forecast
+# distribution (normal, with the standard deviation implied by its confidence interval, cut at
+# zero), converted to staff hours with per-item/per-store staffing factors, summed per store and
+# period, and summarized as quantiles:
+#
+#     result = simulate_staffing(forecasts, lower, upper, factors, groups, n_scenarios=100_000, seed=7)
+#
+# Scenarios are drawn in chunks sized to a memory budget. Each chunk only adds to fixed-size
+# histograms per store and period, so memory does not grow with the number of scenarios.
+
+import os
+import json
+import time
+import functools
+import numpy as np
+from reconcile_utils import DEFAULT_ALPHA, interval_variance
+from train_utils import parse_series_key, store_label
+
+STAFFING_SCENARIOS = int(os.getenv('STAFFING_SCENARIOS', '100000'))
+
+# Memory allowed for the demand samples of one chunk
+STAFFING_MEMORY_MB = float(os.getenv('STAFFING_MEMORY_MB', '64'))
+
+# Staff hours per unit sold by item, store or item/store series, e.g. {"Jeans": 0.15, "Store 3": 0.12};
+# sales without a Store ID are "Store Unknown"
+STAFFING_FACTORS_FILE = os.getenv('STAFFING_FACTORS_FILE')
+
+STAFFING_QUANTILES = (0.5, 0.9, 0.95)
+
+# Histogram bins per store and period, spread over the mean +/- HISTOGRAM_SIGMAS standard deviations;
+# quantiles are read to within 2 * HISTOGRAM_SIGMAS / HISTOGRAM_BINS standard deviations
+HISTOGRAM_BINS = 4096
+HISTOGRAM_SIGMAS = 8
+
+# Group of the series without a store, and of all series together when there are several groups
+ALL_STORES = "All Stores"
+TOTAL_STAFFING = "Total"
+
+# Staffing factor overrides from a JSON file, re-read when the file changes
+def load_staffing_factors(path=STAFFING_FACTORS_FILE):
+    if not path or not os.path.exists(path):
+        return {}
+    return _load_staffing_factors(path, os.stat(path).st_mtime_ns)
+
+@functools.lru_cache(maxsize=4)
+def _load_staffing_factors(path, mtime_ns):
+    with open(path) as f:
+        return {str(key): float(value) for key, value in json.load(f).items()}
+
+# Staff hours per unit for each series: its own entry, else its item's, else its store's, else the default
+def staffing_factors(series_keys, overrides, default):
+    factors = np.empty(len(series_keys))
+    for i, key in enumerate(series_keys):
+        item, store = parse_series_key(key)
+        store_key = store_label(store) if store is not None else None
+        factors[i] = overrides.get(key, overrides.get(item, overrides.get(store_key, default)))
+    return factors
+
+# Store of each series, ALL_STORES for series that are not per store
+def staffing_groups(series_keys):
+    groups = []
+    for key in series_keys:
+        _, store = parse_series_key(key)
+        groups.append(store_label(store) if store is not None else ALL_STORES)
+    return groups
+
+# Stores in numeric order
+def group_sort_key(group):
+    number = group.rsplit(' ', 1)[-1]
+    return (0, int(number), group) if number.isdigit() else (1, 0, group)
+
+# Scenarios per chunk so one chunk's float32 samples fit the memory budget (the sampler needs
+# about as much scratch space again)
+def chunk_scenarios(n_series, n_periods, memory_mb=STAFFING_MEMORY_MB):
+    return max(int(memory_mb * 2 ** 20 / (2 * 4 * max(n_series * n_periods, 1))), 1)
+
+# Quantiles of each histogram row, interpolated linearly within the bin they fall in
+def histogram_quantiles(counts, low, width, quantiles):
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1:]
+    result = np.empty((len(counts), len(quantiles)))
+    for j, q in enumerate(quantiles):
+        target = q * total
+        bins = np.minimum((cumulative < target).sum(axis=1), counts.shape[1] - 1)
+        rows = np.arange(len(counts))
+        below = np.where(bins > 0, cumulative[rows, bins - 1], 0)
+        fraction = (target[:, 0] - below) / np.maximum(counts[rows, bins], 1)
+        result[:, j] = low + (bins + fraction) * width
+    return result
+
+# Staff-hour quantiles per group and period from n_scenarios sampled demand paths. Series are rows
+# of the forecast arrays; factors and groups have one entry per series. Returns the group names,
+# quantiles (groups x periods x quantiles), mean staff hours (groups x periods) and timings.
+def simulate_staffing(forecasts, lower, upper, factors, groups, n_scenarios=STAFFING_SCENARIOS,
+                      quantiles=STAFFING_QUANTILES, seed=None, alpha=DEFAULT_ALPHA, memory_mb=STAFFING_MEMORY_MB):
+    start = time.perf_counter()
+    forecasts = np.asarray(forecasts, dtype=float)
+    sigma = np.sqrt(interval_variance(lower, upper, alpha))
+    factors = np.asarray(factors, dtype=float)
+    n_series, n_periods = forecasts.shape
+
+    group_names = sorted(set(groups), key=group_sort_key)
+    position = {group: i for i, group in enumerate(group_names)}
+    group_index = np.array([position[group] for group in groups], dtype=int)
+    # Series x groups membership, so staff hours are summed per group with one matrix product
+    membership = np.zeros((n_series, len(group_names)))
+    membership[np.arange(n_series), group_index] = 1.0
+    if len(group_names) > 1:
+        group_names.append(TOTAL_STAFFING)
+        membership = np.column_stack([membership, np.ones(n_series)])
+    n_groups = len(group_names)
+    weighted = membership * factors[:, None]
+
+    # Histogram range per group and period, from the normal approximation of its staff hours
+    hours_mean = weighted.T @ forecasts.clip(min=0)
+    hours_sd = np.sqrt((weighted ** 2).T @ sigma ** 2)
+    spread = np.maximum(hours_sd, 1e-9 * np.maximum(np.abs(hours_mean), 1.0))
+    low = np.maximum(hours_mean - HISTOGRAM_SIGMAS * spread, 0.0)
+    width = (hours_mean + HISTOGRAM_SIGMAS * spread - low) / HISTOGRAM_BINS
+    counts = np.zeros(n_groups * n_periods * HISTOGRAM_BINS, dtype=np.int64)
+    cell_offset = (np.arange(n_groups * n_periods) * HISTOGRAM_BINS).reshape(n_groups, n_periods)
+    totals = np.zeros((n_groups, n_periods))
+
+    # Samples are drawn in float32, plenty for staff hours and half the memory and time
+    mean32, sigma32, weighted32 = forecasts.astype(np.float32), sigma.astype(np.float32), weighted.T.astype(np.float32)
+    rng = np.random.default_rng(seed)
+    chunk = chunk_scenarios(n_series, n_periods, memory_mb)
+    for done in range(0, n_scenarios, chunk):
+        size = min(chunk, n_scenarios - done)
+        # Demand paths (scenarios x series x periods); sales cannot be negative
+        demand = rng.standard_normal((size, n_series, n_periods), dtype=np.float32)
+        demand *= sigma32
+        demand += mean32
+        np.maximum(demand, 0, out=demand)
+        hours = np.matmul(weighted32, demand)
+        totals += hours.sum(axis=0)
+        bins = np.clip(((hours - low) / width).astype(np.int64), 0, HISTOGRAM_BINS - 1)
+        counts += np.bincount((bins + cell_offset).ravel(), minlength=len(counts))
+
+    counts = counts.reshape(n_groups * n_periods, HISTOGRAM_BINS)
+    result = histogram_quantiles(counts, low.ravel(), width.ravel(), quantiles)
+    return {
+        'groups': group_names,
+        'quantiles': result.reshape(n_groups, n_periods, len(quantiles)),
+        'mean': totals / n_scenarios,
+        'scenarios': n_scenarios,
+        'chunk_scenarios': chunk,
+        'seconds': time.perf_counter() - start,
+    }
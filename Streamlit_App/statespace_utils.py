@@ -0,0 +1,155 @@
+# statespace_utils.py
+#
+# Vectorized forecasting of many fitted state space models (pmdarima ARIMA or any statsmodels
+# state space results, e.g. SARIMAX or ETS). The system matrices and final predicted state of
+# every model are stacked into arrays grouped by state dimension, and the Kalman forecast
+# recursion runs once per horizon step for the whole group:
+#
+#     y_h = d + Z a_h            F_h = Z P_h Z' + H
+#     a_h+1 = c + T a_h          P_h+1 = T P_h T' + R Q R'
+#
+# Confidence intervals are y_h -/+ z * sqrt(scale * F_h), as statsmodels computes them.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.stats import norm
+
+# Batches with more series than this are split across worker processes
+PARALLEL_MIN_SERIES = int(os.getenv('STATESPACE_PARALLEL_MIN_SERIES', '5000'))
+
+# Confidence level of the intervals, matching pmdarima's predict(return_conf_int=True)
+DEFAULT_ALPHA = 0.05
+
+# Matrices of a state space representation read by the engine
+SYSTEM_MATRICES = ('design', 'obs_intercept', 'obs_cov', 'transition', 'state_intercept', 'selection', 'state_cov')
+
+# Fitted statsmodels results behind a model: pmdarima keeps them in arima_res_
+def state_space_results(model):
+    results = getattr(model, 'arima_res_', model)
+    if not hasattr(results, 'predicted_state') or not hasattr(getattr(results, 'model', None), 'ssm'):
+        return None
+    return results
+
+# Time-invariant system of a fitted model plus its one-step-ahead predicted state, or None when
+# the model cannot be forecast this way (exogenous regressors, multivariate or time-varying matrices)
+def extract_state_space(model):
+    results = state_space_results(model)
+    if results is None or getattr(results.model, 'k_exog', 0) or results.model.k_endog != 1:
+        return None
+    ssm = results.model.ssm
+
+    system = {}
+    for name in SYSTEM_MATRICES:
+        matrix = np.asarray(getattr(ssm, name), dtype=float)
+        # Matrices stored per period must hold the same value in every period (e.g. a constant trend)
+        if matrix.shape[-1] > 1 and not np.allclose(matrix, matrix[..., :1]):
+            return None
+        system[name] = matrix[..., 0]
+
+    selection = system['selection']
+    scale = float(getattr(results.filter_results, 'scale', 1.0) or 1.0)
+    return {
+        'Z': system['design'][0],
+        'd': system['obs_intercept'][0],
+        'H': system['obs_cov'][0, 0],
+        'T': system['transition'],
+        'c': system['state_intercept'],
+        'RQR': selection @ system['state_cov'] @ selection.T,
+        'a': np.asarray(results.predicted_state[:, -1], dtype=float),
+        'P': np.asarray(results.predicted_state_cov[:, :, -1], dtype=float),
+        'scale': scale,
+    }
+
+# Stack the systems of one state dimension into arrays with a leading series axis
+def stack_systems(systems):
+    return {name: np.stack([system[name] for system in systems]) for name in systems[0]}
+
+# Forecast mean and variance of a stacked group for n_periods steps
+def forecast_group(group, n_periods):
+    Z, d, H, T, c, RQR = group['Z'], group['d'], group['H'], group['T'], group['c'], group['RQR']
+    a, P = group['a'].copy(), group['P'].copy()
+    T_t = np.swapaxes(T, 1, 2)
+    mean = np.empty((len(d), n_periods))
+    variance = np.empty((len(d), n_periods))
+    for h in range(n_periods):
+        mean[:, h] = d + np.einsum('bk,bk->b', Z, a)
+        variance[:, h] = np.einsum('bi,bij,bj->b', Z, P, Z) + H
+        a = c + np.einsum('bij,bj->bi', T, a)
+        P = T @ P @ T_t + RQR
+    return mean, variance * group['scale'][:, None]
+
+# Forecast, lower and upper arrays of stacked groups, one row per series in the given order
+def forecast_groups(groups, n_series, n_periods, alpha=DEFAULT_ALPHA):
+    z = norm.ppf(1 - alpha / 2)
+    forecasts = np.empty((n_series, n_periods))
+    lower = np.empty((n_series, n_periods))
+    upper = np.empty((n_series, n_periods))
+    for rows, group in groups:
+        mean, variance = forecast_group(group, n_periods)
+        half_width = z * np.sqrt(np.clip(variance, 0, None))
+        forecasts[rows], lower[rows], upper[rows] = mean, mean - half_width, mean + half_width
+    return forecasts, lower, upper
+
+# Many fitted models forecast together; models the engine cannot stack keep their own predict
+class StateSpaceBatch:
+    def __init__(self, models):
+        self.keys = list(models)
+        self.position = {key: i for i, key in enumerate(self.keys)}
+        self.fallback = {}
+        by_dimension = {}
+        for i, key in enumerate(self.keys):
+            system = extract_state_space(models[key])
+            if system is None:
+                self.fallback[key] = models[key]
+                continue
+            by_dimension.setdefault(len(system['a']), []).append((i, system))
+
+        # Per state dimension: positions of the series in self.keys and their stacked systems
+        self.groups = [
+            (np.array([i for i, _ in members]), stack_systems([system for _, system in members]))
+            for _, members in sorted(by_dimension.items())
+        ]
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Groups restricted to the series at the given positions, with rows renumbered to the output
+    def _select(self, positions):
+        output_row = np.full(len(self.keys), -1)
+        output_row[positions] = np.arange(len(positions))
+        selected = []
+        for rows, group in self.groups:
+            keep = output_row[rows] >= 0
+            if keep.any():
+                selected.append((output_row[rows[keep]], {name: values[keep] for name, values in group.items()}))
+        return selected
+
+    # Forecast, lower and upper arrays (series x periods) for the given keys (all by default)
+    def forecast(self, n_periods, keys=None, alpha=DEFAULT_ALPHA, max_workers=None):
+        keys = self.keys if keys is None else list(keys)
+        # Each distinct series is forecast once, then spread back to the requested order
+        positions, inverse = np.unique([self.position[key] for key in keys], return_inverse=True)
+
+        if len(positions) >= PARALLEL_MIN_SERIES and max_workers != 1:
+            # Contiguous slices of the series, one per worker, concatenated back in order
+            slices = np.array_split(positions, max_workers or os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=len(slices)) as pool:
+                parts = list(pool.map(
+                    forecast_groups,
+                    [self._select(part) for part in slices],
+                    [len(part) for part in slices],
+                    [n_periods] * len(slices),
+                    [alpha] * len(slices),
+                ))
+            forecasts, lower, upper = (np.concatenate(arrays) for arrays in zip(*parts))
+        else:
+            forecasts, lower, upper = forecast_groups(self._select(positions), len(positions), n_periods, alpha)
+
+        for i, position in enumerate(positions):
+            model = self.fallback.get(self.keys[position])
+            if model is not None:
+                forecast, conf_int = model.predict(n_periods=n_periods, return_conf_int=True, alpha=alpha)
+                conf_int = np.asarray(conf_int, dtype=float)
+                forecasts[i], lower[i], upper[i] = np.asarray(forecast, dtype=float), conf_int[:, 0], conf_int[:, 1]
+        return forecasts[inverse], lower[inverse], upper[inverse]
@@ -0,0 +1,8 @@
+# conftest.py
+#
+# The app modules import each other by name, as when run from Streamlit_App, so the tests do too.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
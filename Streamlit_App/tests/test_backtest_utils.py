@@ -0,0 +1,40 @@
+# test_backtest_utils.py
+#
+# Pruning must drop fold models that have not been used recently, then the least recently used
+# ones until the cache fits its size cap.
+#
+#     python -m pytest Streamlit_App/tests
+
+import os
+import time
+
+from backtest_utils import prune_fold_cache
+
+DAY = 86400
+
+# Cache file of the given size last used the given number of days ago
+def cached_model(cache_dir, name, days_ago, size=1000):
+    path = cache_dir / 'jeans_0000' / 'arima' / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'0' * size)
+    used = time.time() - days_ago * DAY
+    os.utime(path, (used, used))
+    return path
+
+def test_old_models_are_pruned(tmp_path):
+    old = cached_model(tmp_path, '36_old.pkl', days_ago=40)
+    recent = cached_model(tmp_path, '37_recent.pkl', days_ago=1)
+    stats = prune_fold_cache(str(tmp_path), max_age_days=30, max_mb=1)
+    assert not old.exists() and recent.exists()
+    assert stats['removed'] == 1 and stats['kept'] == 1
+
+def test_least_recently_used_models_go_first_past_the_cap(tmp_path):
+    paths = [cached_model(tmp_path, f"{36 + i}_model.pkl", days_ago=5 - i, size=300_000) for i in range(5)]
+    stats = prune_fold_cache(str(tmp_path), max_age_days=30, max_mb=1)
+    assert [path.exists() for path in paths] == [False, False, True, True, True]
+    assert stats['megabytes'] <= 1
+
+def test_empty_directories_are_removed(tmp_path):
+    cached_model(tmp_path, '36_old.pkl', days_ago=40)
+    prune_fold_cache(str(tmp_path), max_age_days=30, max_mb=1)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,110 @@
+# test_cache_utils.py
+#
+# Concurrent misses on one key must share a single computation, and entries must leave the
+# cache by LRU eviction and TTL expiry.
+#
+#     python -m pytest Streamlit_App/tests
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache_utils
+from cache_utils import ResultCache
+from forecast_utils import forecast_cache_key, reorder_forecast_products
+
+N_WAITERS = 8
+
+# Runs get_or_compute from N_WAITERS threads at once and returns their results or errors
+def run_concurrently(cache, key, compute):
+    started = threading.Barrier(N_WAITERS)
+    results = [None] * N_WAITERS
+
+    def worker(i):
+        started.wait()
+        try:
+            results[i] = cache.get_or_compute(key, compute)
+        except BaseException as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(N_WAITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_misses_share_one_computation():
+    cache = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'value'
+
+    results = run_concurrently(cache, 'key', compute)
+    assert results == ['value'] * N_WAITERS
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] + stats['coalesced'] == N_WAITERS - 1
+
+def test_waiters_receive_the_error():
+    cache = ResultCache()
+
+    def compute():
+        time.sleep(0.2)
+        raise KeyboardInterrupt
+
+    results = run_concurrently(cache, 'key', compute)
+    assert all(isinstance(result, KeyboardInterrupt) for result in results)
+    assert cache.stats()['entries'] == 0
+
+def test_none_is_not_cached():
+    cache = ResultCache()
+    assert cache.get_or_compute('key', lambda: None) is None
+    assert cache.get_or_compute('key', lambda: 'value') == 'value'
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_utils.time, 'monotonic', lambda: now[0])
+    cache = ResultCache(ttl=60)
+    cache.put('key', 'value')
+    now[0] += 59
+    assert cache.get('key') == 'value'
+    now[0] += 2
+    assert cache.get('key') is None
+    assert cache.stats()['expirations'] == 1
+
+def test_cache_key_ignores_product_order():
+    start, end = pd.Timestamp('2024-01-01').date(), pd.Timestamp('2024-06-30').date()
+    key = forecast_cache_key(start, end, ['Shirt', 'Belt', 'Hat'], 'token', True)
+    assert key == forecast_cache_key(start, end, ['Hat', 'Shirt', 'Belt'], 'token', True)
+
+@pytest.mark.parametrize('with_total', [False, True])
+def test_reorder_restores_requested_order(with_total):
+    n_periods = 3
+    computed = ['Belt', 'Hat', 'Shirt']
+    requested = ['Shirt', 'Belt', 'Hat']
+    products = np.repeat(computed + ['All'] * with_total, n_periods)
+    forecast_df = pd.DataFrame({'Product': products, 'Forecast': np.arange(len(products), dtype=float)})
+
+    reordered = reorder_forecast_products(forecast_df, computed, requested, n_periods)
+    expected = np.repeat(requested + ['All'] * with_total, n_periods)
+    assert reordered['Product'].tolist() == expected.tolist()
+    assert reordered.groupby('Product')['Forecast'].sum().to_dict() == forecast_df.groupby('Product')['Forecast'].sum().to_dict()
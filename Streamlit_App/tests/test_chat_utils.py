@@ -0,0 +1,65 @@
+# test_chat_utils.py
+#
+# The async backend must stream chunks in order, report a stalled backend as TimeoutError and
+# cancel the request on its event loop.
+#
+#     python -m pytest Streamlit_App/tests
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from chat_utils import AsyncOpenAIBackend
+
+MESSAGES = [{'role': 'user', 'content': 'Sales next month?'}]
+
+# Async stream of completion chunks, as returned by AsyncOpenAI with stream=True
+class FakeResponse:
+    def __init__(self, texts):
+        self.texts = texts
+        self.closed = False
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for text in self.texts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    async def close(self):
+        self.closed = True
+
+# Backend whose client replies with the given texts, or never replies when texts is None
+class StubBackend(AsyncOpenAIBackend):
+    def __init__(self, texts, timeout):
+        super().__init__(timeout=timeout, retries=0)
+        self.texts = texts
+        self.response = None
+        self.cancelled = threading.Event()
+
+    async def _create(self, **kwargs):
+        if self.texts is None:
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                self.cancelled.set()
+                raise
+        self.response = FakeResponse(self.texts)
+        return self.response
+
+    @property
+    def client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._create)))
+
+def test_stream_yields_chunks_and_closes_response():
+    backend = StubBackend(['Sales ', 'rise ', 'in May.'], timeout=5)
+    assert backend.complete(MESSAGES) == 'Sales rise in May.'
+    assert backend.response.closed
+
+def test_stalled_backend_times_out_and_is_cancelled():
+    backend = StubBackend(None, timeout=0.2)
+    with pytest.raises(TimeoutError):
+        backend.complete(MESSAGES)
+    assert backend.cancelled.wait(5)
@@ -0,0 +1,70 @@
+# test_cube_utils.py
+#
+# A cube streamed chunk by chunk, or appended extract by extract, must hold the same cells as the
+# cube built in one pass from the cached columns.
+#
+#     python -m pytest Streamlit_App/tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube_utils
+import data_utils
+from bench_utils import synthetic_transactions
+from cube_utils import CubeStore, SalesCube, chunk_rows_for_budget, stream_sales_cube
+from data_utils import load_sales_columns
+
+N_ROWS = 5000
+
+# Budget small enough to split the test file into many chunks
+MEMORY_BUDGET_MB = 0.05
+
+@pytest.fixture
+def sales_csv(tmp_path):
+    path = tmp_path / 'sales.csv'
+    synthetic_transactions(N_ROWS, np.random.default_rng(3)).to_csv(path, index=False)
+    return str(path)
+
+def cached_cube(csv_path, cache_dir):
+    columns, categories = load_sales_columns(csv_path, str(cache_dir))
+    return SalesCube.from_columns(columns, categories)
+
+# Non-empty cells of each measure keyed by their labels, so cubes with differently ordered axes compare equal
+def cells(cube):
+    index = pd.MultiIndex.from_product([cube.months, cube.items, cube.stores, cube.payments])
+    occupied = cube.measures['count'].ravel() > 0
+    return {
+        name: pd.Series(values.ravel()[occupied], index=index[occupied]).sort_index()
+        for name, values in cube.measures.items()
+    }
+
+def assert_same_cells(actual, expected):
+    actual, expected = cells(actual), cells(expected)
+    for name in expected:
+        pd.testing.assert_series_equal(actual[name], expected[name], check_dtype=False)
+
+def test_streamed_cube_equals_cached_cube(sales_csv, tmp_path):
+    assert chunk_rows_for_budget(sales_csv, MEMORY_BUDGET_MB) < N_ROWS // 4
+
+    streamed, rows = stream_sales_cube(sales_csv, memory_budget_mb=MEMORY_BUDGET_MB)
+    assert rows == N_ROWS
+    assert_same_cells(streamed, cached_cube(sales_csv, tmp_path / 'cache'))
+
+# The first extract is cleaned with its own statistics only, so the comparison is made without cleaning
+def test_store_append_equals_cached_cube(sales_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(cube_utils, 'DATA_CLEANING', False)
+    monkeypatch.setattr(data_utils, 'DATA_CLEANING', False)
+    df = pd.read_csv(sales_csv)
+    first, second = tmp_path / 'first.csv', tmp_path / 'second.csv'
+    df.iloc[:N_ROWS // 2].to_csv(first, index=False)
+    df.iloc[N_ROWS // 2:].to_csv(second, index=False)
+
+    store = CubeStore(str(tmp_path / 'store'))
+    store.append([str(first)], MEMORY_BUDGET_MB)
+    cube, ingested = store.append([str(first), str(second)], MEMORY_BUDGET_MB)
+    assert ingested == [str(second)]
+    assert sum(entry['rows'] for entry in store.ledger().values()) == N_ROWS
+
+    assert_same_cells(SalesCube.load(store.cube_path), cube)
+    assert_same_cells(cube, cached_cube(sales_csv, tmp_path / 'cache'))
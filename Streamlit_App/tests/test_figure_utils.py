@@ -0,0 +1,48 @@
+# test_figure_utils.py
+#
+# Downsampling must keep the point budget, both endpoints and the extremes that give a series
+# its shape, and heatmap rows must group by category and store cluster.
+#
+#     python -m pytest Streamlit_App/tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from figure_utils import downsample, heatmap_levels, heatmap_row_labels, lttb_indices
+
+@pytest.mark.parametrize('n, n_out', [(10, 3), (1000, 50), (1001, 1000), (5000, 500)])
+def test_lttb_keeps_endpoints_and_count(n, n_out):
+    y = np.random.default_rng(n).normal(0, 1, n).cumsum()
+    indices = lttb_indices(y, n_out)
+    assert len(indices) == n_out
+    assert indices[0] == 0 and indices[-1] == n - 1
+    assert (np.diff(indices) > 0).all()
+
+@pytest.mark.parametrize('n_out', [2, 100, 150])
+def test_lttb_keeps_short_series(n_out):
+    y = np.arange(100, dtype=float)
+    assert (lttb_indices(y, n_out) == np.arange(100)).all()
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(1000)
+    y[[137, 512, 870]] = [50.0, -40.0, 30.0]
+    indices = lttb_indices(y, 20)
+    assert {137, 512, 870} <= set(indices.tolist())
+
+def test_downsample_uses_dates():
+    dates = pd.date_range('2020-01-01', periods=2000, freq='D')
+    df = pd.DataFrame({'Date': dates, 'Forecast': np.sin(np.arange(2000) / 50)})
+    reduced = downsample(df, 'Forecast', n_out=200)
+    assert len(reduced) == 200
+    assert reduced['Date'].iloc[0] == dates[0] and reduced['Date'].iloc[-1] == dates[-1]
+    assert reduced['Date'].is_monotonic_increasing
+
+def test_store_cluster_level_needs_store_series():
+    assert heatmap_levels(np.array(['Jeans', 'Belt'])) == ['Category']
+    assert heatmap_levels(np.array(['Jeans @ Store 3', 'Jeans @ Store Unknown'])) == ['Category', 'Store Cluster']
+
+def test_heatmap_rows_group_store_series():
+    products = np.array(['Jeans @ Store 3', 'Skirt @ Store 7', 'Belt @ Store Unknown'])
+    assert heatmap_row_labels(products, 'Category').tolist() == ['Bottoms', 'Bottoms', 'Accessories']
+    assert heatmap_row_labels(products, 'Store Cluster').tolist() == ['Stores 1-5', 'Stores 6-10', 'Store Unknown']
@@ -0,0 +1,82 @@
+# test_forecast_store_utils.py
+#
+# Stored forecasts must read back as written, and a store built from another artifact than the
+# loaded one must not be served.
+#
+#     python -m pytest Streamlit_App/tests
+
+import json
+import os
+from datetime import date
+
+import numpy as np
+import pytest
+
+import forecast_utils
+from forecast_store_utils import META_FILE, STORE_FORMAT, open_forecast_store, write_forecast_store
+from forecast_utils import resource_factors, stored_batch_forecast
+
+SERIES = ['Belt', 'Hat', 'Jeans @ Store 3']
+MAX_HORIZON = 6
+
+# Registry stand-in that reports a fixed token for every version
+class StubRegistry:
+    def __init__(self, token):
+        self.token = token
+
+    def version_token(self, name):
+        return self.token
+
+@pytest.fixture
+def arrays():
+    rng = np.random.default_rng(5)
+    forecast = rng.normal(50, 20, (len(SERIES), MAX_HORIZON))
+    return {'forecast': forecast, 'lower': forecast - 10, 'upper': forecast + 10}
+
+@pytest.fixture
+def store_root(tmp_path, arrays, monkeypatch):
+    root = str(tmp_path)
+    write_forecast_store('v1', 'v1@abc', SERIES, arrays, root)
+    monkeypatch.setattr(forecast_utils, 'open_forecast_store', lambda version: open_forecast_store(version, root))
+    return root
+
+def test_lookup_returns_the_written_arrays(store_root, arrays):
+    store = open_forecast_store('v1', store_root)
+    assert store.meta['format'] == STORE_FORMAT
+    forecast, lower, upper = store.lookup(['Jeans @ Store 3', 'Belt'], 4)
+    np.testing.assert_allclose(forecast, arrays['forecast'][[2, 0], :4], rtol=1e-6)
+    np.testing.assert_allclose(lower, arrays['lower'][[2, 0], :4], rtol=1e-6)
+    np.testing.assert_allclose(upper, arrays['upper'][[2, 0], :4], rtol=1e-6)
+
+def test_lookup_misses(store_root):
+    store = open_forecast_store('v1', store_root)
+    assert store.lookup(['Belt', 'Scarf'], 4) is None
+    assert store.lookup(['Belt'], MAX_HORIZON + 1) is None
+    assert open_forecast_store('v2', store_root) is None
+
+def test_rewritten_store_is_reopened(store_root, arrays):
+    write_forecast_store('v1', 'v1@def', SERIES, arrays, store_root)
+    assert open_forecast_store('v1', store_root).model_token == 'v1@def'
+
+# Stores written before the format field, which also held a staff-hour array, still load
+def test_format_1_store_loads(store_root):
+    meta_path = os.path.join(store_root, 'v1', META_FILE)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    del meta['format']
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    np.save(os.path.join(store_root, 'v1', 'resource.npy'), np.zeros((len(SERIES), MAX_HORIZON)))
+    assert open_forecast_store('v1', store_root).lookup(['Hat'], 2) is not None
+
+def test_stale_store_is_not_served(store_root):
+    start, end = date(2024, 1, 1), date(2024, 3, 31)
+    assert stored_batch_forecast(start, end, ['Belt'], 'v1', StubRegistry('v1@abc')) is not None
+    assert stored_batch_forecast(start, end, ['Belt'], 'v1', StubRegistry('v1@retrained')) is None
+
+def test_staff_hours_derived_at_lookup(store_root):
+    start, end = date(2024, 1, 1), date(2024, 3, 31)
+    forecast_df = stored_batch_forecast(start, end, SERIES, 'v1', StubRegistry('v1@abc'), include_total=False)
+    factors = np.repeat(resource_factors(SERIES), 3)
+    expected = forecast_df['Forecast'].clip(lower=0).to_numpy() * factors
+    np.testing.assert_allclose(forecast_df['Resource Requirement'].to_numpy(), expected)
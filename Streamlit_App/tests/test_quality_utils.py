@@ -0,0 +1,63 @@
+# test_quality_utils.py
+#
+# Streamed statistics must match the exact ones: sketch quantiles to their relative accuracy and
+# merged moments to rounding, however the data is chunked.
+#
+#     python -m pytest Streamlit_App/tests
+
+import json
+
+import numpy as np
+import pytest
+
+from quality_utils import SKETCH_ACCURACY, QuantileSketch, RunningMoments
+
+QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+def chunks(values, n_chunks, seed=0):
+    cuts = np.sort(np.random.default_rng(seed).choice(np.arange(1, len(values)), n_chunks - 1, replace=False))
+    return np.split(values, cuts)
+
+@pytest.fixture(params=['lognormal', 'mixed_sign'])
+def values(request):
+    rng = np.random.default_rng(4)
+    if request.param == 'lognormal':
+        return rng.lognormal(4, 1.2, 100_000)
+    mixed = rng.normal(0, 50, 100_000)
+    mixed[::50] = 0.0
+    return mixed
+
+def test_sketch_quantiles_within_relative_accuracy(values):
+    sketch = QuantileSketch()
+    for chunk in chunks(values, 37):
+        sketch.update(chunk)
+    assert sketch.count == len(values)
+    ordered = np.sort(values)
+    for q in QUANTILES:
+        exact = ordered[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= SKETCH_ACCURACY * abs(exact) + 1e-12
+
+def test_merged_sketch_equals_single_sketch(values):
+    whole = QuantileSketch().update(values)
+    merged = QuantileSketch()
+    for chunk in chunks(values, 11):
+        merged.merge(QuantileSketch().update(chunk))
+    restored = QuantileSketch.from_dict(json.loads(json.dumps(merged.to_dict())))
+    for q in QUANTILES:
+        assert merged.quantile(q) == whole.quantile(q) == restored.quantile(q)
+
+def test_sketches_with_other_accuracy_do_not_merge():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.02))
+
+# A large offset is where the textbook sum-of-squares formula loses the variance
+@pytest.mark.parametrize('offset', [0.0, 1e9])
+def test_merged_moments_match_numpy(values, offset):
+    shifted = values + offset
+    moments = RunningMoments()
+    for chunk in chunks(shifted, 53):
+        moments.merge(RunningMoments().update(chunk))
+    assert moments.count == len(shifted)
+    np.testing.assert_allclose(moments.mean, shifted.mean(), rtol=1e-12)
+    np.testing.assert_allclose(moments.variance, shifted.var(ddof=1), rtol=1e-6)
+    assert moments.minimum == shifted.min() and moments.maximum == shifted.max()
@@ -0,0 +1,92 @@
+# test_reconcile_utils.py
+#
+# Reconciled forecasts must be coherent: every aggregate equals the sum of its children. MinT
+# must match the dense textbook formula it avoids forming, and an artifact set reconciles once
+# for concurrent requests.
+#
+#     python -m pytest Streamlit_App/tests
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import forecast_utils
+from forecast_utils import SeriesModelSet
+from reconcile_utils import Hierarchy, interval_variance, reconcile
+from train_utils import TOTAL_SERIES, series_key
+
+ITEMS = ['Belt', 'Hat', 'Jeans', 'Scarf']
+STORES = (1, 2, 3)
+N_PERIODS = 6
+
+@pytest.fixture
+def hierarchy():
+    keys = [TOTAL_SERIES] + [series_key(item) for item in ITEMS]
+    keys += [series_key(item, store) for item in ITEMS[:3] for store in STORES]
+    return Hierarchy(keys)
+
+def base_forecasts(hierarchy, seed=0):
+    rng = np.random.default_rng(seed)
+    forecasts = rng.normal(100, 40, (len(hierarchy), N_PERIODS))
+    half_width = rng.uniform(5, 60, (len(hierarchy), N_PERIODS))
+    return forecasts, forecasts - half_width, forecasts + half_width
+
+def children(hierarchy, key):
+    return [child for child in hierarchy.nodes if hierarchy.parent[hierarchy.position[child]] == hierarchy.position[key]]
+
+@pytest.mark.parametrize('method', ['mint', 'bottom_up'])
+def test_aggregates_equal_the_sum_of_their_children(hierarchy, method):
+    reconciled, lower, upper = reconcile(hierarchy, *base_forecasts(hierarchy), method=method)
+    for key in [TOTAL_SERIES] + [series_key(item) for item in ITEMS[:3]]:
+        rows = hierarchy.rows(children(hierarchy, key))
+        np.testing.assert_allclose(reconciled[hierarchy.position[key]], reconciled[rows].sum(axis=0), rtol=1e-9)
+    assert (lower <= reconciled).all() and (reconciled <= upper).all()
+
+def test_mint_matches_the_dense_formula(hierarchy):
+    forecasts, lower, upper = base_forecasts(hierarchy, seed=1)
+    reconciled, reconciled_lower, reconciled_upper = reconcile(hierarchy, forecasts, lower, upper, method='mint')
+    variance = interval_variance(lower, upper)
+    reconciled_variance = interval_variance(reconciled_lower, reconciled_upper)
+    C = hierarchy.C.toarray()
+    for h in range(N_PERIODS):
+        W = np.diag(variance[:, h])
+        projection = np.eye(len(hierarchy)) - W @ C.T @ np.linalg.solve(C @ W @ C.T, C)
+        np.testing.assert_allclose(reconciled[:, h], projection @ forecasts[:, h], rtol=1e-9)
+        np.testing.assert_allclose(reconciled_variance[:, h], np.diag(projection @ W @ projection.T), rtol=1e-6)
+
+# An item whose store series were not all fitted is not forced to equal the ones that were
+def test_incomplete_parent_is_unconstrained():
+    every_series = [TOTAL_SERIES, series_key('Hat'), series_key('Hat', 1), series_key('Hat', 2)]
+    hierarchy = Hierarchy([TOTAL_SERIES, series_key('Hat'), series_key('Hat', 1)], every_series)
+    forecasts, lower, upper = base_forecasts(hierarchy)
+    reconciled, _, _ = reconcile(hierarchy, forecasts, lower, upper)
+    assert hierarchy.parent[hierarchy.position[series_key('Hat', 1)]] == -1
+    np.testing.assert_allclose(reconciled[hierarchy.position[TOTAL_SERIES]], reconciled[hierarchy.position[series_key('Hat')]])
+    np.testing.assert_allclose(reconciled[hierarchy.position[series_key('Hat', 1)]], forecasts[hierarchy.position[series_key('Hat', 1)]])
+
+# Concurrent requests on one artifact set share a single reconciliation
+def test_concurrent_requests_reconcile_once(hierarchy, monkeypatch):
+    class StubStateSpace:
+        def forecast(self, n_periods, keys):
+            time.sleep(0.1)
+            forecasts, lower, upper = base_forecasts(hierarchy)
+            return forecasts[:, :n_periods], lower[:, :n_periods], upper[:, :n_periods]
+
+    calls = []
+    def counting_reconcile(*args, **kwargs):
+        calls.append(1)
+        return reconcile(*args, **kwargs)
+    monkeypatch.setattr(forecast_utils, 'reconcile', counting_reconcile)
+
+    model_set = SeriesModelSet({'version': 'test', 'series': {}}, {})
+    model_set._hierarchy, model_set._state_space = hierarchy, StubStateSpace()
+    threads = [threading.Thread(target=model_set.reconciled_forecast, args=(3, 'mint')) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert model_set.reconciled_forecast(2, 'mint')[0].shape == (len(hierarchy), 2)
+    assert len(calls) == 1
@@ -0,0 +1,100 @@
+# test_service_utils.py
+#
+# The forecast service must answer a batch of (product, start, end) requests with the rows the
+# dashboard would compute itself, and report failures as JSON errors.
+#
+#     python -m pytest Streamlit_App/tests
+
+import socket
+import threading
+from datetime import date
+
+import joblib
+import numpy as np
+import pytest
+
+pm = pytest.importorskip('pmdarima')
+
+import service_utils
+from forecast_utils import generate_batch_forecast
+from service_utils import ForecastClient, make_server
+
+VERSION = 'test_model'
+PRODUCTS = ['Jeans', 'Footwear']
+
+@pytest.fixture(scope='module')
+def model():
+    rng = np.random.default_rng(11)
+    months = np.arange(48)
+    values = 100 + 15 * np.sin(2 * np.pi * months / 12) + rng.normal(0, 3, len(months))
+    return pm.ARIMA(order=(1, 0, 0), seasonal_order=(0, 0, 0, 0)).fit(values)
+
+@pytest.fixture
+def service(tmp_path, monkeypatch, model):
+    # No model files or forecast store in the working directory besides the test model
+    monkeypatch.chdir(tmp_path)
+    joblib.dump(model, tmp_path / f"{VERSION}.pkl")
+    server = make_server(port=0)
+    server.RequestHandlerClass.service.registry.register(VERSION, str(tmp_path / f"{VERSION}.pkl"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = ForecastClient(f"http://127.0.0.1:{server.server_address[1]}", timeout=10)
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+def test_forecast_matches_local_batch(service, model):
+    start, end = date(2024, 1, 1), date(2024, 6, 30)
+    forecast_df = service.batch_forecast(start, end, PRODUCTS, VERSION, include_total=True)
+    expected = generate_batch_forecast(start, end, PRODUCTS, model, include_total=True)
+    assert forecast_df['Product'].tolist() == expected['Product'].tolist()
+    assert (forecast_df['Date'].to_numpy() == expected['Date'].to_numpy()).all()
+    for column in ('Forecast', 'Lower CI', 'Upper CI', 'Resource Requirement'):
+        np.testing.assert_allclose(forecast_df[column], expected[column], atol=1e-4)
+
+def test_requests_grouped_by_date_range(service):
+    requests = [
+        ('Jeans', '2024-01-01', '2024-03-31'),
+        ('Footwear', '2024-01-01', '2024-06-30'),
+        ('Jeans', '2024-01-01', '2024-06-30'),
+    ]
+    response = service.forecast(requests, VERSION)
+    columns = response['columns']
+    assert response['ranges'] == [['2024-01-01', '2024-03-31'], ['2024-01-01', '2024-06-30']]
+    assert [columns['request'].count(i) for i in range(len(requests))] == [3, 6, 6]
+    rows = [i for i, request in enumerate(columns['request']) if request == 1]
+    assert {columns['product'][i] for i in rows} == {'Footwear'}
+
+def test_version_token_stable_across_loading(service):
+    before = service.versions()['tokens'][VERSION]
+    service.forecast([('Jeans', '2024-01-01', '2024-03-31')], VERSION)
+    assert before.startswith(f"{VERSION}@")
+    assert service.versions()['tokens'][VERSION] == before
+
+def test_unknown_version_is_not_found(service):
+    with pytest.raises(RuntimeError, match='404'):
+        service.forecast([('Jeans', '2024-01-01', '2024-03-31')], 'missing_model')
+
+def test_failed_forecast_is_unavailable(service, monkeypatch):
+    monkeypatch.setattr(service_utils, 'version_batch_forecast', lambda *args: None)
+    with pytest.raises(RuntimeError, match='503'):
+        service.forecast([('Jeans', '2024-01-01', '2024-03-31')], VERSION)
+
+# A timed-out request may already be running on the server, so it must not be sent again
+def test_timeout_is_not_retried():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(4)
+    client = ForecastClient(f"http://127.0.0.1:{listener.getsockname()[1]}", timeout=0.2, retries=2)
+    try:
+        with pytest.raises(TimeoutError):
+            client.forecast([('Jeans', '2024-01-01', '2024-03-31')])
+        listener.settimeout(0.2)
+        connection, _ = listener.accept()
+        connection.close()
+        with pytest.raises(socket.timeout):
+            listener.accept()
+    finally:
+        client.close()
+        listener.close()
@@ -0,0 +1,47 @@
+# test_staffing_utils.py
+#
+# Quantiles read off the simulation's histograms must agree with exact quantiles of the same
+# samples to within a bin, and the simulated staff hours with the forecast distribution.
+#
+#     python -m pytest Streamlit_App/tests
+
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+from staffing_utils import STAFFING_QUANTILES, histogram_quantiles, simulate_staffing
+
+N_BINS = 512
+
+@pytest.mark.parametrize('distribution', ['normal', 'gamma', 'uniform'])
+def test_histogram_quantiles_match_np_quantile(distribution):
+    rng = np.random.default_rng(2)
+    samples = {
+        'normal': lambda size: rng.normal(40, 8, size),
+        'gamma': lambda size: rng.gamma(2.0, 15.0, size),
+        'uniform': lambda size: rng.uniform(10, 90, size),
+    }[distribution]((3, 50_000))
+    low = samples.min(axis=1)
+    width = (samples.max(axis=1) - low) / N_BINS
+    bins = np.clip(((samples - low[:, None]) / width[:, None]).astype(int), 0, N_BINS - 1)
+    counts = np.stack([np.bincount(row, minlength=N_BINS) for row in bins])
+
+    quantiles = (0.05, 0.5, 0.9, 0.95, 0.99)
+    result = histogram_quantiles(counts, low, width, quantiles)
+    expected = np.quantile(samples, quantiles, axis=1).T
+    assert np.all(np.abs(result - expected) <= width[:, None])
+
+def test_simulated_quantiles_match_the_forecast_distribution():
+    forecasts = np.array([[100.0, 200.0], [50.0, 80.0]])
+    half_width = np.array([[20.0, 30.0], [10.0, 12.0]])
+    factors = np.array([0.1, 0.2])
+    result = simulate_staffing(forecasts, forecasts - half_width, forecasts + half_width, factors,
+                               ['Store 1', 'Store 2'], n_scenarios=200_000, seed=0)
+
+    assert result['groups'] == ['Store 1', 'Store 2', 'Total']
+    sigma = half_width / norm.ppf(0.975)
+    z = norm.ppf(STAFFING_QUANTILES)
+    expected = (factors[:, None, None] * (forecasts[:, :, None] + sigma[:, :, None] * z))
+    np.testing.assert_allclose(result['quantiles'][:2], expected, rtol=0.01)
+    np.testing.assert_allclose(result['mean'][:2], factors[:, None] * forecasts, rtol=0.01)
+    np.testing.assert_allclose(result['mean'][2], (factors[:, None] * forecasts).sum(axis=0), rtol=0.01)
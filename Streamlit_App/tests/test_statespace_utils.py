@@ -0,0 +1,57 @@
+# test_statespace_utils.py
+#
+# The vectorized engine must give the same forecasts and intervals as predicting each model.
+#
+#     python -m pytest Streamlit_App/tests
+
+import numpy as np
+import pytest
+
+pm = pytest.importorskip('pmdarima')
+
+from statespace_utils import StateSpaceBatch
+
+# Largest relative difference allowed, as in bench_utils
+TOLERANCE = 1e-6
+
+N_OBS = 60
+
+# Small fixed-order models of different state dimensions, fitted to seeded monthly series
+@pytest.fixture(scope='module')
+def models():
+    rng = np.random.default_rng(7)
+    months = np.arange(N_OBS)
+    seasonal = 100 + 20 * np.sin(2 * np.pi * months / 12) + rng.normal(0, 5, N_OBS)
+    trending = np.cumsum(rng.normal(1, 3, N_OBS)) + 50
+    noisy = 30 + rng.normal(0, 4, N_OBS)
+    return {
+        'Seasonal': pm.ARIMA(order=(1, 0, 0), seasonal_order=(1, 0, 0, 12)).fit(seasonal),
+        'Trending': pm.ARIMA(order=(1, 1, 1), seasonal_order=(0, 0, 0, 0)).fit(trending),
+        'Noisy': pm.ARIMA(order=(0, 0, 1), seasonal_order=(0, 0, 0, 0)).fit(noisy),
+    }
+
+def assert_close(actual, expected):
+    expected = np.asarray(expected, dtype=float)
+    error = np.max(np.abs(actual - expected) / np.maximum(np.abs(expected), 1.0))
+    assert error <= TOLERANCE
+
+@pytest.mark.parametrize('n_periods', [1, 3, 24])
+def test_forecast_matches_predict(models, n_periods):
+    batch = StateSpaceBatch(models)
+    assert not batch.fallback
+    forecasts, lower, upper = batch.forecast(n_periods, max_workers=1)
+    for i, model in enumerate(models.values()):
+        forecast, conf_int = model.predict(n_periods=n_periods, return_conf_int=True)
+        assert_close(forecasts[i], forecast)
+        assert_close(lower[i], conf_int[:, 0])
+        assert_close(upper[i], conf_int[:, 1])
+
+def test_forecast_keys_select_and_repeat(models):
+    batch = StateSpaceBatch(models)
+    keys = ['Noisy', 'Seasonal', 'Noisy']
+    forecasts, lower, upper = batch.forecast(6, keys, max_workers=1)
+    for i, key in enumerate(keys):
+        forecast, conf_int = models[key].predict(n_periods=6, return_conf_int=True)
+        assert_close(forecasts[i], forecast)
+        assert_close(lower[i], conf_int[:, 0])
+        assert_close(upper[i], conf_int[:, 1])
@@ -0,0 +1,391 @@
+# train_utils.py
+#
+# Fits one AutoARIMA model per item (and optionally per item and store) in parallel
+# and writes them as a versioned artifact set the dashboard can load:
+#
+#     python train_utils.py --by-store --workers 8
+
+import os
+import re
+import json
+import time
+import zlib
+import shutil
+import argparse
+import traceback
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import joblib
+import numpy as np
+import pandas as pd
+from data_utils import SALES_CSV, MISSING_STORE
+from cube_utils import load_sales_cube
+from quality_utils import DATA_CLEANING
+
+# Where artifact sets are written, one sub-directory per version
+ARTIFACT_DIR = os.getenv('ARTIFACT_DIR', 'models')
+
+# Manifest describing the models of an artifact set
+MANIFEST_FILE = 'manifest.json'
+
+# Pointer to the most recently trained artifact set
+LATEST_FILE = 'LATEST'
+
+# Series key of the model fitted on total sales
+TOTAL_SERIES = 'All Products'
+
+# Same search settings as the notebook's autoarima_model
+DEFAULT_ARIMA_PARAMS = {
+    'seasonal': True,
+    'm': 12,
+    'stepwise': True,
+    'suppress_warnings': True,
+    'error_action': 'ignore',
+}
+
+# Series with fewer monthly observations than this are not fitted
+MIN_OBSERVATIONS = 12
+
+# Mean absolute error on the new months, in residual standard deviations, above which a series is refit
+DRIFT_THRESHOLD = float(os.getenv('DRIFT_THRESHOLD', '3.0'))
+
+# Days between full order searches; refreshes in between only update the fitted models
+FULL_SEARCH_DAYS = int(os.getenv('FULL_SEARCH_DAYS', '30'))
+
+# Store label of the transactions without a Store ID
+UNKNOWN_STORE = 'Unknown'
+
+# Display name of a store, e.g. "Store 3" or "Store Unknown"
+def store_label(store):
+    return f"Store {UNKNOWN_STORE if store == MISSING_STORE else int(store)}"
+
+# Key identifying an item or item/store series
+def series_key(item, store=None):
+    if store is None:
+        return item
+    return f"{item} @ {store_label(store)}"
+
+# Item and store (None for item-level series, MISSING_STORE for sales without a Store ID) of a series key
+def parse_series_key(key):
+    item, separator, store = key.partition(' @ Store ')
+    if not separator:
+        return item, None
+    return item, MISSING_STORE if store == UNKNOWN_STORE else int(store)
+
+# File name for a series model that is safe on every filesystem
+def series_file_name(key):
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', key).strip('_').lower()
+    return f"{slug}_{zlib.crc32(key.encode('utf-8')):08x}.pkl"
+
+# Monthly sales series for the total, every item and optionally every item/store pair
+def build_series(cube, by_store=False):
+    # The cube is dense, so months without sales are already zero
+    series = {TOTAL_SERIES: cube.monthly_sales()}
+    meta = {TOTAL_SERIES: {'item': None, 'store': None}}
+
+    by_item = cube.rollup(('item', 'month')).unstack('month')
+    for item, values in by_item.iterrows():
+        key = series_key(item)
+        series[key] = values
+        meta[key] = {'item': item, 'store': None}
+
+    # Sales without a Store ID get their own "Store Unknown" series, so the store series of an
+    # item add up to the item
+    if by_store:
+        by_item_store = cube.rollup(('item', 'store', 'month')).unstack('month')
+        for (item, store), values in by_item_store.iterrows():
+            if values.any():
+                key = series_key(item, store)
+                series[key] = values
+                meta[key] = {'item': item, 'store': int(store)}
+
+    return series, meta
+
+# Fit one series in a worker process; errors are returned instead of raised so one bad series cannot stop the run
+def fit_series(key, values, arima_params):
+    import pmdarima as pm
+
+    start = time.perf_counter()
+    try:
+        model = pm.auto_arima(values, **arima_params)
+        return {'key': key, 'model': model, 'seconds': time.perf_counter() - start, 'error': None}
+    except Exception:
+        return {'key': key, 'model': None, 'seconds': time.perf_counter() - start, 'error': traceback.format_exc()}
+
+# Update a fitted model with new observations in a worker process, keeping its orders,
+# unless its forecast for those observations has drifted too far
+def update_series(key, model_path, values, drift_threshold):
+    start = time.perf_counter()
+    try:
+        model = joblib.load(model_path)
+        forecast = np.asarray(model.predict(n_periods=len(values)), dtype=float)
+        residual_scale = float(np.std(model.resid())) or 1.0
+        drift = float(np.mean(np.abs(values - forecast)) / residual_scale)
+        if drift > drift_threshold:
+            return {'key': key, 'model': None, 'drift': drift, 'seconds': time.perf_counter() - start, 'error': None}
+        model.update(values)
+        return {'key': key, 'model': model, 'drift': drift, 'seconds': time.perf_counter() - start, 'error': None}
+    except Exception:
+        return {'key': key, 'model': None, 'drift': None, 'seconds': time.perf_counter() - start, 'error': traceback.format_exc()}
+
+# Manifest entry of a series before it is fitted
+def new_entry(meta, values):
+    return {
+        **meta,
+        'file': None,
+        'n_obs': int(len(values)),
+        'last_period': str(values.index[-1]),
+        'status': 'skipped',
+        'fit_seconds': 0.0,
+        'error': None,
+    }
+
+def has_enough_observations(values, min_observations):
+    return int((values != 0).sum()) >= min_observations
+
+# Record a worker result in the manifest entry and save its model
+def save_fit_result(entry, future, version_dir):
+    try:
+        result = future.result()
+    except Exception as e:
+        # A crashed worker only fails its own series
+        entry.update(status='failed', error=repr(e))
+        return None
+
+    entry['fit_seconds'] = round(entry['fit_seconds'] + result['seconds'], 4)
+    if result['model'] is None:
+        entry.update(status='failed', error=result['error'])
+        return result
+
+    file_name = series_file_name(result['key'])
+    joblib.dump(result['model'], os.path.join(version_dir, file_name))
+    entry.update(
+        status='ok',
+        file=file_name,
+        error=None,
+        order=list(result['model'].order),
+        seasonal_order=list(result['model'].seasonal_order),
+    )
+    return result
+
+# Directory for a new artifact set version
+def new_version_dir(output_dir):
+    version = datetime.now().strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(os.path.join(output_dir, version)):
+        version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        suffix += 1
+    version_dir = os.path.join(output_dir, version)
+    os.makedirs(version_dir)
+    return version, version_dir
+
+# Manifest of the artifact set LATEST points to, if any
+def read_latest_manifest(output_dir=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(output_dir, LATEST_FILE)) as f:
+            version = f.read().strip()
+        with open(os.path.join(output_dir, version, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Write the manifest and point LATEST at the new version
+def publish_manifest(output_dir, manifest):
+    write_json(os.path.join(output_dir, manifest['version'], MANIFEST_FILE), manifest)
+    write_text(os.path.join(output_dir, LATEST_FILE), manifest['version'])
+    return manifest
+
+# Fit every series across a process pool and write the artifact set
+def train_models(csv_path=SALES_CSV, output_dir=ARTIFACT_DIR, by_store=False, max_workers=None,
+                 arima_params=None, min_observations=MIN_OBSERVATIONS):
+    arima_params = {**DEFAULT_ARIMA_PARAMS, **(arima_params or {})}
+    version, version_dir = new_version_dir(output_dir)
+
+    series, meta = build_series(load_sales_cube(csv_path), by_store=by_store)
+    run_start = time.perf_counter()
+    entries = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        futures = {}
+        for key, values in series.items():
+            entries[key] = new_entry(meta[key], values)
+            if not has_enough_observations(values, min_observations):
+                entries[key]['error'] = f'fewer than {min_observations} months with sales'
+                continue
+            futures[pool.submit(fit_series, key, values.to_numpy(dtype=float), arima_params)] = key
+
+        for future in as_completed(futures):
+            save_fit_result(entries[futures[future]], future, version_dir)
+
+    created_at = datetime.now().isoformat(timespec='seconds')
+    return publish_manifest(output_dir, {
+        'version': version,
+        'created_at': created_at,
+        'last_full_search': created_at,
+        'source': os.path.abspath(csv_path),
+        'data_cleaning': DATA_CLEANING,
+        'by_store': by_store,
+        'arima_params': arima_params,
+        'wall_seconds': round(time.perf_counter() - run_start, 4),
+        'series': entries,
+    })
+
+# Bring the latest artifact set up to date with the months that arrived since it was trained.
+# Fitted models are updated with only the new observations; the full order search runs when
+# the schedule says so, for drifted series and for series that had no model yet. A series whose
+# update fails keeps its previous model.
+def refresh_models(csv_path=SALES_CSV, output_dir=ARTIFACT_DIR, max_workers=None,
+                   drift_threshold=DRIFT_THRESHOLD, full_search_days=FULL_SEARCH_DAYS,
+                   min_observations=MIN_OBSERVATIONS):
+    previous = read_latest_manifest(output_dir)
+    if previous is None:
+        return train_models(csv_path, output_dir, max_workers=max_workers, min_observations=min_observations)
+
+    arima_params = previous['arima_params']
+    last_full_search = datetime.fromisoformat(previous.get('last_full_search', previous['created_at']))
+    if datetime.now() - last_full_search >= timedelta(days=full_search_days):
+        return train_models(csv_path, output_dir, by_store=previous['by_store'], max_workers=max_workers,
+                            arima_params=arima_params, min_observations=min_observations)
+
+    series, meta = build_series(load_sales_cube(csv_path), by_store=previous['by_store'])
+    previous_dir = os.path.join(output_dir, previous['version'])
+    version, version_dir = new_version_dir(output_dir)
+    run_start = time.perf_counter()
+    entries = {}
+    refits = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        updates = {}
+        for key, values in series.items():
+            entry = entries[key] = new_entry(meta[key], values)
+            old_entry = previous['series'].get(key)
+            if old_entry is None or old_entry['status'] != 'ok':
+                if has_enough_observations(values, min_observations):
+                    refits[key] = values
+                else:
+                    entry['error'] = f'fewer than {min_observations} months with sales'
+                continue
+
+            entry.update(
+                status='ok',
+                file=old_entry['file'],
+                order=old_entry['order'],
+                seasonal_order=old_entry['seasonal_order'],
+                refresh='unchanged',
+            )
+            new_values = values[values.index > pd.Period(old_entry['last_period'], freq='M')]
+            if len(new_values) == 0:
+                # Nothing new: reuse the previous model file
+                link_or_copy(os.path.join(previous_dir, old_entry['file']), os.path.join(version_dir, old_entry['file']))
+                continue
+
+            future = pool.submit(
+                update_series, key, os.path.join(previous_dir, old_entry['file']),
+                new_values.to_numpy(dtype=float), drift_threshold
+            )
+            updates[future] = key
+
+        drifted = {}
+        for future in as_completed(updates):
+            key = updates[future]
+            entry = entries[key]
+            result = save_fit_result(entry, future, version_dir)
+            if result is None or result['error'] is not None:
+                keep_previous_model(entry, previous['series'][key], previous_dir, version_dir)
+                continue
+            entry['drift'] = result['drift']
+            if result['model'] is not None:
+                entry['refresh'] = 'updated'
+            else:
+                # Drifted: fall back to a full order search on the whole series. The previous model
+                # stays in place until the refit succeeds.
+                drifted[key] = previous['series'][key]
+                refits[key] = series[key]
+
+        futures = {
+            pool.submit(fit_series, key, values.to_numpy(dtype=float), arima_params): key
+            for key, values in refits.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            entry = entries[key]
+            result = save_fit_result(entry, future, version_dir)
+            if key in drifted and (result is None or result['model'] is None):
+                keep_previous_model(entry, drifted[key], previous_dir, version_dir)
+            else:
+                entry['refresh'] = 'refit'
+
+    return publish_manifest(output_dir, {
+        'version': version,
+        'parent': previous['version'],
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'last_full_search': last_full_search.isoformat(timespec='seconds'),
+        'source': os.path.abspath(csv_path),
+        'data_cleaning': DATA_CLEANING,
+        'by_store': previous['by_store'],
+        'arima_params': arima_params,
+        'wall_seconds': round(time.perf_counter() - run_start, 4),
+        'series': entries,
+    })
+
+# Carry the previous model of a series into the new version after its update or refit failed,
+# keeping the error. The model has not seen the new months, so the next refresh tries them again.
+def keep_previous_model(entry, old_entry, previous_dir, version_dir):
+    link_or_copy(os.path.join(previous_dir, old_entry['file']), os.path.join(version_dir, old_entry['file']))
+    entry.update(
+        status='ok',
+        file=old_entry['file'],
+        order=old_entry['order'],
+        seasonal_order=old_entry['seasonal_order'],
+        n_obs=old_entry['n_obs'],
+        last_period=old_entry['last_period'],
+        refresh='kept',
+    )
+
+# Hard link unchanged model files into a new version, copying where links are not supported
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+# Write through a temporary file so readers never see a partial file
+def write_text(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def write_json(path, data):
+    write_text(path, json.dumps(data, indent=2, default=str))
+
+def main():
+    parser = argparse.ArgumentParser(description='Train per-item AutoARIMA models in parallel.')
+    parser.add_argument('--csv', default=SALES_CSV, help='transactions CSV')
+    parser.add_argument('--output-dir', default=ARTIFACT_DIR, help='artifact root directory')
+    parser.add_argument('--by-store', action='store_true', help='also fit one model per item and store')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='update the latest artifact set with new months instead of retraining')
+    parser.add_argument('--drift-threshold', type=float, default=DRIFT_THRESHOLD,
+                        help='scaled forecast error on new months that triggers a refit')
+    parser.add_argument('--full-search-days', type=int, default=FULL_SEARCH_DAYS,
+                        help='days between scheduled full order searches')
+    args = parser.parse_args()
+
+    if args.refresh:
+        manifest = refresh_models(args.csv, args.output_dir, max_workers=args.workers,
+                                  drift_threshold=args.drift_threshold, full_search_days=args.full_search_days)
+    else:
+        manifest = train_models(args.csv, args.output_dir, by_store=args.by_store, max_workers=args.workers)
+    statuses = [entry['status'] for entry in manifest['series'].values()]
+    refreshes = [entry.get('refresh') for entry in manifest['series'].values()]
+    print(f"Artifact set {manifest['version']} written to {os.path.join(args.output_dir, manifest['version'])}")
+    print(f"ok: {statuses.count('ok')}  failed: {statuses.count('failed')}  skipped: {statuses.count('skipped')}  "
+          f"wall time: {manifest['wall_seconds']:.1f}s")
+    if 'parent' in manifest:
+        print(f"unchanged: {refreshes.count('unchanged')}  updated: {refreshes.count('updated')}  "
+              f"refit: {refreshes.count('refit')}  kept after a failed update: {refreshes.count('kept')}")
+
+if __name__ == '__main__':
+    main()